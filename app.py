@@ -17,8 +17,11 @@ sys.path.append(os.path.join(ROOT_DIR, "backend"))
 sys.path.append(os.path.join(ROOT_DIR, "env"))
 
 import app_config as env
-from backend import tuya_client
-from backend import storage_manager
+# Import the backend modules by their top-level names (backend/ is on sys.path), the same
+# way they import each other, so the dashboard reads the same storage_manager instance
+# the ingest threads write to.
+import tuya_client
+import storage_manager
 from dashboard.dashboard import dashboard_page
 from dashboard.history import history_page
 from streamlit_autorefresh import st_autorefresh
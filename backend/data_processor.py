@@ -2,6 +2,8 @@
 import json
 import time
 import datetime  # Import datetime for timestamp comparison
+import functools
+import threading
 
 # --- DP Definitions (Keep as is) ---
 # ... (DP_SPECS, interpret_fault_bitmap) ...
@@ -36,20 +38,131 @@ DP_SPECS = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def _bitmap_byte_tables(labels):
+    """For each byte of the bitmap, a 256-entry table: byte value -> tuple of the labels its set bits stand for."""
+    tables = []
+    for byte_index in range((len(labels) + 7) // 8):
+        byte_labels = labels[byte_index * 8:byte_index * 8 + 8]
+        tables.append(tuple(
+            tuple(label for bit, label in enumerate(byte_labels) if (byte_value >> bit) & 1)
+            for byte_value in range(256)
+        ))
+    return tuple(tables)
+
+
+def decode_fault_bitmap(value, labels):
+    """Active alarm codes of a bitmap value, lowest bit first (one table lookup per byte)."""
+    active_alarms = ()
+    for byte_index, table in enumerate(_bitmap_byte_tables(tuple(labels))):
+        byte_value = (value >> (byte_index * 8)) & 0xFF
+        if byte_value:
+            active_alarms += table[byte_value]
+    return active_alarms
+
+
 def interpret_fault_bitmap(value, labels):
     if not isinstance(value, int):
         return f"Unknown fault value type: {value}"
-    active_alarms = []
-    for i, label in enumerate(labels):
-        if (value >> i) & 1:
-            active_alarms.append(label)
+    active_alarms = decode_fault_bitmap(value, labels)
     if not active_alarms:
         return "No active faults"
     return ", ".join(active_alarms)
 
 
-# --- Global variable to store the last known state of critical DPs ---
-_last_known_device_state = {
+# --- DP records ---
+# How each DP type is shown; only evaluated when a record's display value is read.
+_DISPLAY_FORMATTERS = {
+    "Integer": lambda value, unit: f"{value} {unit}",
+    "Boolean": lambda value, unit: value,
+    "Bitmap": lambda value, unit: value,
+    "Raw": lambda value, unit: f"{value} (Raw Data)",
+    "Unknown": lambda value, unit: value,
+}
+
+
+def _format_other(value, unit):
+    return str(value)
+
+
+class DpRecord:
+    """One decoded DP value. Reads like the record dicts it replaces (record["dp_code"], .get, keys)."""
+    __slots__ = ("timestamp", "device_id", "dp_code", "dp_name", "dp_value_save", "dp_unit", "dp_type", "_display")
+
+    FIELDS = ("timestamp", "device_id", "dp_code", "dp_name", "dp_value_display", "dp_value_save", "dp_unit",
+              "dp_type")
+
+    def __init__(self, timestamp, device_id, dp_code, dp_name, dp_value_save, dp_unit, dp_type, display=None):
+        self.timestamp = timestamp
+        self.device_id = device_id
+        self.dp_code = dp_code
+        self.dp_name = dp_name
+        self.dp_value_save = dp_value_save
+        self.dp_unit = dp_unit
+        self.dp_type = dp_type
+        self._display = display
+
+    @property
+    def dp_value_display(self):
+        if self._display is None:
+            formatter = _CODE_DISPLAY_FORMATTERS.get(self.dp_code) or _DISPLAY_FORMATTERS.get(self.dp_type,
+                                                                                               _format_other)
+            self._display = formatter(self.dp_value_save, self.dp_unit)
+        return self._display
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def __repr__(self):
+        return f"DpRecord({self.to_dict()!r})"
+
+
+# --- DP decoders compiled from DP_SPECS at import ---
+# dp_code -> (decode(raw) -> saved value, name, unit, type)
+# Bitmap DPs keep the raw integer as their saved value (queryable as a number); their
+# display text and fault events are derived from it through the label tables.
+_CODE_DISPLAY_FORMATTERS = {}
+_BITMAP_LABELS = {}  # dp_code -> labels, for the Bitmap DPs
+
+
+def _compile_decoder(dp_code, dp_info):
+    dp_type = dp_info["type"]
+    if dp_type == "Integer":
+        scale = dp_info.get("scale", 1)
+        decode = lambda raw: round(raw / scale, 3)
+    elif dp_type == "Boolean":
+        decode = lambda raw: "ON" if raw else "OFF"
+    elif dp_type == "Bitmap":
+        labels = tuple(dp_info.get("labels", []))
+        _BITMAP_LABELS[dp_code] = labels
+        _CODE_DISPLAY_FORMATTERS[dp_code] = lambda value, unit: interpret_fault_bitmap(value, labels)
+        decode = lambda raw: raw
+    else:
+        decode = lambda raw: raw
+    return decode, dp_info["name"], dp_info.get("unit", ""), dp_type
+
+
+_DP_DECODERS = {code: _compile_decoder(code, info) for code, info in DP_SPECS.items()}
+
+
+@functools.lru_cache(maxsize=256)  # all DPs of a message, and repeated polls, share a timestamp
+def _parse_timestamp(timestamp):
+    return datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+
+
+# --- Last known state of the critical DPs, before any data arrives ---
+_INITIAL_DEVICE_STATE = {
     "switch": "N/A",  # Default for Breaker Switch
     "output_voltage": "N/A",
     "supply_frequency": "N/A",
@@ -58,45 +171,128 @@ _last_known_device_state = {
     "power_factor": "N/A",
 }
 
-# --- Global variable to store the last timestamp when *actual* data was received ---
-# This helps detect stale data.
-_last_actual_data_timestamp = None
+_OFFLINE_DEVICE_STATE = {
+    "switch": "OFF",
+    "output_voltage": 0.0,
+    "supply_frequency": 0.0,
+    "output_current": 0.0,
+    "output_power": 0.0,
+    "power_factor": 0.0,
+}
+
+
+# --- Per-device state store ---
+# MQTT workers and pollers update devices concurrently. Each device has its own lock for
+# writers; `latest` is replaced with a new dict on every update and never mutated after
+# that, so readers take it without locking.
+class DeviceState:
+    __slots__ = ("lock", "latest", "active_faults", "last_actual_data_timestamp", "last_gs_snapshot_sent")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = dict(_INITIAL_DEVICE_STATE)
+        self.active_faults = {}  # Bitmap dp_code -> tuple of active alarm codes (replaced, never mutated)
+        self.last_actual_data_timestamp = None  # when *actual* data was last received; helps detect stale data
+        self.last_gs_snapshot_sent = {}  # last snapshot sent to Google Sheets
+
+
+_device_states = {}
+_device_states_lock = threading.Lock()
+
+
+def _get_device_state(device_id):
+    state = _device_states.get(device_id)
+    if state is None:
+        with _device_states_lock:
+            state = _device_states.setdefault(device_id, DeviceState())
+    return state
+
+
+def get_latest_state(device_id):
+    """Last known critical DP values of one device (read-only dict)."""
+    state = _device_states.get(device_id)
+    return state.latest if state is not None else dict(_INITIAL_DEVICE_STATE)
+
+
+def get_active_faults(device_id):
+    """{bitmap dp_code: tuple of active alarm codes} for one device, as last reported."""
+    state = _device_states.get(device_id)
+    return state.active_faults if state is not None else {}
+
+
+def _fault_transitions(device_id, timestamp, dp_code, bitmap, previous, current):
+    """Fault events for alarms that became active or cleared between two bitmap reports."""
+    events = [{"timestamp": timestamp, "device_id": device_id, "dp_code": dp_code, "fault_code": code,
+               "event": "raised", "bitmap": bitmap} for code in current if code not in previous]
+    events += [{"timestamp": timestamp, "device_id": device_id, "dp_code": dp_code, "fault_code": code,
+                "event": "cleared", "bitmap": bitmap} for code in previous if code not in current]
+    return events
+
 
-# --- Global variable to store the last snapshot sent to Google Sheets ---
-_last_gs_snapshot_sent = {}
+# Snapshot column -> DP code whose deadband rule applies to it
+_SNAPSHOT_COLUMN_DPS = (
+    ("Breaker Switch", "switch"),
+    ("Voltage (V)", "output_voltage"),
+    ("Frequency (Hz)", "supply_frequency"),
+    ("Current (A)", "output_current"),
+    ("Active Power (kW)", "output_power"),
+    ("Power Factor", "power_factor"),
+)
+
+
+def claim_sheets_snapshot(snapshot_data, rules, epoch_ts):
+    """True if the snapshot is due for Google Sheets, in which case it is remembered as the last one sent.
+
+    A snapshot is due when any column moved past its DP's deadband, or a column's heartbeat
+    ran out, since the last snapshot sent for the device (`rules` is a deadband.DeadbandRules).
+    """
+    state = _get_device_state(snapshot_data['device_id'])
+    with state.lock:
+        last_sent = state.last_gs_snapshot_sent
+        last_ts = last_sent.get("epoch_ts")
+        if not any(rules.is_due(dp_code, last_sent.get(column), last_ts, snapshot_data[column], epoch_ts)
+                   for column, dp_code in _SNAPSHOT_COLUMN_DPS):
+            return False
+        sent = {column: snapshot_data[column] for column, _ in _SNAPSHOT_COLUMN_DPS}
+        sent["epoch_ts"] = epoch_ts
+        state.last_gs_snapshot_sent = sent
+        return True
+
+
+def get_all_latest():
+    """{device_id: last known critical DP values} for every device seen so far (read-only dicts)."""
+    return {device_id: state.latest for device_id, state in list(_device_states.items())}
 
 
 # --- Helper function to initialize/reset the last known state ---
 def initialize_dp_state():
-    global _last_known_device_state, _last_gs_snapshot_sent, _last_actual_data_timestamp
-    _last_known_device_state = {
-        "switch": "N/A",
-        "output_voltage": "N/A",
-        "supply_frequency": "N/A",
-        "output_current": "N/A",
-        "output_power": "N/A",
-        "power_factor": "N/A",
-    }
-    _last_gs_snapshot_sent = {}
-    _last_actual_data_timestamp = None  # Reset this on init
+    with _device_states_lock:
+        _device_states.clear()
+
+
+# (dp_code, dp_name, saved value, unit, type, display) of the records written for an offline device
+_OFFLINE_DP_RECORDS = (
+    ("switch", "Breaker Switch", "OFF", "", "Boolean", "OFF"),
+    ("output_voltage", "Voltage", 0.0, "V", "Integer", "0.0 V"),
+    ("supply_frequency", "Frequency", 0.0, "Hz", "Integer", "0.0 Hz"),
+    ("output_current", "Current", 0.0, "A", "Integer", "0.0 A"),
+    ("output_power", "Active Power", 0.0, "kW", "Integer", "0.0 kW"),
+    ("power_factor", "Power Factor", 0.0, "", "Integer", "0.0"),
+    ("device_status", "Device Status", "OFFLINE", "", "String", "OFFLINE"),
+)
 
 
 # --- Function to generate a 'device offline' snapshot ---
 # This is called by tuya_client if API call fails or if data is detected as stale.
 def get_offline_snapshot(device_id, timestamp):
-    global _last_known_device_state, _last_actual_data_timestamp
-
-    # Update global state to reflect offline status
-    _last_known_device_state["switch"] = "OFF"
-    _last_known_device_state["output_voltage"] = 0.0
-    _last_known_device_state["supply_frequency"] = 0.0
-    _last_known_device_state["output_current"] = 0.0
-    _last_known_device_state["output_power"] = 0.0
-    _last_known_device_state["power_factor"] = 0.0
+    state = _get_device_state(device_id)
 
-    _last_actual_data_timestamp = None  # Reset actual data timestamp if we force offline
+    # Update the device's state to reflect offline status
+    with state.lock:
+        state.latest = dict(_OFFLINE_DEVICE_STATE)
+        state.last_actual_data_timestamp = None  # Reset actual data timestamp if we force offline
 
-    # Construct the snapshot data from the updated global state
+    # Construct the snapshot data for the offline state
     snapshot_data = {
         "timestamp": timestamp,
         "time_12hr": time.strftime('%I:%M:%S %p', time.localtime()),
@@ -112,95 +308,75 @@ def get_offline_snapshot(device_id, timestamp):
     }
     # Individual DP records for SQLite for offline entry
     individual_dp_records = [
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "switch", "dp_name": "Breaker Switch",
-         "dp_value_display": "OFF", "dp_value_save": "OFF", "dp_unit": "", "dp_type": "Boolean"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "output_voltage", "dp_name": "Voltage",
-         "dp_value_display": "0.0 V", "dp_value_save": 0.0, "dp_unit": "V", "dp_type": "Integer"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "supply_frequency", "dp_name": "Frequency",
-         "dp_value_display": "0.0 Hz", "dp_value_save": 0.0, "dp_unit": "Hz", "dp_type": "Integer"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "output_current", "dp_name": "Current",
-         "dp_value_display": "0.0 A", "dp_value_save": 0.0, "dp_unit": "A", "dp_type": "Integer"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "output_power", "dp_name": "Active Power",
-         "dp_value_display": "0.0 kW", "dp_value_save": 0.0, "dp_unit": "kW", "dp_type": "Integer"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "power_factor", "dp_name": "Power Factor",
-         "dp_value_display": "0.0", "dp_value_save": 0.0, "dp_unit": "", "dp_type": "Integer"},
-        {"timestamp": timestamp, "device_id": device_id, "dp_code": "device_status", "dp_name": "Device Status",
-         "dp_value_display": "OFFLINE", "dp_value_save": "OFFLINE", "dp_unit": "", "dp_type": "String"},
+        DpRecord(timestamp, device_id, dp_code, dp_name, value, dp_unit, dp_type, display)
+        for dp_code, dp_name, value, dp_unit, dp_type, display in _OFFLINE_DP_RECORDS
     ]
     return snapshot_data, individual_dp_records
 
 
 # --- Function to Process Raw Data into a Fixed-Column Snapshot AND Individual Records ---
-# This function UPDATES a global state and constructs the snapshot from that state
+# This function UPDATES the device's state and constructs the snapshot from that state
 def process_device_data_snapshot(device_id, raw_dp_list, timestamp):
-    global _last_known_device_state, _last_actual_data_timestamp  # Declare global to modify them
-
     individual_dp_records = []
+    state_changes = {}
+    bitmap_values = {}
 
-    # Only update _last_actual_data_timestamp if we received *any* DPs
-    if raw_dp_list:
-        _last_actual_data_timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-
-    # First, update _last_known_device_state with new incoming DPs
+    # First, decode the incoming DPs and collect changes to the device's last known state
+    decoders = _DP_DECODERS
     for dp_change in raw_dp_list:
         dp_code = dp_change.get('code')
         dp_value_raw = dp_change.get('value')
 
-        dp_info = DP_SPECS.get(dp_code)
-
-        if dp_info:
-            dp_name = dp_info["name"]
-            dp_type = dp_info["type"]
-            dp_scale = dp_info.get("scale", 1)
-            dp_unit = dp_info.get("unit", "")
-
-            value_for_state = dp_value_raw
-            display_value_individual = dp_value_raw
-
-            if dp_type == "Integer":
-                value_for_state = round(dp_value_raw / dp_scale, 3)
-                display_value_individual = f"{value_for_state} {dp_unit}"
-            elif dp_type == "Boolean":
-                value_for_state = "ON" if dp_value_raw else "OFF"
-                display_value_individual = value_for_state
-            elif dp_type == "Bitmap":
-                value_for_state = interpret_fault_bitmap(dp_value_raw, dp_info.get("labels", []))
-                display_value_individual = value_for_state
-            elif dp_type == "Raw":
-                value_for_state = dp_value_raw
-                display_value_individual = f"{dp_value_raw} (Raw Data)"
-            else:
-                value_for_state = dp_value_raw
-                display_value_individual = str(dp_value_raw)
-
-            if dp_code in _last_known_device_state:
-                _last_known_device_state[dp_code] = value_for_state
-
-            individual_dp_records.append({
-                "timestamp": timestamp, "device_id": device_id, "dp_code": dp_code,
-                "dp_name": dp_name, "dp_value_display": display_value_individual,
-                "dp_value_save": value_for_state, "dp_unit": dp_unit, "dp_type": dp_type
-            })
+        decoder = decoders.get(dp_code)
+        if decoder is not None:
+            decode, dp_name, dp_unit, dp_type = decoder
+            value_for_state = decode(dp_value_raw)
+            if dp_code in _INITIAL_DEVICE_STATE:
+                state_changes[dp_code] = value_for_state
+            elif dp_code in _BITMAP_LABELS and isinstance(dp_value_raw, int):
+                bitmap_values[dp_code] = dp_value_raw
+            individual_dp_records.append(DpRecord(timestamp, device_id, dp_code, dp_name, value_for_state,
+                                                  dp_unit, dp_type))
         else:
-            individual_dp_records.append({
-                "timestamp": timestamp, "device_id": device_id, "dp_code": dp_code,
-                "dp_name": "Unknown DP", "dp_value_display": dp_value_raw,
-                "dp_value_save": dp_value_raw, "dp_unit": "", "dp_type": "Unknown"
-            })
-
-    # Now, construct the snapshot data for Google Sheets from the *entire* _last_known_device_state
+            individual_dp_records.append(DpRecord(timestamp, device_id, dp_code, "Unknown DP", dp_value_raw,
+                                                  "", "Unknown"))
+
+    # Then apply them in one step (copy-on-write) and keep that version for the snapshot
+    state = _get_device_state(device_id)
+    with state.lock:
+        if state_changes:
+            latest = dict(state.latest)
+            latest.update(state_changes)
+            state.latest = latest
+        else:
+            latest = state.latest
+        fault_events = []
+        if bitmap_values:
+            active_faults = dict(state.active_faults)
+            for dp_code, bitmap in bitmap_values.items():
+                current = decode_fault_bitmap(bitmap, _BITMAP_LABELS[dp_code])
+                fault_events += _fault_transitions(device_id, timestamp, dp_code, bitmap,
+                                                   active_faults.get(dp_code, ()), current)
+                active_faults[dp_code] = current
+            state.active_faults = active_faults
+        # Only update last_actual_data_timestamp if we received *any* DPs
+        if raw_dp_list:
+            state.last_actual_data_timestamp = _parse_timestamp(timestamp)
+
+    # Now, construct the snapshot data for Google Sheets from the device's *entire* last known state
     snapshot_data = {
         "timestamp": timestamp,
         "time_12hr": time.strftime('%I:%M:%S %p', time.localtime()),
         "device_id": device_id,
         "dp_code_raw": raw_dp_list,
-
-        "Breaker Switch": _last_known_device_state.get("switch", "N/A"),
-        "Voltage (V)": _last_known_device_state.get("output_voltage", "N/A"),
-        "Frequency (Hz)": _last_known_device_state.get("supply_frequency", "N/A"),
-        "Current (A)": _last_known_device_state.get("output_current", "N/A"),
-        "Active Power (kW)": _last_known_device_state.get("output_power", "N/A"),
-        "Power Factor": _last_known_device_state.get("power_factor", "N/A"),
+        "fault_events": fault_events,  # alarms raised/cleared by this update, stored by storage_manager
+
+        "Breaker Switch": latest.get("switch", "N/A"),
+        "Voltage (V)": latest.get("output_voltage", "N/A"),
+        "Frequency (Hz)": latest.get("supply_frequency", "N/A"),
+        "Current (A)": latest.get("output_current", "N/A"),
+        "Active Power (kW)": latest.get("output_power", "N/A"),
+        "Power Factor": latest.get("power_factor", "N/A"),
     }
 
     # --- Override numerical values to 0 if Breaker Switch is OFF ---
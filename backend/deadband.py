@@ -0,0 +1,116 @@
+# deadband.py
+# Change-only persistence: a DP sample is stored when it moved by at least its deadband since
+# the last *stored* sample of that DP, or when the heartbeat interval has passed since then.
+# Comparing against the last stored value (not the last seen one) means slow drift is still caught.
+
+# dp_code -> (deadband, heartbeat_seconds), in the DP's saved unit. A deadband of 0 stores any
+# change; a heartbeat of None never forces a write. DP_DEADBANDS in app_config overrides these.
+DEFAULT_RULES = {
+    "output_voltage": (0.5, 300),      # V
+    "output_current": (0.05, 300),     # A
+    "output_power": (0.01, 300),       # kW
+    "supply_frequency": (0.05, 300),   # Hz
+    "power_factor": (0.01, 300),
+    "leakage_current": (1, 300),       # mA
+    "total_forward_energy": (0, 300),  # kWh, already 0.01 resolution
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class DeadbandRules:
+    """Per-DP deadband/heartbeat rules; DPs without a rule store any change, with `default_heartbeat`."""
+
+    def __init__(self, rules=None, default_heartbeat=300):
+        self._rules = dict(DEFAULT_RULES if rules is None else rules)
+        self._default = (0, default_heartbeat)
+
+    def rule(self, dp_code):
+        return self._rules.get(dp_code, self._default)
+
+    def is_due(self, dp_code, last_value, last_ts, value, epoch_ts):
+        """True if `value` at epoch_ts should be written, given the last written value and its time."""
+        if last_ts is None:
+            return True
+        deadband, heartbeat = self.rule(dp_code)
+        if heartbeat is not None and epoch_ts - last_ts >= heartbeat:
+            return True
+        if _is_number(value) and _is_number(last_value):
+            return value != last_value and abs(value - last_value) >= deadband
+        return value != last_value
+
+
+def rules_from_config(env):
+    """DeadbandRules from app_config, or None if DEADBAND_ENABLED is False (store every sample)."""
+    if not getattr(env, 'DEADBAND_ENABLED', True):
+        return None
+    rules = dict(DEFAULT_RULES)
+    rules.update(getattr(env, 'DP_DEADBANDS', None) or {})
+    return DeadbandRules(rules, default_heartbeat=getattr(env, 'DEADBAND_HEARTBEAT_SECONDS', 300))
+
+
+class DeadbandFilter:
+    """Remembers the last stored value of every (device_id, dp_code) and counts stored/skipped samples.
+
+    Decisions are made per writer batch: `begin()` returns a DeadbandBatch whose
+    updates only take effect on its `commit()`, which the writer runs after the
+    batch's transaction committed. A rolled-back or retried batch is therefore
+    judged again against the values that are actually in the database.
+    Not thread-safe: the SQLite writer thread is its only user.
+    """
+
+    def __init__(self, rules):
+        self._rules = rules
+        self._last_stored = {}  # (device_id, dp_code) -> (epoch_ts, value)
+        self.stored = 0
+        self.skipped = 0
+        self.skipped_by_dp = {}
+
+    def begin(self):
+        return DeadbandBatch(self)
+
+    def should_store(self, device_id, dp_code, epoch_ts, value):
+        """Decide and commit a single sample; see DeadbandBatch.should_store."""
+        batch = self.begin()
+        store = batch.should_store(device_id, dp_code, epoch_ts, value)
+        batch.commit()
+        return store
+
+    def stats(self):
+        return {"stored": self.stored, "skipped": self.skipped, "skipped_by_dp": dict(self.skipped_by_dp)}
+
+
+class DeadbandBatch:
+    """Store/skip decisions for one writer batch, applied to the filter on commit()."""
+
+    def __init__(self, deadband_filter):
+        self._filter = deadband_filter
+        self._last_stored = {}  # staged updates, (device_id, dp_code) -> (epoch_ts, value)
+        self._stored = 0
+        self._skipped_by_dp = {}
+
+    def should_store(self, device_id, dp_code, epoch_ts, value):
+        key = (device_id, dp_code)
+        last = self._last_stored.get(key)
+        if last is None:
+            last = self._filter._last_stored.get(key, (None, None))
+        last_ts, last_value = last
+        if last_ts is not None and epoch_ts < last_ts:
+            self._stored += 1  # out-of-order sample: store it, keep the newer reference
+            return True
+        if self._filter._rules.is_due(dp_code, last_value, last_ts, value, epoch_ts):
+            self._last_stored[key] = (epoch_ts, value)
+            self._stored += 1
+            return True
+        self._skipped_by_dp[dp_code] = self._skipped_by_dp.get(dp_code, 0) + 1
+        return False
+
+    def commit(self):
+        flt = self._filter
+        flt._last_stored.update(self._last_stored)
+        flt.stored += self._stored
+        for dp_code, count in self._skipped_by_dp.items():
+            flt.skipped += count
+            flt.skipped_by_dp[dp_code] = flt.skipped_by_dp.get(dp_code, 0) + count
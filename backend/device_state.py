@@ -0,0 +1,59 @@
+# device_state.py
+import threading
+import time
+
+# --- Shared per-device connectivity state ---
+# Written by the device-state probe (online flag), the pollers and the MQTT ingest
+# pipeline (last data time); read by the pollers and the dashboard. Times are epoch seconds.
+_states = {}  # device_id -> {"online": bool | None, "checked_at": float | None, "last_mqtt_at": float | None}
+_states_lock = threading.Lock()
+
+
+def _state_locked(device_id):
+    state = _states.get(device_id)
+    if state is None:
+        state = _states[device_id] = {"online": None, "checked_at": None, "last_mqtt_at": None}
+    return state
+
+
+def record_online(device_id, is_online, checked_at=None):
+    with _states_lock:
+        state = _state_locked(device_id)
+        state["online"] = bool(is_online)
+        state["checked_at"] = checked_at or time.time()
+
+
+def record_mqtt_data(device_id, received_at=None):
+    """MQTT only delivers status for a reachable device, so this also marks it online."""
+    received_at = received_at or time.time()
+    with _states_lock:
+        state = _state_locked(device_id)
+        state["last_mqtt_at"] = received_at
+        if state["checked_at"] is None or received_at >= state["checked_at"]:
+            state["online"] = True
+            state["checked_at"] = received_at
+
+
+def get_state(device_id):
+    """Copy of the device's state dict, or None if nothing is known about it yet."""
+    with _states_lock:
+        state = _states.get(device_id)
+        return dict(state) if state is not None else None
+
+
+def get_all_states():
+    with _states_lock:
+        return {device_id: dict(state) for device_id, state in _states.items()}
+
+
+def get_online(device_id, max_age_seconds):
+    """Cached online flag if it was checked within max_age_seconds, else None (caller should probe)."""
+    state = get_state(device_id)
+    if state is None or state["checked_at"] is None or time.time() - state["checked_at"] > max_age_seconds:
+        return None
+    return state["online"]
+
+
+def has_fresh_mqtt_data(device_id, max_age_seconds):
+    state = get_state(device_id)
+    return bool(state and state["last_mqtt_at"] and time.time() - state["last_mqtt_at"] <= max_age_seconds)
@@ -0,0 +1,322 @@
+# energy.py
+import threading
+import time
+
+from rollups import ENERGY_DP_CODE, bucket_start
+
+# The meter's own cumulative energy register (kWh), used to cross-check the integrated total.
+METER_DP_CODE = "total_forward_energy"
+
+DAY_SECONDS = 24 * 60 * 60
+
+# One row per device per local day; rewritten by the SQLite writer whenever the day's totals move.
+_CHECKPOINT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS energy_checkpoints (
+        device_id TEXT NOT NULL,
+        day_ts INTEGER NOT NULL,
+        updated_ts INTEGER NOT NULL,
+        day_kwh REAL NOT NULL,
+        gap_seconds INTEGER NOT NULL,
+        total_kwh REAL NOT NULL,
+        meter_start_kwh REAL,
+        meter_start_day_kwh REAL,
+        meter_last_kwh REAL,
+        meter_last_day_kwh REAL,
+        last_ts INTEGER,
+        last_kw REAL,
+        PRIMARY KEY (device_id, day_ts)
+    ) WITHOUT ROWID
+'''
+_CHECKPOINT_COLUMNS = ("device_id", "day_ts", "updated_ts", "day_kwh", "gap_seconds", "total_kwh",
+                       "meter_start_kwh", "meter_start_day_kwh", "meter_last_kwh", "meter_last_day_kwh", "last_ts",
+                       "last_kw")
+
+
+def ensure_checkpoint_table(cursor):
+    cursor.execute(_CHECKPOINT_SCHEMA)
+
+
+def day_start(epoch_ts):
+    """Local midnight at or before epoch_ts."""
+    return bucket_start(epoch_ts, DAY_SECONDS)
+
+
+class _DeviceEnergy:
+    __slots__ = _CHECKPOINT_COLUMNS[1:] + ("drift_warned",)
+
+    def __init__(self, day_ts):
+        self.day_ts = day_ts
+        self.updated_ts = None
+        self.day_kwh = 0.0
+        self.gap_seconds = 0
+        self.total_kwh = 0.0
+        self.meter_start_kwh = None      # meter register when today's cross-check window started
+        self.meter_start_day_kwh = None  # day_kwh at that same moment
+        self.meter_last_kwh = None
+        self.meter_last_day_kwh = None   # day_kwh at the latest meter reading
+        self.last_ts = None              # previous power sample
+        self.last_kw = None
+        self.drift_warned = False
+
+    def copy(self):
+        dev = _DeviceEnergy.__new__(_DeviceEnergy)
+        for name in self.__slots__:
+            setattr(dev, name, getattr(self, name))
+        return dev
+
+
+class EnergyIntegrator:
+    """Running kWh per device, integrated from power samples as they are ingested.
+
+    Each power sample closes a trapezoid with the previous one; intervals longer
+    than `max_gap_seconds`, and the part of the day before a device's first
+    sample, are counted as gap time instead of energy. Day totals
+    roll over at local midnight, so today's energy is a single lookup however many
+    samples it took. Readings of the meter's total_forward_energy register run
+    alongside and are compared with the integrated energy over the same window;
+    a difference beyond the tolerance is logged.
+
+    Fed by the SQLite writer thread (through RollupAggregator) one batch at a
+    time: `begin()` stages a batch on copies of the device states, the batch's
+    checkpoint rows are written in the same transaction, and its `commit()`
+    publishes the states once that transaction has committed, so a rolled-back
+    batch leaves the integrator untouched. Readers on other threads go through
+    the lock.
+    """
+
+    def __init__(self, max_gap_seconds=600, split_seconds=60, drift_tolerance_kwh=0.05, drift_tolerance_ratio=0.05):
+        self._max_gap_seconds = max_gap_seconds
+        self._split_seconds = split_seconds
+        self._drift_tolerance_kwh = drift_tolerance_kwh
+        self._drift_tolerance_ratio = drift_tolerance_ratio
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Start a batch of samples; nothing changes until the batch's commit()."""
+        return EnergyBatch(self)
+
+    def _roll_over(self, dev, epoch_ts, closed_days):
+        day_ts = day_start(epoch_ts)
+        if day_ts > dev.day_ts:
+            closed_days.append(dev.copy())  # the finished day's final totals still need their checkpoint
+            dev.day_ts = day_ts
+            dev.day_kwh = 0.0
+            dev.gap_seconds = 0
+            # Yesterday's last meter reading is where today's meter consumption starts.
+            dev.meter_start_kwh = dev.meter_last_kwh
+            dev.meter_start_day_kwh = dev.meter_last_day_kwh = 0.0 if dev.meter_last_kwh is not None else None
+            dev.drift_warned = False
+
+    def add_sample(self, device_id, dp_code, epoch_ts, value):
+        """Feed and commit a single sample; see EnergyBatch.add_sample."""
+        batch = self.begin()
+        pieces = batch.add_sample(device_id, dp_code, epoch_ts, value)
+        batch.commit()
+        return pieces
+
+    def _add_power(self, dev, epoch_ts, kw, closed_days):
+        t0, kw0 = dev.last_ts, dev.last_kw
+        if t0 is not None and epoch_ts <= t0:
+            return []  # duplicate or out-of-order sample: nothing to integrate
+        dev.last_ts, dev.last_kw = epoch_ts, kw
+        dev.updated_ts = epoch_ts
+        if t0 is None:
+            self._roll_over(dev, epoch_ts, closed_days)
+            dev.gap_seconds += epoch_ts - dev.day_ts  # nothing is known about the day before this sample
+            return []
+        if epoch_ts - t0 > self._max_gap_seconds:
+            # Split at midnight, so every day the gap spans gets its own share.
+            start = t0
+            while start < epoch_ts:
+                self._roll_over(dev, start, closed_days)
+                end = min(dev.day_ts + DAY_SECONDS, epoch_ts)
+                dev.gap_seconds += end - start
+                start = end
+            self._roll_over(dev, epoch_ts, closed_days)
+            return []
+
+        pieces = []
+        slope = (kw - kw0) / (epoch_ts - t0)
+        start = t0
+        while start < epoch_ts:
+            end = min(bucket_start(start, self._split_seconds) + self._split_seconds, epoch_ts)
+            p_start = kw0 + slope * (start - t0)
+            p_end = kw0 + slope * (end - t0)
+            kwh = max(0.0, (p_start + p_end) / 2.0 * (end - start) / 3600.0)
+            self._roll_over(dev, start, closed_days)
+            dev.day_kwh += kwh
+            dev.total_kwh += kwh
+            pieces.append((start, kwh))
+            start = end
+        self._roll_over(dev, epoch_ts, closed_days)
+        return pieces
+
+    def _add_meter_reading(self, device_id, dev, epoch_ts, kwh, closed_days):
+        self._roll_over(dev, epoch_ts, closed_days)
+        if dev.meter_start_kwh is None:
+            dev.meter_start_kwh = kwh
+            dev.meter_start_day_kwh = dev.day_kwh
+        elif dev.meter_last_kwh is not None and kwh < dev.meter_last_kwh:
+            # Register cleared (clr_all_energy): keep today's metered consumption continuous.
+            dev.meter_start_kwh = kwh - (dev.meter_last_kwh - dev.meter_start_kwh)
+        dev.meter_last_kwh = kwh
+        dev.meter_last_day_kwh = dev.day_kwh
+        dev.updated_ts = max(dev.updated_ts or epoch_ts, epoch_ts)
+        self._check_drift(device_id, dev)
+
+    @staticmethod
+    def _meter_window(dev):
+        """(integrated kWh, metered kWh) between the first and the latest meter reading of the day, or None."""
+        if dev.meter_start_kwh is None or dev.meter_last_kwh is None:
+            return None
+        return dev.meter_last_day_kwh - dev.meter_start_day_kwh, dev.meter_last_kwh - dev.meter_start_kwh
+
+    def _check_drift(self, device_id, dev):
+        integrated, metered = self._meter_window(dev)
+        drift = integrated - metered
+        if abs(drift) > max(self._drift_tolerance_kwh, self._drift_tolerance_ratio * metered):
+            if not dev.drift_warned:
+                dev.drift_warned = True
+                print(f"Energy: {device_id} integrated {integrated:.3f} kWh but the meter counted "
+                      f"{metered:.3f} kWh over the same window (drift {drift:+.3f} kWh).")
+        else:
+            dev.drift_warned = False
+
+    def _day_totals(self, dev, day_ts):
+        if dev.day_ts != day_ts:
+            return {"kwh": 0.0, "meter_kwh": None, "drift_kwh": None, "gap_seconds": 0, "updated_ts": dev.updated_ts}
+        window = self._meter_window(dev)
+        return {
+            "kwh": dev.day_kwh,
+            "meter_kwh": window[1] if window else None,
+            "drift_kwh": window[0] - window[1] if window else None,
+            "gap_seconds": dev.gap_seconds,
+            "updated_ts": dev.updated_ts,
+        }
+
+    def get_today(self, device_id=None, now=None):
+        """Energy since local midnight for one device, or summed over all devices; None if nothing was seen."""
+        day_ts = day_start(int(now if now is not None else time.time()))
+        with self._lock:
+            if device_id is not None:
+                dev = self._devices.get(device_id)
+                return self._day_totals(dev, day_ts) if dev is not None else None
+            return combine_day_totals([self._day_totals(dev, day_ts) for dev in self._devices.values()])
+
+    def restore(self, rows):
+        """Resume from checkpoint rows (dicts keyed like the table), e.g. each device's latest one."""
+        with self._lock:
+            for row in rows:
+                dev = _DeviceEnergy(row["day_ts"])
+                for column in _CHECKPOINT_COLUMNS[2:]:
+                    setattr(dev, column, row[column])
+                self._devices[row["device_id"]] = dev
+
+
+class EnergyBatch:
+    """Samples fed to an EnergyIntegrator within one writer transaction, applied to copies of the device states."""
+
+    def __init__(self, integrator):
+        self._integrator = integrator
+        self._devices = {}      # device_id -> staged _DeviceEnergy
+        self._closed_days = {}  # device_id -> [_DeviceEnergy of each day the batch rolled past]
+
+    def _device(self, device_id, epoch_ts):
+        dev = self._devices.get(device_id)
+        if dev is None:
+            committed = self._integrator._devices.get(device_id)
+            dev = committed.copy() if committed is not None else _DeviceEnergy(day_start(epoch_ts))
+            self._devices[device_id] = dev
+        return dev, self._closed_days.setdefault(device_id, [])
+
+    def add_sample(self, device_id, dp_code, epoch_ts, value):
+        """Feed one numeric DP sample. Returns [(piece_start_ts, kWh), ...] integrated by a power sample.
+
+        The interval since the previous power sample is split on `split_seconds`
+        edges so callers can attribute energy to time buckets (and so to days).
+        """
+        if dp_code not in (ENERGY_DP_CODE, METER_DP_CODE):
+            return []
+        dev, closed_days = self._device(device_id, epoch_ts)
+        if dp_code == ENERGY_DP_CODE:
+            return self._integrator._add_power(dev, epoch_ts, value, closed_days)
+        self._integrator._add_meter_reading(device_id, dev, epoch_ts, value, closed_days)
+        return []
+
+    def checkpoint_rows(self):
+        """Rows for energy_checkpoints of every day whose totals this batch moved, staged state included."""
+        rows = []
+        for device_id, dev in self._devices.items():
+            for day in self._closed_days.get(device_id, []) + [dev]:
+                rows.append((device_id,) + tuple(getattr(day, column) for column in _CHECKPOINT_COLUMNS[1:]))
+        return rows
+
+    def commit(self):
+        """Publish the staged device states (after the transaction that stored the batch committed)."""
+        integrator = self._integrator
+        with integrator._lock:
+            integrator._devices.update(self._devices)
+
+
+def combine_day_totals(totals):
+    """Sum per-device day totals into one; meter figures only count devices that have them."""
+    if not totals:
+        return None
+    metered = [t for t in totals if t["meter_kwh"] is not None]
+    return {
+        "kwh": sum(t["kwh"] for t in totals),
+        "meter_kwh": sum(t["meter_kwh"] for t in metered) if metered else None,
+        "drift_kwh": sum(t["drift_kwh"] for t in metered) if metered else None,
+        "gap_seconds": max(t["gap_seconds"] for t in totals),
+        "updated_ts": max((t["updated_ts"] for t in totals if t["updated_ts"] is not None), default=None),
+    }
+
+
+# --- Checkpoint table access (writer connection for writes, read connection for reads) ---
+def write_checkpoints(conn, energy_batch):
+    """Store an EnergyBatch's checkpoint rows; call it inside the transaction that stores the batch."""
+    rows = energy_batch.checkpoint_rows()
+    if rows:
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO energy_checkpoints ({", ".join(_CHECKPOINT_COLUMNS)})
+            VALUES ({", ".join("?" for _ in _CHECKPOINT_COLUMNS)})
+        ''', rows)
+
+
+def load_latest_checkpoints(conn):
+    """Each device's most recent checkpoint row, as dicts."""
+    rows = conn.execute(f'''
+        SELECT {", ".join("c." + column for column in _CHECKPOINT_COLUMNS)}
+        FROM energy_checkpoints c
+        JOIN (SELECT device_id, max(day_ts) AS day_ts FROM energy_checkpoints GROUP BY device_id) latest
+          ON c.device_id = latest.device_id AND c.day_ts = latest.day_ts
+    ''').fetchall()
+    return [dict(zip(_CHECKPOINT_COLUMNS, row)) for row in rows]
+
+
+def query_day(conn, day_ts, device_id=None, now=None):
+    """Stored totals of one local day (primary-key lookups), summed over devices when device_id is None.
+
+    "gap_seconds" also counts the part of the day (up to `now`) after a device's last power
+    sample that its checkpoint never saw integrated, e.g. because the backend stopped.
+    """
+    elapsed_end = min(day_ts + DAY_SECONDS, int(now if now is not None else time.time()))
+    query = f"SELECT {', '.join(_CHECKPOINT_COLUMNS)} FROM energy_checkpoints WHERE day_ts = ?"
+    params = [day_ts]
+    if device_id is not None:
+        query += " AND device_id = ?"
+        params.append(device_id)
+    totals = []
+    for row in conn.execute(query, params).fetchall():
+        row = dict(zip(_CHECKPOINT_COLUMNS, row))
+        has_meter = row["meter_start_kwh"] is not None and row["meter_last_kwh"] is not None
+        metered = row["meter_last_kwh"] - row["meter_start_kwh"] if has_meter else None
+        totals.append({
+            "kwh": row["day_kwh"],
+            "meter_kwh": metered,
+            "drift_kwh": row["meter_last_day_kwh"] - row["meter_start_day_kwh"] - metered if has_meter else None,
+            "gap_seconds": row["gap_seconds"] + max(0, elapsed_end - (row["last_ts"] or day_ts)),
+            "updated_ts": row["updated_ts"],
+        })
+    return combine_day_totals(totals)
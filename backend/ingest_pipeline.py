@@ -0,0 +1,167 @@
+# ingest_pipeline.py
+import json
+import queue
+import threading
+import time
+
+import data_processor
+import device_state
+import storage_manager
+
+# Overflow policies for a full stage queue.
+OVERFLOW_DROP_NEWEST = "drop_newest"  # reject the incoming item
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # evict the oldest queued item to make room
+OVERFLOW_BLOCK = "block"              # wait up to block_timeout, then drop the incoming item
+OVERFLOW_POLICIES = (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK)
+
+_STOP = object()
+
+
+class PipelineStage:
+    """One worker thread reading from a bounded queue.
+
+    `handler(item)` returns the item for the next stage, or None to end the item's
+    trip through the pipeline. Items are handed to `next_stage` with blocking puts,
+    so a slow downstream stage backs up into this one instead of losing data
+    between stages; only the entry stage's overflow policy ever drops.
+    """
+
+    def __init__(self, name, handler, maxsize=1000, overflow=OVERFLOW_BLOCK, block_timeout=1.0, next_stage=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.name = name
+        self._handler = handler
+        self._queue = queue.Queue(maxsize=max(1, int(maxsize)))
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+        self._next_stage = next_stage
+        self._thread = None
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name=f"ingest-{self.name}", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """Offer an item according to the overflow policy. Returns False if an item was dropped."""
+        if self._overflow == OVERFLOW_BLOCK:
+            try:
+                self._queue.put(item, timeout=self._block_timeout)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        self.dropped += 1
+        if self._overflow == OVERFLOW_DROP_NEWEST:
+            return False
+        try:
+            self._queue.get_nowait()  # discard oldest
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            pass  # lost the race with another producer; the item counted as dropped above
+        return False
+
+    def stop(self, timeout=5):
+        if not (self._thread and self._thread.is_alive()):
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            try:
+                result = self._handler(item)
+            except Exception as e:
+                self.errors += 1
+                print(f"Ingest Pipeline: error in stage '{self.name}': {e}")
+                continue
+            self.processed += 1
+            if result is not None and self._next_stage is not None:
+                self._next_stage._queue.put(result)
+
+
+# --- Stage handlers ---
+def _decode_stage(item):
+    received_ts, message_data = item
+    data = message_data.get('data') if isinstance(message_data, dict) else None
+    if isinstance(data, dict) and 'status' in data:
+        return data.get('devId'), data.get('status', []), received_ts
+
+    print(f"\nTuya Client: --- Received Other MQTT Message (Protocol: {message_data.get('protocol', 'N/A')}) ---")
+    print(json.dumps(message_data, indent=2))
+    return None
+
+
+def _normalise_stage(item):
+    dev_id, raw_dp_list, timestamp = item
+    snapshot, individual_dp_records = data_processor.process_device_data_snapshot(dev_id, raw_dp_list, timestamp)
+    device_state.record_mqtt_data(dev_id)
+    print(f"\nTuya Client: --- Received MQTT Device Data Update ({timestamp}) ---")
+    data_processor.print_clean_snapshot(snapshot)
+    return snapshot, individual_dp_records
+
+
+def _persist_stage(item):
+    snapshot, individual_dp_records = item
+    storage_manager.insert_snapshot_into_sqlite(snapshot)
+    storage_manager.insert_records_into_sqlite(individual_dp_records)
+    return None
+
+
+class MqttIngestPipeline:
+    """decode -> normalise -> persist, each stage on its own thread.
+
+    `submit()` is safe to call from the paho network thread: it stamps the
+    message with its receive time and enqueues it without blocking (unless the
+    overflow policy is "block").
+    """
+
+    def __init__(self, maxsize=1000, overflow=OVERFLOW_DROP_OLDEST):
+        self.persist = PipelineStage("persist", _persist_stage, maxsize=maxsize)
+        self.normalise = PipelineStage("normalise", _normalise_stage, maxsize=maxsize, next_stage=self.persist)
+        self.decode = PipelineStage("decode", _decode_stage, maxsize=maxsize, overflow=overflow,
+                                    next_stage=self.normalise)
+        self._stages = (self.decode, self.normalise, self.persist)
+
+    def start(self):
+        for stage in reversed(self._stages):
+            stage.start()
+        print("Ingest Pipeline: started.")
+
+    def submit(self, message_data):
+        received_ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        return self.decode.put((received_ts, message_data))
+
+    def stop(self):
+        # Upstream first so everything already accepted drains through.
+        for stage in self._stages:
+            stage.stop()
+        print(f"Ingest Pipeline: stopped. {self.stats()}")
+
+    def stats(self):
+        return {
+            stage.name: {"depth": stage.depth(), "processed": stage.processed,
+                         "dropped": stage.dropped, "errors": stage.errors}
+            for stage in self._stages
+        }
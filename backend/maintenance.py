@@ -0,0 +1,199 @@
+# maintenance.py
+import sqlite3
+import threading
+import time
+
+import rollups
+
+# Days each level is kept; None keeps it forever. "raw" is device_data, "snapshot" is snapshot_data,
+# the others are the rollup tables. Override with STORAGE_RETENTION_DAYS in app_config.
+DEFAULT_RETENTION_DAYS = {
+    "raw": 7,
+    "snapshot": 7,
+    "1m": 90,
+    "15m": 365,
+    "1h": None,
+    "1d": None,
+}
+
+# Level whose data is folded into the next coarser one before it is deleted.
+_DOWNSAMPLE_TARGET = {
+    "raw": "1m",
+    "1m": "15m",
+    "15m": "1h",
+    "1h": "1d",
+}
+
+# raw -> 1m. INSERT OR IGNORE: buckets already maintained at ingest time are left alone, so this
+# only fills buckets for data that predates the rollup tables. Energy for such buckets is
+# approximated as avg kW x bucket length.
+_DOWNSAMPLE_RAW_SQL = f'''
+    INSERT OR IGNORE INTO rollup_1m (device_id, dp_code, bucket_ts, sample_count, min_value, max_value, sum_value,
+                                     last_value, last_ts, energy_kwh)
+    SELECT g.device_id, g.dp_code, g.bucket_ts, g.n, g.mn, g.mx, g.sm,
+           (SELECT d.value_num FROM device_data d
+            WHERE d.device_id = g.device_id AND d.dp_code = g.dp_code AND d.epoch_ts = g.last_ts),
+           g.last_ts,
+           CASE WHEN g.dp_code = '{rollups.ENERGY_DP_CODE}' THEN g.sm / g.n * :res / 3600.0 ELSE 0 END
+    FROM (
+        SELECT device_id, dp_code, epoch_ts - ((epoch_ts + :offset) % :res) AS bucket_ts,
+               count(*) AS n, min(value_num) AS mn, max(value_num) AS mx, sum(value_num) AS sm,
+               max(epoch_ts) AS last_ts
+        FROM device_data
+        WHERE epoch_ts >= :start AND epoch_ts < :end AND value_num IS NOT NULL
+        GROUP BY device_id, dp_code, bucket_ts
+    ) AS g
+'''
+
+# finer rollup -> coarser rollup, same idea.
+_DOWNSAMPLE_ROLLUP_SQL = '''
+    INSERT OR IGNORE INTO rollup_{target} (device_id, dp_code, bucket_ts, sample_count, min_value, max_value,
+                                           sum_value, last_value, last_ts, energy_kwh)
+    SELECT g.device_id, g.dp_code, g.bucket_ts, g.n, g.mn, g.mx, g.sm,
+           (SELECT r.last_value FROM rollup_{source} r
+            WHERE r.device_id = g.device_id AND r.dp_code = g.dp_code AND r.bucket_ts >= :start
+              AND r.bucket_ts < :end AND r.last_ts = g.last_ts LIMIT 1),
+           g.last_ts, g.energy
+    FROM (
+        SELECT device_id, dp_code, bucket_ts - ((bucket_ts + :offset) % :res) AS bucket_ts,
+               sum(sample_count) AS n, min(min_value) AS mn, max(max_value) AS mx, sum(sum_value) AS sm,
+               max(last_ts) AS last_ts, sum(energy_kwh) AS energy
+        FROM rollup_{source}
+        WHERE bucket_ts >= :start AND bucket_ts < :end
+        GROUP BY device_id, dp_code, 3
+    ) AS g
+'''
+
+_LEVEL_TABLES = {"raw": ("device_data", "epoch_ts"), "snapshot": ("snapshot_data", "epoch_ts")}
+_LEVEL_TABLES.update({name: (f"rollup_{name}", "bucket_ts") for name, _ in rollups.RESOLUTIONS})
+
+
+class StorageMaintenance:
+    """Scheduled retention job for the local SQLite store.
+
+    Every `interval_seconds` it walks each level older than its retention in
+    small time slices. Each slice is one short transaction that first folds the
+    rows into the next coarser rollup level (if missing) and then deletes them,
+    followed by an incremental VACUUM of a few pages and a short pause, so the
+    ingest writer never waits long for the database lock.
+
+    With `convert_to_incremental_vacuum`, the first run also switches an existing
+    database to auto_vacuum=INCREMENTAL. That takes one full VACUUM, which holds
+    the database for as long as it runs, so it is opt-in and happens here, off
+    the startup path.
+    """
+
+    def __init__(self, db_file, retention_days=None, interval_seconds=3600, initial_delay_seconds=60,
+                 max_slices_per_run=500, vacuum_pages_per_slice=200, slice_pause_seconds=0.05,
+                 convert_to_incremental_vacuum=False):
+        self._db_file = db_file
+        self._retention_days = dict(DEFAULT_RETENTION_DAYS)
+        self._retention_days.update(retention_days or {})
+        self._interval_seconds = max(60, int(interval_seconds))
+        self._initial_delay_seconds = max(0, int(initial_delay_seconds))
+        self._max_slices_per_run = max(1, int(max_slices_per_run))
+        self._vacuum_pages_per_slice = max(1, int(vacuum_pages_per_slice))
+        self._slice_pause_seconds = slice_pause_seconds
+        self._convert_to_incremental_vacuum = convert_to_incremental_vacuum
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.last_run_summary = {}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-maintenance", daemon=True)
+        self._thread.start()
+        print(f"Storage Maintenance: scheduled every {self._interval_seconds}s (retention days: {self._retention_days}).")
+
+    def stop(self, timeout=10):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        if self._stop_event.wait(self._initial_delay_seconds):
+            return
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                print(f"Storage Maintenance: Error during maintenance run: {e}")
+            self._stop_event.wait(self._interval_seconds)
+
+    # --- One maintenance pass ---
+    def run_once(self):
+        conn = sqlite3.connect(self._db_file)
+        conn.execute("PRAGMA busy_timeout=5000")
+        summary = {}
+        slices_left = self._max_slices_per_run
+        try:
+            if self._convert_to_incremental_vacuum:
+                self._convert_auto_vacuum(conn)
+            # Finest first, so e.g. raw rows reach rollup_1m before old 1m rows are folded into 15m.
+            for level in ("raw", "snapshot") + tuple(name for name, _ in rollups.RESOLUTIONS):
+                days = self._retention_days.get(level)
+                if days is None or slices_left <= 0:
+                    continue
+                deleted, used = self._expire_level(conn, level, time.time() - float(days) * 86400, slices_left)
+                slices_left -= used
+                if deleted:
+                    summary[level] = deleted
+        finally:
+            conn.close()
+        self.last_run_summary = summary
+        if summary:
+            print(f"Storage Maintenance: expired rows per level: {summary}")
+        return summary
+
+    def _convert_auto_vacuum(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("Storage Maintenance: Switching SQLite database to incremental auto-vacuum (one-time VACUUM)...")
+            started = time.monotonic()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f"Storage Maintenance: VACUUM finished in {time.monotonic() - started:.1f}s.")
+        self._convert_to_incremental_vacuum = False
+
+    def _expire_level(self, conn, level, cutoff_ts, max_slices):
+        table, ts_column = _LEVEL_TABLES[level]
+        target = _DOWNSAMPLE_TARGET.get(level)
+        target_seconds = rollups.RESOLUTION_SECONDS[target] if target else 0
+        slice_seconds = max(3600, target_seconds)
+        # Whole slices only, aligned to the target's buckets, so a target bucket is never built from part of its data.
+        cutoff_ts = rollups.bucket_start(int(cutoff_ts), slice_seconds)
+
+        oldest = conn.execute(f"SELECT min({ts_column}) FROM {table}").fetchone()[0]
+        if oldest is None or oldest >= cutoff_ts:
+            return 0, 0
+
+        deleted = 0
+        used = 0
+        start = rollups.bucket_start(int(oldest), slice_seconds)
+        while start < cutoff_ts and used < max_slices and not self._stop_event.is_set():
+            end = min(start + slice_seconds, cutoff_ts)
+            with conn:
+                if target:
+                    self._downsample(conn, level, target, start, end)
+                deleted += conn.execute(
+                    f"DELETE FROM {table} WHERE {ts_column} >= ? AND {ts_column} < ?", (start, end)).rowcount
+            conn.execute(f"PRAGMA incremental_vacuum({self._vacuum_pages_per_slice})").fetchall()
+            used += 1
+            start = end
+            time.sleep(self._slice_pause_seconds)
+        return deleted, used
+
+    @staticmethod
+    def _downsample(conn, level, target, start, end):
+        params = {
+            "start": start,
+            "end": end,
+            "res": rollups.RESOLUTION_SECONDS[target],
+            "offset": time.localtime(start).tm_gmtoff,
+        }
+        if level == "raw":
+            conn.execute(_DOWNSAMPLE_RAW_SQL, params)
+        else:
+            conn.execute(_DOWNSAMPLE_ROLLUP_SQL.format(source=level, target=target), params)
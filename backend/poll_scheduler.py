@@ -0,0 +1,170 @@
+# poll_scheduler.py
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _PollJob:
+    __slots__ = ("key", "func", "interval", "deadline", "base_due", "running", "runs", "failures",
+                 "deadline_misses", "overlaps", "last_started", "last_duration", "removed")
+
+    def __init__(self, key, func, interval, deadline):
+        self.key = key
+        self.func = func
+        self.interval = float(interval)
+        self.deadline = float(deadline)
+        self.base_due = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.deadline_misses = 0
+        self.overlaps = 0
+        self.last_started = None
+        self.last_duration = None
+        self.removed = False
+
+
+class PollScheduler:
+    """Runs many periodic polls on one scheduler thread and a bounded worker pool.
+
+    Each job has its own interval. Jobs start at evenly spread offsets within
+    their interval plus random jitter, so devices are not all polled in the
+    same second. A run counts as a deadline miss when it starts more than
+    `late_tolerance` seconds after it was due (pool saturated), when it runs
+    longer than its deadline, or when it is still running at its next due time
+    (that occurrence is skipped instead of stacking up).
+    """
+
+    def __init__(self, max_workers=4, jitter_fraction=0.1, late_tolerance=2.0):
+        self._max_workers = max(1, int(max_workers))
+        self._jitter_fraction = max(0.0, float(jitter_fraction))
+        self._late_tolerance = late_tolerance
+        self._jobs = {}
+        self._heap = []  # (fire_at, sequence, job)
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._stopped = True
+        self._thread = None
+        self._executor = None
+
+    # --- Job management ---
+    def add_job(self, key, func, interval, deadline=None, first_delay=None):
+        """Schedule func() every `interval` seconds; it is dropped silently if a job with `key` already exists."""
+        with self._cond:
+            if key in self._jobs:
+                return False
+            job = _PollJob(key, func, interval, deadline or interval)
+            if first_delay is None:
+                first_delay = random.uniform(0, job.interval)
+            job.base_due = time.monotonic() + first_delay
+            self._jobs[key] = job
+            self._push_locked(job, job.base_due)
+            self._cond.notify()
+            return True
+
+    def add_jobs_spread(self, jobs):
+        """Add [(key, func, interval), ...] with first runs spread evenly across each interval."""
+        count = len(jobs)
+        for index, (key, func, interval) in enumerate(jobs):
+            self.add_job(key, func, interval, first_delay=interval * index / max(1, count))
+
+    def remove_job(self, key):
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job is not None:
+                job.removed = True
+
+    def _push_locked(self, job, base_due):
+        jitter = random.uniform(0, job.interval * self._jitter_fraction)
+        self._sequence += 1
+        heapq.heappush(self._heap, (base_due + jitter, self._sequence, job))
+
+    # --- Lifecycle ---
+    def start(self):
+        with self._cond:
+            if not self._stopped:
+                return
+            self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="poll-worker")
+        self._thread = threading.Thread(target=self._run, name="poll-scheduler", daemon=True)
+        self._thread.start()
+        print(f"Poll Scheduler: started with {len(self._jobs)} job(s) on {self._max_workers} worker(s).")
+
+    def stop(self, wait=False):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        with self._cond:
+            return {
+                job.key: {
+                    "interval": job.interval,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "deadline_misses": job.deadline_misses,
+                    "skipped_overlaps": job.overlaps,
+                    "running": job.running,
+                    "last_duration": job.last_duration,
+                }
+                for job in self._jobs.values()
+            }
+
+    # --- Scheduler thread ---
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                if job.removed:
+                    continue
+                due = job.base_due
+                job.base_due += job.interval
+                # Don't replay missed occurrences after a long stall; resume from now.
+                if job.base_due < time.monotonic():
+                    job.base_due = time.monotonic() + job.interval
+                self._push_locked(job, job.base_due)
+
+                if job.running:
+                    job.overlaps += 1
+                    job.deadline_misses += 1
+                    continue
+                job.running = True
+            try:
+                self._executor.submit(self._execute, job, due)
+            except RuntimeError:  # executor shut down
+                return
+
+    def _execute(self, job, due):
+        started = time.monotonic()
+        late = started - due > self._late_tolerance + job.interval * self._jitter_fraction
+        ok = True
+        try:
+            result = job.func()
+            ok = result is not False
+        except Exception as e:
+            ok = False
+            print(f"Poll Scheduler: job '{job.key}' raised: {e}")
+        duration = time.monotonic() - started
+        with self._cond:
+            job.running = False
+            job.runs += 1
+            job.last_started = started
+            job.last_duration = duration
+            if not ok:
+                job.failures += 1
+            if late or duration > job.deadline:
+                job.deadline_misses += 1
@@ -0,0 +1,138 @@
+# rollups.py
+import time
+
+# (name, bucket length in seconds), finest first. Each name has a table rollup_<name>.
+RESOLUTIONS = (
+    ("1m", 60),
+    ("15m", 15 * 60),
+    ("1h", 60 * 60),
+    ("1d", 24 * 60 * 60),
+)
+RESOLUTION_SECONDS = dict(RESOLUTIONS)
+
+# DP whose value (kW) is integrated into energy_kwh per bucket.
+ENERGY_DP_CODE = "output_power"
+
+_TABLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rollup_{name} (
+        device_id TEXT NOT NULL,
+        dp_code TEXT NOT NULL,
+        bucket_ts INTEGER NOT NULL,
+        sample_count INTEGER NOT NULL,
+        min_value REAL,
+        max_value REAL,
+        sum_value REAL,
+        last_value REAL,
+        last_ts INTEGER,
+        energy_kwh REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (device_id, dp_code, bucket_ts)
+    ) WITHOUT ROWID
+'''
+
+# Merge a batch's partial aggregate into the stored bucket. Buckets that only received
+# interpolated energy have sample_count 0 and NULL min/max/last, hence the coalesces.
+_UPSERT = '''
+    INSERT INTO rollup_{name} (device_id, dp_code, bucket_ts, sample_count, min_value, max_value, sum_value,
+                               last_value, last_ts, energy_kwh)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (device_id, dp_code, bucket_ts) DO UPDATE SET
+        sample_count = sample_count + excluded.sample_count,
+        min_value = min(coalesce(min_value, excluded.min_value), coalesce(excluded.min_value, min_value)),
+        max_value = max(coalesce(max_value, excluded.max_value), coalesce(excluded.max_value, max_value)),
+        sum_value = coalesce(sum_value, 0) + coalesce(excluded.sum_value, 0),
+        last_value = CASE WHEN excluded.last_ts >= coalesce(last_ts, -1) THEN excluded.last_value ELSE last_value END,
+        last_ts = max(coalesce(last_ts, -1), coalesce(excluded.last_ts, -1)),
+        energy_kwh = energy_kwh + excluded.energy_kwh
+'''
+
+# The primary key serves per-DP range reads; retention and downsampling work on time slices
+# across all devices and DPs, which without this index would scan the whole table.
+_TIME_INDEX = "CREATE INDEX IF NOT EXISTS idx_rollup_{name}_bucket_ts ON rollup_{name} (bucket_ts)"
+
+
+def ensure_rollup_tables(cursor):
+    for name, _ in RESOLUTIONS:
+        cursor.execute(_TABLE_SCHEMA.format(name=name))
+        cursor.execute(_TIME_INDEX.format(name=name))
+
+
+def bucket_start(epoch_ts, seconds):
+    """Start of the bucket containing epoch_ts, aligned to local time (so daily buckets start at local midnight)."""
+    offset = time.localtime(epoch_ts).tm_gmtoff
+    return epoch_ts - (epoch_ts + offset) % seconds
+
+
+class RollupAggregator:
+    """Maintains the rollup tables incrementally from ingested samples.
+
+    Only used from the SQLite writer thread. Energy comes from `energy_integrator`
+    (an energy.EnergyIntegrator fed with every sample here), which integrates power
+    across batches and hands back per-minute kWh pieces for the buckets. Each batch
+    is staged on the integrator and committed with the writer transaction.
+    """
+
+    def __init__(self, energy_integrator):
+        self._energy = energy_integrator
+
+    def apply(self, conn, samples):
+        """Fold samples [(device_id, dp_code, epoch_ts, numeric value), ...] into every rollup table.
+
+        Returns the energy.EnergyBatch staged from the samples. Write its checkpoints in the same
+        transaction and call its commit() only after that transaction committed (SQLiteBatchWriter
+        does), so a retried batch is aggregated again from the same starting point.
+        """
+        partials = {name: {} for name, _ in RESOLUTIONS}
+        energy_batch = self._energy.begin()
+
+        def partial(name, seconds, device_id, dp_code, ts):
+            key = (device_id, dp_code, bucket_start(ts, seconds))
+            agg = partials[name].get(key)
+            if agg is None:
+                # [count, min, max, sum, last_value, last_ts, energy_kwh]
+                agg = partials[name][key] = [0, None, None, None, None, None, 0.0]
+            return agg
+
+        for device_id, dp_code, epoch_ts, value in sorted(samples, key=lambda s: s[2]):
+            for name, seconds in RESOLUTIONS:
+                agg = partial(name, seconds, device_id, dp_code, epoch_ts)
+                agg[0] += 1
+                agg[1] = value if agg[1] is None else min(agg[1], value)
+                agg[2] = value if agg[2] is None else max(agg[2], value)
+                agg[3] = value if agg[3] is None else agg[3] + value
+                if agg[5] is None or epoch_ts >= agg[5]:
+                    agg[4], agg[5] = value, epoch_ts
+
+            for piece_ts, kwh in energy_batch.add_sample(device_id, dp_code, epoch_ts, value):
+                for name, seconds in RESOLUTIONS:
+                    partial(name, seconds, device_id, dp_code, piece_ts)[6] += kwh
+
+        for name, _ in RESOLUTIONS:
+            rows = [key + tuple(agg) for key, agg in partials[name].items()]
+            if rows:
+                conn.executemany(_UPSERT.format(name=name), rows)
+        return energy_batch
+
+
+def pick_resolution(start_ts, end_ts, max_points=500):
+    """Finest resolution that covers [start_ts, end_ts) in at most max_points buckets (else the coarsest)."""
+    span = max(0, end_ts - start_ts)
+    for name, seconds in RESOLUTIONS:
+        if span / seconds <= max_points:
+            return name
+    return RESOLUTIONS[-1][0]
+
+
+def query(conn, device_id, dp_code, start_ts, end_ts, max_points=500, resolution=None):
+    """Bucketed series for one DP. Returns (resolution name, [row dict, ...]) oldest first."""
+    name = resolution or pick_resolution(start_ts, end_ts, max_points)
+    seconds = RESOLUTION_SECONDS[name]
+    rows = conn.execute(f'''
+        SELECT bucket_ts, sample_count, min_value, max_value,
+               CASE WHEN sample_count > 0 THEN sum_value / sample_count END,
+               last_value, energy_kwh
+        FROM rollup_{name}
+        WHERE device_id = ? AND dp_code = ? AND bucket_ts >= ? AND bucket_ts < ?
+        ORDER BY bucket_ts
+    ''', (device_id, dp_code, bucket_start(start_ts, seconds), end_ts)).fetchall()
+    columns = ("bucket_ts", "sample_count", "min", "max", "avg", "last", "energy_kwh")
+    return name, [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,162 @@
+# sheets_sink.py
+import random
+import threading
+
+import gspread
+import requests
+
+# HTTP statuses worth retrying: quota/rate limit and transient server errors.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable_error(exc):
+    if isinstance(exc, gspread.exceptions.APIError):
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class SheetsBatchSink:
+    """Buffers Google Sheets rows and appends them in batches on a timer.
+
+    Rows are tagged with the daily sheet they belong to when they are
+    submitted, so rows captured before midnight still land in that day's tab
+    even if the flush happens after it. The actual API calls are made through
+    `append_raw_rows(rows)` and `append_daily_rows(sheet_title, rows)`, which
+    should raise on failure; retryable errors (quota, 5xx, connection) are
+    retried with exponential backoff, and rows that still fail are kept for
+    the next flush (bounded by `max_buffer_rows`, oldest dropped first).
+    """
+
+    def __init__(self, append_raw_rows, append_daily_rows, flush_interval=60.0, batch_rows=500,
+                 max_buffer_rows=5000, max_retries=5, backoff_base=2.0, backoff_max=60.0):
+        self._append_raw_rows = append_raw_rows
+        self._append_daily_rows = append_daily_rows
+        self._flush_interval = max(1.0, float(flush_interval))
+        self._batch_rows = max(1, int(batch_rows))
+        self._max_buffer_rows = max(1, int(max_buffer_rows))
+        self._max_retries = max(0, int(max_retries))
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._raw_rows = []
+        self._daily_rows = {}  # sheet title -> [row, ...], insertion-ordered by day
+        self._stop_event = threading.Event()
+        self._flush_now = threading.Event()
+        self._thread = None
+
+        self.api_calls = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+    # --- Public API ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sheets-sink", daemon=True)
+        self._thread.start()
+        print(f"Sheets Sink: started (flush every {self._flush_interval}s).")
+
+    def submit(self, sheet_title, daily_row, raw_row=None):
+        with self._lock:
+            self._daily_rows.setdefault(sheet_title, []).append(daily_row)
+            if raw_row is not None:
+                self._raw_rows.append(raw_row)
+            self._trim_locked()
+
+    def flush(self):
+        """Ask the background thread to flush now (non-blocking)."""
+        self._flush_now.set()
+
+    def stop(self, timeout=30):
+        if not (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.set()
+        self._flush_now.set()
+        self._thread.join(timeout=timeout)
+        print(f"Sheets Sink: stopped (api_calls={self.api_calls}, rows_written={self.rows_written}, "
+              f"rows_dropped={self.rows_dropped}, pending={self.pending_rows()}).")
+
+    def pending_rows(self):
+        with self._lock:
+            return len(self._raw_rows) + sum(len(rows) for rows in self._daily_rows.values())
+
+    # --- Internals ---
+    def _trim_locked(self):
+        overflow = len(self._raw_rows) - self._max_buffer_rows
+        if overflow > 0:
+            del self._raw_rows[:overflow]
+            self.rows_dropped += overflow
+        daily_total = sum(len(rows) for rows in self._daily_rows.values())
+        while daily_total > self._max_buffer_rows:
+            oldest_title = next(iter(self._daily_rows))
+            rows = self._daily_rows[oldest_title]
+            excess = min(len(rows), daily_total - self._max_buffer_rows)
+            del rows[:excess]
+            daily_total -= excess
+            self.rows_dropped += excess
+            if not rows:
+                del self._daily_rows[oldest_title]
+
+    def _requeue(self, sheet_title, rows):
+        # Put rows that could not be written back in front of anything submitted meanwhile.
+        with self._lock:
+            if sheet_title is None:
+                self._raw_rows[:0] = rows
+            else:
+                newer = self._daily_rows.pop(sheet_title, [])
+                pending = {sheet_title: rows + newer}
+                pending.update(self._daily_rows)
+                self._daily_rows = pending
+            self._trim_locked()
+
+    def _call_with_retry(self, fn, *args):
+        attempt = 0
+        while True:
+            try:
+                self.api_calls += 1
+                fn(*args)
+                return True
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self._max_retries:
+                    print(f"Sheets Sink: append failed ({e}); will retry on next flush.")
+                    return False
+                delay = min(self._backoff_max, self._backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                attempt += 1
+                print(f"Sheets Sink: retryable error ({e}); retry {attempt}/{self._max_retries} in {delay:.1f}s.")
+                if self._stop_event.wait(delay) and attempt > 1:
+                    # Shutting down: one quick retry is all we allow.
+                    return False
+
+    def _flush_once(self):
+        with self._lock:
+            raw_rows, self._raw_rows = self._raw_rows, []
+            daily_rows, self._daily_rows = self._daily_rows, {}
+
+        for sheet_title, rows in daily_rows.items():
+            for start in range(0, len(rows), self._batch_rows):
+                chunk = rows[start:start + self._batch_rows]
+                if not self._call_with_retry(self._append_daily_rows, sheet_title, chunk):
+                    self._requeue(sheet_title, rows[start:])
+                    break
+                self.rows_written += len(chunk)
+
+        for start in range(0, len(raw_rows), self._batch_rows):
+            chunk = raw_rows[start:start + self._batch_rows]
+            if not self._call_with_retry(self._append_raw_rows, chunk):
+                self._requeue(None, raw_rows[start:])
+                break
+            self.rows_written += len(chunk)
+
+    def _run(self):
+        while True:
+            self._flush_now.wait(self._flush_interval)
+            self._flush_now.clear()
+            try:
+                self._flush_once()
+            except Exception as e:
+                print(f"Sheets Sink: unexpected error during flush: {e}")
+            if self._stop_event.is_set():
+                break
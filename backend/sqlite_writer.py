@@ -0,0 +1,148 @@
+# sqlite_writer.py
+import queue
+import sqlite3
+import threading
+import time
+
+# Sentinel pushed onto the queue to make the writer flush and exit.
+_STOP = object()
+
+
+class SQLiteBatchWriter:
+    """Write-behind SQLite writer.
+
+    Callers hand records to `submit()` and return immediately; a background
+    thread owns its own connection and writes the records in grouped
+    transactions. A batch is flushed once `batch_size` records are pending or
+    `flush_interval` seconds after the first pending record, whichever comes
+    first. `write_batch(conn, records)` does the actual SQL and runs inside a
+    single transaction per flush. It may return a callable, which is run only
+    once that transaction has committed: in-memory state derived from the batch
+    (running aggregates, last-written values) is applied there, so a rolled-back
+    or retried batch never sees state from an attempt that did not commit.
+    """
+
+    def __init__(self, db_file, write_batch, batch_size=500, flush_interval=2.0,
+                 max_queue_size=10000, put_timeout=0.5):
+        self._db_file = db_file
+        self._write_batch = write_batch
+        self._batch_size = max(1, int(batch_size))
+        self._flush_interval = max(0.05, float(flush_interval))
+        self._put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._thread = None
+
+        # Counters, only written by the writer thread (dropped_count by callers).
+        self.written_count = 0
+        self.dropped_count = 0
+        self.failed_batches = 0
+        self.failed_after_commit = 0  # committed batches whose after-commit callable raised
+
+    # --- Public API ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+        print(f"SQLite Writer: started (batch_size={self._batch_size}, flush_interval={self._flush_interval}s).")
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, records):
+        """Queue a list of records for writing. Returns False if the queue stayed full and they were dropped."""
+        if not records:
+            return True
+        try:
+            self._queue.put(list(records), timeout=self._put_timeout)
+            return True
+        except queue.Full:
+            self.dropped_count += len(records)
+            print(f"SQLite Writer: queue full, dropped {len(records)} record(s) (total dropped {self.dropped_count}).")
+            return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=10):
+        """Flush everything still queued and stop the writer thread."""
+        if not self.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print(f"SQLite Writer: queue still full after {timeout}s, abandoning {self.pending()} queued batch(es).")
+            return
+        self._thread.join(timeout=timeout)
+        print(f"SQLite Writer: stopped (written={self.written_count}, dropped={self.dropped_count}, "
+              f"failed_batches={self.failed_batches}, failed_after_commit={self.failed_after_commit}).")
+
+    # --- Writer thread ---
+    def _connect(self):
+        conn = sqlite3.connect(self._db_file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _flush(self, conn, batch):
+        committed = False
+        for attempt in range(2):
+            try:
+                with conn:  # one transaction per batch
+                    after_commit = self._write_batch(conn, batch)
+                committed = True
+                break
+            except sqlite3.OperationalError as e:
+                # Most likely "database is locked" by a reader/maintenance; retry once.
+                if attempt == 0:
+                    time.sleep(0.2)
+                    continue
+                print(f"SQLite Writer: Error writing batch of {len(batch)} record(s): {e}")
+            except Exception as e:
+                # Bad record (e.g. unparsable timestamp) or SQL error: drop this batch, keep the writer alive.
+                print(f"SQLite Writer: Error writing batch of {len(batch)} record(s): {e!r}")
+                break
+        if not committed:
+            self.failed_batches += 1
+            return
+
+        self.written_count += len(batch)
+        if after_commit is not None:
+            try:
+                after_commit()
+            except Exception as e:
+                # The rows are stored; only the in-memory state derived from them did not move.
+                self.failed_after_commit += 1
+                print(f"SQLite Writer: Error applying committed batch of {len(batch)} record(s): {e!r}")
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"SQLite Writer: Could not open '{self._db_file}': {e}")
+            return
+
+        pending = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = self._flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                pending.extend(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self._flush_interval
+
+            if pending and (stopping or len(pending) >= self._batch_size or time.monotonic() >= deadline):
+                self._flush(conn, pending)
+                pending = []
+                deadline = None
+
+        conn.close()
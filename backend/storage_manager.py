@@ -4,8 +4,17 @@ import gspread
 from google.oauth2.service_account import Credentials
 import time
 import datetime
+import functools
+import threading
 import json  # Ensure json is imported here at the top
 import app_config as env  # fallback source for SERVICE_ACCOUNT_FILE  # fallback source for SERVICE_ACCOUNT_FILE
+from sqlite_writer import SQLiteBatchWriter
+from sheets_sink import SheetsBatchSink
+import rollups
+import energy
+import deadband
+import data_processor
+from maintenance import StorageMaintenance
 
 # --- NEW: Get a direct reference to json.dumps ---
 _json_dumps_func = json.dumps
@@ -13,6 +22,17 @@ _json_dumps_func = json.dumps
 # --- Global connection objects ---
 _sqlite_conn = None
 _sqlite_cursor = None
+_sqlite_writer = None
+_sheets_sink = None
+_sqlite_read_lock = threading.Lock()
+_latest_snapshots = {}  # device_id -> most recent snapshot dict (in-process read model)
+_rollup_aggregator = None  # only used on the writer thread
+_energy_integrator = None  # fed by the writer thread, read by the dashboard
+_deadband_rules = None  # None stores every sample (DEADBAND_ENABLED = False)
+_deadband_filter = None  # only used on the writer thread
+_sheets_snapshots_sent = 0
+_sheets_snapshots_skipped = 0
+_storage_maintenance = None
 _gspread_gc = None
 _master_google_spreadsheet = None
 _dp_worksheets = {}
@@ -65,53 +85,450 @@ def initialize_storage(db_file, google_sheets_key_file, google_sheet_name, imper
 
     _setup_sqlite_db()
     _setup_google_sheets()
+    _start_sheets_sink()
+
+
+# --- SQLite Database Functions ---
+# device_data schema version, tracked in PRAGMA user_version.
+#   0: id/timestamp TEXT/dp_value REAL rowid table (strings such as "ON" mixed into dp_value)
+#   1: keyed by (device_id, dp_code, epoch_ts), integer timestamps, separate numeric/text values
+SQLITE_SCHEMA_VERSION = 1
+
+_DEVICE_DATA_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS device_data (
+        device_id TEXT NOT NULL,
+        dp_code TEXT NOT NULL,
+        epoch_ts INTEGER NOT NULL,
+        value_num REAL,
+        value_text TEXT,
+        dp_name TEXT,
+        dp_unit TEXT,
+        dp_type TEXT,
+        PRIMARY KEY (device_id, dp_code, epoch_ts)
+    ) WITHOUT ROWID
+'''
+# The clustered primary key already covers per-device/per-DP range scans; this one
+# serves time-wide scans (e.g. all DPs in a window, retention).
+_DEVICE_DATA_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_device_data_epoch_ts ON device_data (epoch_ts)",
+)
+
+
+def _migrate_device_data(cursor):
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(device_data)")]
+
+    if version < 1 and "timestamp" in columns:
+        print("Storage Manager: Migrating 'device_data' to the typed (device_id, dp_code, epoch_ts) schema...")
+        # Local-time TEXT timestamps -> epoch seconds; REAL/INTEGER values -> value_num, anything else -> value_text.
+        try:
+            cursor.executescript(f'''
+            BEGIN;
+            ALTER TABLE device_data RENAME TO device_data_v0;
+            {_DEVICE_DATA_SCHEMA};
+            INSERT OR REPLACE INTO device_data (device_id, dp_code, epoch_ts, value_num, value_text,
+                                                dp_name, dp_unit, dp_type)
+            SELECT device_id, dp_code, CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+                   CASE WHEN typeof(dp_value) IN ('integer', 'real') THEN dp_value END,
+                   CASE WHEN typeof(dp_value) IN ('text', 'blob') THEN CAST(dp_value AS TEXT) END,
+                   dp_name, dp_unit, dp_type
+            FROM device_data_v0 ORDER BY id;
+            DROP TABLE device_data_v0;
+            COMMIT;
+            ''')
+        except sqlite3.Error:
+            # Leave the v0 table as it was; the caller gives up on the database.
+            if cursor.connection.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        migrated = cursor.execute("SELECT count(*) FROM device_data").fetchone()[0]
+        print(f"Storage Manager: Migrated {migrated} row(s) to the new 'device_data' schema.")
+    else:
+        cursor.execute(_DEVICE_DATA_SCHEMA)
+
+    for statement in _DEVICE_DATA_INDEXES:
+        cursor.execute(statement)
+    cursor.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+
+
+# Writes go through a background SQLiteBatchWriter (own connection, WAL, batched transactions);
+# _sqlite_conn is used for schema setup and, under _sqlite_read_lock, for dashboard reads.
+def _enable_incremental_vacuum(cursor):
+    # The retention job frees pages with PRAGMA incremental_vacuum, which needs auto_vacuum=INCREMENTAL.
+    # A new database just takes the pragma. An existing one needs a full VACUUM to switch, which can take
+    # minutes on a large device_data table, so that is left to StorageMaintenance (STORAGE_VACUUM_CONVERSION).
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    if cursor.execute("SELECT count(*) FROM sqlite_master").fetchone()[0]:
+        if not getattr(env, 'STORAGE_VACUUM_CONVERSION', False):
+            print("Storage Manager: SQLite database is not in incremental auto-vacuum mode; freed pages are reused "
+                  "but not returned to the OS (set STORAGE_VACUUM_CONVERSION = True to convert it).")
+        return
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
 
-# --- SQLite Database Functions (Keep as is) ---
 def _setup_sqlite_db():
-    global _sqlite_conn, _sqlite_cursor
+    global _sqlite_conn, _sqlite_cursor, _sqlite_writer, _rollup_aggregator, _storage_maintenance
+    global _deadband_rules, _deadband_filter, _energy_integrator
     try:
         _sqlite_conn = sqlite3.connect(_db_file, check_same_thread=False)
         _sqlite_cursor = _sqlite_conn.cursor()
+        _enable_incremental_vacuum(_sqlite_cursor)
+        _sqlite_cursor.execute("PRAGMA journal_mode=WAL")
+        _migrate_device_data(_sqlite_cursor)
+        # Read model for the dashboard: one row per processed snapshot, same columns as the daily sheet.
+        _sqlite_cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                epoch_ts INTEGER NOT NULL,
+                device_id TEXT NOT NULL,
+                time_12hr TEXT,
+                breaker_switch TEXT,
+                voltage REAL,
+                frequency REAL,
+                current REAL,
+                active_power REAL,
+                power_factor REAL
+            )
+        ''')
+        _sqlite_cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_snapshot_data_device_ts ON snapshot_data (device_id, epoch_ts)")
+        # Time-wide scans: the dashboard's day view and the retention job's slices.
+        _sqlite_cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_data_epoch_ts ON snapshot_data (epoch_ts)")
+        # Alarm history: one row per fault code raised or cleared in a fault bitmap DP.
         _sqlite_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS device_data (
+            CREATE TABLE IF NOT EXISTS fault_events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
+                epoch_ts INTEGER NOT NULL,
                 device_id TEXT NOT NULL,
                 dp_code TEXT NOT NULL,
-                dp_name TEXT NOT NULL,
-                dp_value REAL, 
-                dp_unit TEXT,
-                dp_type TEXT
+                fault_code TEXT NOT NULL,
+                event TEXT NOT NULL,
+                bitmap INTEGER
             )
         ''')
+        _sqlite_cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fault_events_device_ts ON fault_events (device_id, epoch_ts)")
+        _sqlite_cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fault_events_code_ts ON fault_events (fault_code, epoch_ts)")
+        _sqlite_cursor.execute("CREATE INDEX IF NOT EXISTS idx_fault_events_epoch_ts ON fault_events (epoch_ts)")
+        # 1m/15m/1h/1d aggregates per DP, maintained by the writer as records are ingested.
+        rollups.ensure_rollup_tables(_sqlite_cursor)
+        # Running kWh per device and day, so today's energy survives restarts.
+        energy.ensure_checkpoint_table(_sqlite_cursor)
         _sqlite_conn.commit()
-        print(f"Storage Manager: SQLite database '{_db_file}' opened and table 'device_data' ensured.")
+        print(f"Storage Manager: SQLite database '{_db_file}' opened and tables 'device_data', 'snapshot_data', 'fault_events', 'energy_checkpoints' ensured.")
     except sqlite3.Error as e:
         print(f"Storage Manager: Error setting up SQLite database: {e}")
+        if _sqlite_conn is not None:
+            try:
+                if _sqlite_conn.in_transaction:
+                    _sqlite_conn.rollback()
+                _sqlite_conn.close()
+            except sqlite3.Error:
+                pass
         _sqlite_conn = None
         _sqlite_cursor = None
+        return
+
+    if _sqlite_writer is None or not _sqlite_writer.is_alive():
+        _energy_integrator = energy.EnergyIntegrator(
+            max_gap_seconds=int(getattr(env, 'ENERGY_MAX_GAP_SECONDS', 600)),
+            drift_tolerance_kwh=float(getattr(env, 'ENERGY_DRIFT_TOLERANCE_KWH', 0.05)),
+            drift_tolerance_ratio=float(getattr(env, 'ENERGY_DRIFT_TOLERANCE_RATIO', 0.05)),
+        )
+        try:
+            _energy_integrator.restore(energy.load_latest_checkpoints(_sqlite_conn))
+        except sqlite3.Error as e:
+            print(f"Storage Manager: Error loading energy checkpoints, starting from zero: {e}")
+        _rollup_aggregator = rollups.RollupAggregator(_energy_integrator)
+        _deadband_rules = deadband.rules_from_config(env)
+        _deadband_filter = deadband.DeadbandFilter(_deadband_rules) if _deadband_rules is not None else None
+        _sqlite_writer = SQLiteBatchWriter(
+            _db_file,
+            _write_batch,
+            batch_size=int(getattr(env, 'SQLITE_BATCH_SIZE', 500)),
+            flush_interval=float(getattr(env, 'SQLITE_FLUSH_INTERVAL_SECONDS', 2.0)),
+            max_queue_size=int(getattr(env, 'SQLITE_QUEUE_MAXSIZE', 10000)),
+        )
+        _sqlite_writer.start()
+
+    if _storage_maintenance is None:
+        _storage_maintenance = StorageMaintenance(
+            _db_file,
+            retention_days=getattr(env, 'STORAGE_RETENTION_DAYS', None),
+            interval_seconds=int(getattr(env, 'STORAGE_MAINTENANCE_INTERVAL_SECONDS', 3600)),
+            convert_to_incremental_vacuum=bool(getattr(env, 'STORAGE_VACUUM_CONVERSION', False)),
+        )
+        _storage_maintenance.start()
+
+
+# Writer queue items are (kind, payload) tuples so DP records, snapshots and fault events share one transaction.
+_ITEM_DP_RECORD = "dp"
+_ITEM_SNAPSHOT = "snapshot"
+_ITEM_FAULT_EVENT = "fault"
+
+# Snapshot dict keys, in snapshot_data column order (after epoch_ts/device_id/time_12hr).
+_SNAPSHOT_VALUE_KEYS = ("Breaker Switch", "Voltage (V)", "Frequency (Hz)", "Current (A)", "Active Power (kW)",
+                        "Power Factor")
+
+
+@functools.lru_cache(maxsize=1024)  # every record of a snapshot shares its timestamp
+def _timestamp_to_epoch(timestamp):
+    return int(time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S')))
+
+
+def _numeric_or_none(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _split_value(value):
+    """(value_num, value_text) columns for a DP value."""
+    if isinstance(value, bool):
+        return int(value), None
+    if isinstance(value, (int, float)):
+        return value, None
+    if value is None:
+        return None, None
+    return None, value if isinstance(value, str) else _json_dumps_func(value)
+
+
+# Runs on the writer thread inside a single transaction; returns what to run once it has committed.
+def _write_batch(conn, items):
+    dp_rows = []
+    snapshot_rows = []
+    fault_rows = []
+    rollup_samples = []
+    deadband_batch = _deadband_filter.begin() if _deadband_filter is not None else None
+    for kind, payload in items:
+        if kind == _ITEM_DP_RECORD:
+            r = payload
+            epoch_ts = _timestamp_to_epoch(r['timestamp'])
+            # Rollups (and so energy) see every sample; the deadband only thins out the raw rows.
+            numeric_value = _numeric_or_none(r['dp_value_save'])
+            if numeric_value is not None and r['dp_type'] != "Bitmap":  # min/avg of a bitmap means nothing
+                rollup_samples.append((r['device_id'], r['dp_code'], epoch_ts, numeric_value))
+            if deadband_batch is None or deadband_batch.should_store(r['device_id'], r['dp_code'], epoch_ts,
+                                                                     r['dp_value_save']):
+                dp_rows.append((r['device_id'], r['dp_code'], epoch_ts, *_split_value(r['dp_value_save']),
+                                r['dp_name'], r['dp_unit'], r['dp_type']))
+        elif kind == _ITEM_SNAPSHOT:
+            snap = payload
+            snapshot_rows.append((_timestamp_to_epoch(snap['timestamp']), snap['device_id'], snap['time_12hr'],
+                                  snap['Breaker Switch'],
+                                  *(_numeric_or_none(snap[key]) for key in _SNAPSHOT_VALUE_KEYS[1:])))
+        elif kind == _ITEM_FAULT_EVENT:
+            e = payload
+            fault_rows.append((_timestamp_to_epoch(e['timestamp']), e['device_id'], e['dp_code'], e['fault_code'],
+                               e['event'], e['bitmap']))
+    if dp_rows:
+        # Same DP reported twice in one second (e.g. MQTT and a poll): keep the later one.
+        conn.executemany('''
+            INSERT OR REPLACE INTO device_data (device_id, dp_code, epoch_ts, value_num, value_text,
+                                                dp_name, dp_unit, dp_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', dp_rows)
+    if snapshot_rows:
+        conn.executemany('''
+            INSERT INTO snapshot_data (epoch_ts, device_id, time_12hr, breaker_switch, voltage, frequency, current,
+                                       active_power, power_factor)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', snapshot_rows)
+    if fault_rows:
+        conn.executemany('''
+            INSERT INTO fault_events (epoch_ts, device_id, dp_code, fault_code, event, bitmap)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', fault_rows)
+    # In-memory state (deadband references, running energy) only moves once this transaction commits.
+    after_commit = [deadband_batch.commit] if deadband_batch is not None else []
+    if rollup_samples and _rollup_aggregator is not None:
+        energy_batch = _rollup_aggregator.apply(conn, rollup_samples)
+        energy.write_checkpoints(conn, energy_batch)
+        after_commit.append(energy_batch.commit)
+
+    def commit_state():
+        for callback in after_commit:
+            callback()
+    return commit_state
+
+
+def insert_records_into_sqlite(data_records):
+    """Queue a list of DP records for the background writer (non-blocking unless the queue is full)."""
+    if _sqlite_writer is None:
+        return False
+    return _sqlite_writer.submit([(_ITEM_DP_RECORD, record) for record in data_records])
 
 
 def insert_data_into_sqlite(data_record):
-    if _sqlite_conn is None or _sqlite_cursor is None:
+    return insert_records_into_sqlite([data_record])
+
+
+def insert_snapshot_into_sqlite(snapshot_data):
+    """Update the in-process latest-value cache and queue the snapshot and its fault events for SQLite."""
+    _latest_snapshots[snapshot_data['device_id']] = snapshot_data
+    if _sqlite_writer is None:
         return False
+    items = [(_ITEM_SNAPSHOT, snapshot_data)]
+    items.extend((_ITEM_FAULT_EVENT, event) for event in snapshot_data.get('fault_events') or ())
+    return _sqlite_writer.submit(items)
+
+
+# --- Local read model (used by the dashboard instead of Google Sheets) ---
+def query_device_data(device_id, dp_code, start_ts, end_ts, limit=None):
+    """Raw samples of one DP with start_ts <= epoch_ts < end_ts, oldest first (primary-key range seek).
+
+    Each row is {"epoch_ts", "value"}; value is the numeric value when there is one, else the text value.
+    """
+    if _sqlite_conn is None:
+        return []
+    query = '''
+        SELECT epoch_ts, coalesce(value_num, value_text) FROM device_data
+        WHERE device_id = ? AND dp_code = ? AND epoch_ts >= ? AND epoch_ts < ?
+        ORDER BY epoch_ts
+    '''
+    params = [device_id, dp_code, int(start_ts), int(end_ts)]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
     try:
-        _sqlite_cursor.execute('''
-            INSERT INTO device_data (timestamp, device_id, dp_code, dp_name, dp_value, dp_unit, dp_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (data_record['timestamp'], data_record['device_id'], data_record['dp_code'],
-              data_record['dp_name'], data_record['dp_value_save'], data_record['dp_unit'], data_record['dp_type']))
-        _sqlite_conn.commit()
-        return True
+        with _sqlite_read_lock:
+            rows = _sqlite_conn.execute(query, params).fetchall()
     except sqlite3.Error as e:
-        print(f"Storage Manager: Error inserting data into SQLite DB: {e}")
-        return False
+        print(f"Storage Manager: Error reading device data from SQLite DB: {e}")
+        return []
+    return [{"epoch_ts": epoch_ts, "value": value} for epoch_ts, value in rows]
+
+
+def query_rollups(device_id, dp_code, start_ts, end_ts, max_points=500, resolution=None):
+    """Bucketed min/max/avg/last/energy for one DP between two epoch timestamps.
+
+    Uses the finest rollup resolution that returns at most max_points buckets,
+    unless `resolution` ("1m", "15m", "1h", "1d") is given. Returns (resolution, rows).
+    """
+    if _sqlite_conn is None:
+        return None, []
+    try:
+        with _sqlite_read_lock:
+            return rollups.query(_sqlite_conn, device_id, dp_code, start_ts, end_ts, max_points, resolution)
+    except sqlite3.Error as e:
+        print(f"Storage Manager: Error reading rollups from SQLite DB: {e}")
+        return None, []
+
+
+def query_fault_events(device_id=None, start_ts=None, end_ts=None, fault_code=None, limit=None):
+    """Fault raised/cleared events, newest first, optionally filtered by device, time range and fault code.
+
+    Each row is {"epoch_ts", "device_id", "dp_code", "fault_code", "event", "bitmap"}.
+    """
+    if _sqlite_conn is None:
+        return []
+    conditions = []
+    params = []
+    for condition, value in (("device_id = ?", device_id), ("epoch_ts >= ?", start_ts), ("epoch_ts < ?", end_ts),
+                             ("fault_code = ?", fault_code)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    query = "SELECT epoch_ts, device_id, dp_code, fault_code, event, bitmap FROM fault_events"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY epoch_ts DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    try:
+        with _sqlite_read_lock:
+            rows = _sqlite_conn.execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Storage Manager: Error reading fault events from SQLite DB: {e}")
+        return []
+    return [{"epoch_ts": epoch_ts, "device_id": dev_id, "dp_code": dp_code, "fault_code": fault_code,
+             "event": event, "bitmap": bitmap} for epoch_ts, dev_id, dp_code, fault_code, event, bitmap in rows]
+
+
+def get_today_energy(device_id=None):
+    """Energy used since local midnight, for one device or all of them; a lookup, not a scan of today's samples.
+
+    Returns {"kwh", "meter_kwh", "drift_kwh", "gap_seconds", "updated_ts"} or None. "kwh" is integrated
+    from Active Power; "meter_kwh" is what the meter's total_forward_energy register counted over the part
+    of the day it reported, and "drift_kwh" the difference between the two over that same window.
+    """
+    if _energy_integrator is not None:
+        return _energy_integrator.get_today(device_id)
+    return get_day_energy(datetime.date.today(), device_id)
+
+
+def get_day_energy(day, device_id=None):
+    """Energy totals of a calendar day (datetime.date) from the last stored checkpoint; same dict as get_today_energy."""
+    if _sqlite_conn is None:
+        return None
+    try:
+        with _sqlite_read_lock:
+            return energy.query_day(_sqlite_conn, int(time.mktime(day.timetuple())), device_id)
+    except sqlite3.Error as e:
+        print(f"Storage Manager: Error reading energy checkpoints from SQLite DB: {e}")
+        return None
+
+
+def get_write_stats():
+    """How many raw DP rows and Sheets snapshots were written or skipped by the deadband rules."""
+    return {
+        "device_data": _deadband_filter.stats() if _deadband_filter is not None else None,
+        "sheets_snapshots": {"sent": _sheets_snapshots_sent, "skipped": _sheets_snapshots_skipped},
+    }
+
+
+def is_local_store_available():
+    return _sqlite_conn is not None
+
+
+def _snapshot_to_daily_record(snapshot_data):
+    record = {"Time": snapshot_data["time_12hr"]}
+    for key in _SNAPSHOT_VALUE_KEYS:
+        record[key] = snapshot_data.get(key, "N/A")
+    return record
+
+
+def get_latest_snapshot_record(device_id=None):
+    """Latest snapshot as a daily-sheet style dict ("Time", "Voltage (V)", ...), from memory when possible."""
+    if device_id is not None:
+        snapshot_data = _latest_snapshots.get(device_id)
+    else:
+        snapshot_data = max(_latest_snapshots.values(), key=lambda snap: snap['timestamp'], default=None)
+    if snapshot_data is not None:
+        return _snapshot_to_daily_record(snapshot_data)
+
+    records = get_snapshot_records(datetime.date.today(), device_id)
+    return records[-1] if records else None
+
+
+def get_snapshot_records(day, device_id=None):
+    """All snapshots stored for a calendar day (datetime.date), oldest first, as daily-sheet style dicts."""
+    if _sqlite_conn is None:
+        return []
+    start_ts = int(time.mktime(day.timetuple()))
+    end_ts = int(time.mktime((day + datetime.timedelta(days=1)).timetuple()))
+    query = '''
+        SELECT time_12hr, breaker_switch, voltage, frequency, current, active_power, power_factor
+        FROM snapshot_data WHERE epoch_ts >= ? AND epoch_ts < ?
+    '''
+    params = [start_ts, end_ts]
+    if device_id is not None:
+        query += " AND device_id = ?"
+        params.append(device_id)
+    query += " ORDER BY epoch_ts, id"
+    try:
+        with _sqlite_read_lock:
+            rows = _sqlite_conn.execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Storage Manager: Error reading snapshots from SQLite DB: {e}")
+        return []
+    return [dict(zip(DAILY_SHEET_HEADERS, row)) for row in rows]
 
 
 # --- Google Sheets Functions (MODIFIED TO ENSURE ORDER/DEFINITIONS) ---
 # _get_or_create_daily_worksheet is defined BEFORE _setup_google_sheets to ensure header visibility
-def _get_or_create_daily_worksheet():
+def _get_or_create_daily_worksheet(date_str=None):
     global _current_daily_worksheet, _last_checked_date_str
 
     if _master_google_spreadsheet is None:
@@ -119,24 +536,29 @@ def _get_or_create_daily_worksheet():
         return None
 
     today_date_str = datetime.datetime.now().strftime('%d/%m/%Y')
+    if date_str is None:
+        date_str = today_date_str
 
-    if _current_daily_worksheet and _current_daily_worksheet.title == today_date_str:
+    if _current_daily_worksheet and _current_daily_worksheet.title == date_str:
         return _current_daily_worksheet
 
-    print(f"Storage Manager: Checking for/creating daily sheet for {today_date_str}...")
+    print(f"Storage Manager: Checking for/creating daily sheet for {date_str}...")
     try:
-        worksheet = _master_google_spreadsheet.worksheet(today_date_str)
-        print(f"Storage Manager: Found existing sheet '{today_date_str}'.")
+        worksheet = _master_google_spreadsheet.worksheet(date_str)
+        print(f"Storage Manager: Found existing sheet '{date_str}'.")
     except gspread.exceptions.WorksheetNotFound:
-        print(f"Storage Manager: Creating new sheet '{today_date_str}'...")
-        worksheet = _master_google_spreadsheet.add_worksheet(title=today_date_str, rows="1000", cols="20")
+        print(f"Storage Manager: Creating new sheet '{date_str}'...")
+        worksheet = _master_google_spreadsheet.add_worksheet(title=date_str, rows="1000", cols="20")
 
     if not worksheet.row_values(1):
         worksheet.append_row(DAILY_SHEET_HEADERS)  # <--- DAILY_SHEET_HEADERS is used here
-        print(f"Storage Manager: Headers added to '{today_date_str}'.")
+        print(f"Storage Manager: Headers added to '{date_str}'.")
 
-    _last_checked_date_str = today_date_str
-    _current_daily_worksheet = worksheet
+    # Only today's sheet becomes the cached "current" one; late flushes of
+    # yesterday's rows must not roll the pointer backwards.
+    if date_str == today_date_str:
+        _last_checked_date_str = today_date_str
+        _current_daily_worksheet = worksheet
     return worksheet
 
 
@@ -220,42 +642,73 @@ def _setup_google_sheets():
         _current_daily_worksheet = None
 
 
-def insert_data_into_google_sheet(snapshot_data):
-    global _master_google_spreadsheet, _current_daily_worksheet, _last_checked_date_str
-
+# --- Buffered Google Sheets writes ---
+# insert_data_into_google_sheet only buffers rows; SheetsBatchSink flushes them on a timer
+# with append_rows, calling the two helpers below from its own thread.
+def _start_sheets_sink():
+    global _sheets_sink
+    if _sheets_sink is not None:
+        return
+    _sheets_sink = SheetsBatchSink(
+        _append_raw_rows,
+        _append_daily_rows,
+        flush_interval=float(getattr(env, 'GOOGLE_SHEETS_FLUSH_INTERVAL_SECONDS', 60)),
+        batch_rows=int(getattr(env, 'GOOGLE_SHEETS_BATCH_ROWS', 500)),
+        max_buffer_rows=int(getattr(env, 'GOOGLE_SHEETS_MAX_BUFFER_ROWS', 5000)),
+    )
+    _sheets_sink.start()
+
+
+def _ensure_google_sheets_connected():
     if _master_google_spreadsheet is None:
         print("Storage Manager: Master Google Sheet not connected. Attempting to reconnect...")
         _setup_google_sheets()  # Try to reconnect
         if _master_google_spreadsheet is None:
-            print("Storage Manager: Still cannot connect to Google Sheets. Skipping insert.")
-            return False
+            raise ConnectionError("Still cannot connect to Google Sheets.")
+
+
+def _append_raw_rows(rows):
+    _ensure_google_sheets_connected()
+    if _raw_log_worksheet:
+        _raw_log_worksheet.append_rows(rows)
+
+
+def _append_daily_rows(sheet_title, rows):
+    _ensure_google_sheets_connected()
+    worksheet = _get_or_create_daily_worksheet(sheet_title)
+    if worksheet is None:
+        raise ConnectionError(f"Failed to get/create daily sheet '{sheet_title}'.")
+    worksheet.append_rows(rows)
+    print(f"Storage Manager: Appended {len(rows)} row(s) to Google Sheet '{sheet_title}'.")
+
+
+def insert_data_into_google_sheet(snapshot_data):
+    global _sheets_snapshots_sent, _sheets_snapshots_skipped
+    if _sheets_sink is None:
+        print("Storage Manager: Google Sheets sink not started. Skipping insert.")
+        return False
+
+    # Change-only: skip snapshots that match the last one sent for the device within the deadbands.
+    if _deadband_rules is not None and not data_processor.claim_sheets_snapshot(
+            snapshot_data, _deadband_rules, _timestamp_to_epoch(snapshot_data['timestamp'])):
+        _sheets_snapshots_skipped += 1
+        return True
+    _sheets_snapshots_sent += 1
 
     try:
-        # Check for daily sheet rotation
-        today_date_str = datetime.datetime.now().strftime('%d/%m/%Y')
-        if today_date_str != _last_checked_date_str or _current_daily_worksheet is None:
-            print(
-                f"Storage Manager: New day detected ({today_date_str}) or worksheet missing. Switching to new daily sheet...")
-            _current_daily_worksheet = _get_or_create_daily_worksheet()
-
-        if _current_daily_worksheet is None:
-            print("Storage Manager: Failed to get/create daily sheet. Skipping Google Sheets insert.")
-            return False
-
-        # Insert into Raw Log Sheet (if available)
-        if _raw_log_worksheet:
-            raw_log_row = [
-                snapshot_data['timestamp'],
-                snapshot_data['device_id'],
-                _json_dumps_func(snapshot_data['dp_code_raw']),
-                "Snapshot Data",
-                "Multiple Values",
-                "Various",
-                "Snapshot"
-            ]
-            _raw_log_worksheet.append_row(raw_log_row)
-
-        # Insert into Current Daily Sheet
+        # The daily tab is chosen from the snapshot's own timestamp, so a flush after
+        # midnight still writes the previous day's rows into the previous day's tab.
+        sheet_title = datetime.datetime.strptime(snapshot_data['timestamp'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y')
+
+        raw_log_row = [
+            snapshot_data['timestamp'],
+            snapshot_data['device_id'],
+            _json_dumps_func(snapshot_data['dp_code_raw']),
+            "Snapshot Data",
+            "Multiple Values",
+            "Various",
+            "Snapshot"
+        ]
         daily_row = [
             snapshot_data["time_12hr"],
             snapshot_data["Breaker Switch"],
@@ -265,17 +718,30 @@ def insert_data_into_google_sheet(snapshot_data):
             snapshot_data["Active Power (kW)"],
             snapshot_data["Power Factor"]
         ]
-        _current_daily_worksheet.append_row(daily_row)
-        print(f"Storage Manager: Successfully inserted data to Google Sheets at {snapshot_data['time_12hr']}")
+        _sheets_sink.submit(sheet_title, daily_row, raw_log_row)
         return True
 
     except Exception as e:
-        print(f"Storage Manager: Error inserting data into Google Sheet: {e}")
+        print(f"Storage Manager: Error buffering data for Google Sheet: {e}")
         return False
 
 
-# --- Cleanup Function (Keep as is) ---
+# --- Cleanup Function ---
 def close_storage():
+    global _sqlite_writer, _sheets_sink, _storage_maintenance
+    if _storage_maintenance:
+        _storage_maintenance.stop()
+        _storage_maintenance = None
+    if _sheets_sink:
+        _sheets_sink.stop()  # final flush of buffered rows
+        _sheets_sink = None
+    if _sqlite_writer:
+        _sqlite_writer.stop()  # flushes anything still queued
+        _sqlite_writer = None
+        if _deadband_filter is not None:
+            print(f"Storage Manager: deadband stored {_deadband_filter.stored} and skipped "
+                  f"{_deadband_filter.skipped} DP rows; Sheets snapshots sent {_sheets_snapshots_sent}, "
+                  f"skipped {_sheets_snapshots_skipped}.")
     if _sqlite_conn:
         _sqlite_conn.close()
         print("Storage Manager: SQLite database connection closed.")
@@ -1,33 +1,63 @@
 # tuya_client.py
 
 import logging
-import json
 import time
 import threading
 import datetime
-from tuya_iot import TuyaOpenAPI, TuyaOpenMQ, TUYA_LOGGER
+import functools
+from tuya_iot import TuyaOpenAPI, TuyaOpenMQ, RateLimiter, TUYA_LOGGER
+from tuya_iot.ratelimit import DEFAULT_RATE_LIMIT_CODES
 import app_config as env
 import data_processor
+import device_state
 import storage_manager
+from ingest_pipeline import MqttIngestPipeline
+from poll_scheduler import PollScheduler
 
 TUYA_DEVICE_OFFLINE_CODE = 1106  # Common code for "device is offline"
 TUYA_TOKEN_INVALID_CODE = 1010  # Code for "token invalid"
 
+# Batch endpoints used in fleet-poll mode (both take a comma-separated device_ids parameter)
+FLEET_DEVICES_API = "/v1.0/devices"  # device details incl. online flag (and usually status)
+FLEET_STATUS_API = "/v1.0/iot-03/devices/status"  # DP status for many devices
+
 # --- Global Tuya API and MQTT objects ---
 _openapi = None
 _openmq = None
-_polling_thread = None
+_poll_scheduler = None
 _heartbeat_thread = None
+_ingest_pipeline = None
 
 
 # --- Initialization and Connection ---
 _api_lock = threading.Lock()
 
 
+def _build_rate_limiter():
+    """Client-side pacing for all Tuya API calls; TUYA_ENDPOINT_RATE_LIMITS is {path prefix: (rate, burst)}."""
+    return RateLimiter(
+        rate=float(getattr(env, 'TUYA_RATE_LIMIT_PER_SECOND', 10)),
+        burst=float(getattr(env, 'TUYA_RATE_LIMIT_BURST', 20)),
+        endpoint_budgets=getattr(env, 'TUYA_ENDPOINT_RATE_LIMITS', None),
+        rate_limit_codes=getattr(env, 'TUYA_RATE_LIMIT_CODES', DEFAULT_RATE_LIMIT_CODES),
+    )
+
+
 def initialize_tuya_client():
     global _openapi
     with _api_lock:  # Thread-safe initialization
-        _openapi = TuyaOpenAPI(env.ENDPOINT, env.ACCESS_ID, env.ACCESS_KEY)
+        if _openapi is None:
+            # Created once; later calls only log in again, keeping the pooled keep-alive connections.
+            _openapi = TuyaOpenAPI(
+                env.ENDPOINT, env.ACCESS_ID, env.ACCESS_KEY,
+                token_refresh_margin=int(getattr(env, 'TUYA_TOKEN_REFRESH_MARGIN_SECONDS', 300)),
+                pool_maxsize=int(getattr(env, 'TUYA_HTTP_POOL_SIZE', max(10, 2 * int(getattr(env, 'POLL_WORKERS', 4))))),
+                max_retries=int(getattr(env, 'TUYA_HTTP_MAX_RETRIES', 3)),
+                connect_timeout=float(getattr(env, 'TUYA_HTTP_CONNECT_TIMEOUT_SECONDS', 5)),
+                read_timeout=float(getattr(env, 'TUYA_HTTP_READ_TIMEOUT_SECONDS', 15)),
+                rate_limiter=_build_rate_limiter(),
+                rate_limit_timeout=getattr(env, 'TUYA_RATE_LIMIT_TIMEOUT_SECONDS', None),
+            )
         print("Tuya Client: Attempting to connect to Tuya Cloud API...")
         connect_response = _openapi.connect(env.USERNAME, env.PASSWORD, "eu", "tuyasmart")
         print(f"Tuya Client: Connect response: {connect_response}")
@@ -41,7 +71,7 @@ def initialize_tuya_client():
 
 
 def start_mqtt_listener():
-    global _openmq
+    global _openmq, _ingest_pipeline
     with _api_lock:  # Thread-safe MQTT startup
         if _openapi is None or _openapi.token_info is None:
             print("Tuya Client: OpenAPI not properly initialized. Cannot start MQTT listener.")
@@ -60,11 +90,20 @@ def start_mqtt_listener():
                 print(f"Tuya Client: Error stopping existing MQTT listener: {exc}")
             _openmq = None
 
+        if _ingest_pipeline is None:
+            _ingest_pipeline = MqttIngestPipeline(
+                maxsize=int(getattr(env, 'MQTT_INGEST_QUEUE_SIZE', 1000)),
+                overflow=getattr(env, 'MQTT_INGEST_OVERFLOW', 'drop_oldest'),
+            )
+            _ingest_pipeline.start()
+
         print("Tuya Client: Starting MQTT listener...")
         _openmq = TuyaOpenMQ(_openapi)
-        _openmq.add_message_listener(_on_message_callback)
+        # The ingest pipeline is the only queue between the network thread and storage, so its
+        # overflow policy (MQTT_INGEST_OVERFLOW) is the single place messages can be dropped.
+        _openmq.add_message_listener(_on_message_callback, inline=True)
         _openmq.start()
-        print(f"Tuya Client: Listening for real-time MQTT updates for device: {env.DEVICE_ID}... alive={_openmq.is_alive()}")
+        print(f"Tuya Client: Listening for real-time MQTT updates for devices: {', '.join(get_device_ids())}... alive={_openmq.is_alive()}")
         # Start a lightweight heartbeat thread to print online status frequently (no Sheets writes)
         try:
             start_heartbeat_loop()
@@ -73,27 +112,13 @@ def start_mqtt_listener():
         return True
 
 
-# --- MQTT Listener Callback (Only Prints, No Storage Insertions) ---
+# --- MQTT Listener Callback ---
+# Runs on the MQTT network thread (inline listener) and only enqueues; decoding,
+# normalisation and SQLite persistence happen on the ingest pipeline's worker threads.
 def _on_message_callback(msg):
     try:
-        message_data = msg
-        current_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-
-        if 'data' in message_data and 'status' in message_data['data']:
-            dev_id = message_data['data'].get('devId')
-            raw_dp_list = message_data['data'].get('status', [])
-            snapshot, individual_dp_records = data_processor.process_device_data_snapshot(dev_id, raw_dp_list,
-                                                                                          current_timestamp)
-            print(f"\nTuya Client: --- Received MQTT Device Data Update ({current_timestamp}) ---")
-            data_processor.print_clean_snapshot(snapshot)  # Print to console
-
-            # SQLite insertion for MQTT data (if desired) - currently commented out
-            # for record in individual_dp_records:
-            #     storage_manager.insert_data_into_sqlite(record)
-        else:
-            print(
-                f"\nTuya Client: --- Received Other MQTT Message (Protocol: {message_data.get('protocol', 'N/A')}) ---")
-            print(json.dumps(message_data, indent=2))
+        if _ingest_pipeline is not None:
+            _ingest_pipeline.submit(msg)
     except Exception as e:
         print(f"Tuya Client: An error occurred in MQTT callback: {e} - Message: {msg}")
 
@@ -104,114 +129,251 @@ def _on_message_callback(msg):
 # Function to Start MQTT Listener (This is what main.py calls)
 
 
-# --- MODIFIED Polling Function with Device Online Status Check ---
-def _get_device_status_poll():
-    global _openapi  # Make sure _openapi is global to re-assign if needed
+# --- Device list (single DEVICE_ID or a DEVICE_IDS list in app_config) ---
+def get_device_ids():
+    device_ids = getattr(env, 'DEVICE_IDS', None) or [env.DEVICE_ID]
+    return list(dict.fromkeys(device_ids))  # de-duplicate, keep order
+
+
+def _get_poll_interval(device_id):
+    intervals = getattr(env, 'DEVICE_POLL_INTERVALS', None) or {}
+    return float(intervals.get(device_id, env.POLLING_INTERVAL_SECONDS))
+
+
+# --- API helper ---
+# TuyaOpenAPI refreshes the token before it expires and, on a token-invalid response,
+# logs in again (once, shared by all threads) and retries the call itself.
+def _api_get(path, description, params=None):
+    response = _openapi.get(path, params) if _openapi is not None else None
+    if response and response.get("success"):
+        return response
+
+    error_code = response.get("code") if response else None
+    error_msg = response.get("msg") if response else "no response"
+    print(f"Tuya Client: {description} API call FAILED. Code: {error_code}, Message: {error_msg}")
+    if error_code == TUYA_TOKEN_INVALID_CODE:
+        print(f"Tuya Client: Token still invalid after the client's re-login; cannot get {description}.")
+    return None
+
+
+# --- Device-state probe: the one place that asks Tuya whether devices are online ---
+# Run by the heartbeat thread; results go to device_state, where the pollers and the
+# dashboard read them instead of fetching /v1.0/devices/{id} again. The fleet poll and
+# MQTT also record online flags there, and the heartbeat skips devices they kept fresh.
+def _state_max_age():
+    default = 2 * int(getattr(env, 'HEARTBEAT_INTERVAL_SECONDS', 30))
+    return float(getattr(env, 'DEVICE_STATE_MAX_AGE_SECONDS', default))
+
+
+def _mqtt_fresh_seconds(device_id):
+    return float(getattr(env, 'MQTT_FRESH_SECONDS', _get_poll_interval(device_id)))
+
+
+def probe_device_states(device_ids):
+    """Fetch online flags (one call per device, or per fleet batch) and cache them. Returns {device_id: online}."""
+    results = {}
+    if _openapi is None:
+        return results
+    batch_size = max(1, int(getattr(env, 'FLEET_POLL_BATCH_SIZE', 20)))
+    for i in range(0, len(device_ids), batch_size):
+        batch = device_ids[i:i + batch_size]
+        if len(batch) == 1:
+            device_info = _api_get(f"/v1.0/devices/{batch[0]}", "device info")
+            if device_info is not None:
+                results[batch[0]] = device_info.get("result", {}).get("online", False)
+        else:
+            response = _api_get(FLEET_DEVICES_API, "fleet device info", {"device_ids": ",".join(batch)})
+            for item in _result_items(response, "devices", "list"):
+                if item.get("id") in batch:
+                    results[item["id"]] = item.get("online", False)
+
+    checked_at = time.time()
+    for device_id, is_online in results.items():
+        device_state.record_online(device_id, is_online, checked_at)
+    return results
+
+
+# --- Polling Function with Device Online Status Check ---
+def _get_device_status_poll(device_id=None):
+    device_id = device_id or env.DEVICE_ID
 
     if _openapi is None:
         print("Tuya Client: OpenAPI not initialized for polling.")
         return False
 
-    print(f"\nTuya Client: --- Polling status for device: {env.DEVICE_ID} ---")
-
-    # NEW: Check device online status FIRST
-    print("Tuya Client: Checking device online status...")
-    device_info = _openapi.get(f"/v1.0/devices/{env.DEVICE_ID}")
-
-    # Handle API errors for device info request
-    if not device_info.get("success"):
-        error_code = device_info.get("code")
-        error_msg = device_info.get("msg")
-        print(f"Tuya Client: Device info API call FAILED. Code: {error_code}, Message: {error_msg}")
-
-        # If token is invalid, force a full re-initialization (re-login)
-        if error_code == TUYA_TOKEN_INVALID_CODE:
-            print("Tuya Client: Token invalid detected. Forcing full API client re-initialization (re-login).")
-            if not initialize_tuya_client():
-                print("Tuya Client: Failed to re-initialize client after token invalid. Cannot poll.")
-                return False
-
-            # Retry device info call after re-login
-            device_info = _openapi.get(f"/v1.0/devices/{env.DEVICE_ID}")
-            if not device_info.get("success"):
-                print("Tuya Client: Still failed to get device info after re-login.")
-                return False
-        else:
-            print("Tuya Client: Failed to get device info (not token issue).")
-            return False
+    print(f"\nTuya Client: --- Polling status for device: {device_id} ---")
 
-    # Check if device is online
-    is_online = device_info.get("result", {}).get("online", False)
+    # Online flag from the shared probe; only probe here when the cached state is stale
+    is_online = device_state.get_online(device_id, _state_max_age())
+    if is_online is None:
+        is_online = probe_device_states([device_id]).get(device_id)
+        if is_online is None:
+            return False
     current_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
 
     if not is_online:
-        print(f"Tuya Client: Device {env.DEVICE_ID} is OFFLINE. Using offline snapshot ({current_timestamp}).")
-        snapshot, individual_dp_records = data_processor.get_offline_snapshot(env.DEVICE_ID, current_timestamp)
-        data_processor.print_clean_snapshot(snapshot)
-        storage_manager.insert_data_into_google_sheet(snapshot)
-        for record in individual_dp_records:
-            storage_manager.insert_data_into_sqlite(record)
+        _handle_device_status(device_id, False, None, current_timestamp)
+        return True
+
+    if device_state.has_fresh_mqtt_data(device_id, _mqtt_fresh_seconds(device_id)):
+        # MQTT already delivered this interval's data; snapshot the last known state without a status call
+        print(f"Tuya Client: Device {device_id} has fresh MQTT data. Skipping status call.")
+        _handle_device_status(device_id, True, [], current_timestamp)
         return True
 
     # Device is online, proceed with normal status polling
-    print(f"Tuya Client: Device {env.DEVICE_ID} is ONLINE. Proceeding with status polling...")
-    response = _openapi.get(f"/v1.0/devices/{env.DEVICE_ID}/status")
-
-    # Handle status polling API errors
-    if not response.get("success"):
-        error_code = response.get("code")
-        error_msg = response.get("msg")
-        print(f"Tuya Client: Status polling API call FAILED. Code: {error_code}, Message: {error_msg}")
-
-        # If token is invalid, force a full re-initialization (re-login)
-        if error_code == TUYA_TOKEN_INVALID_CODE:
-            print(
-                "Tuya Client: Token invalid detected during status polling. Forcing full API client re-initialization.")
-            if not initialize_tuya_client():
-                print("Tuya Client: Failed to re-initialize client after token invalid. Cannot poll.")
-                return False
-
-            # Retry status call after re-login
-            response = _openapi.get(f"/v1.0/devices/{env.DEVICE_ID}/status")
-            if not response.get("success"):
-                print("Tuya Client: Still failed to get device status after re-login.")
-                return False
-        else:
-            print("Tuya Client: Failed to poll device status (not token issue).")
-            return False
+    print(f"Tuya Client: Device {device_id} is ONLINE. Proceeding with status polling...")
+    response = _api_get(f"/v1.0/devices/{device_id}/status", "device status")
+    if response is None:
+        return False
+
+    _handle_device_status(device_id, True, response.get("result", []), current_timestamp)
+    return True
 
-    # Process successful response
-    raw_dp_list = response.get("result", [])
-    snapshot, individual_dp_records = data_processor.process_device_data_snapshot(env.DEVICE_ID, raw_dp_list,
-                                                                                  current_timestamp)
-    print(f"Tuya Client: Current polled status for {env.DEVICE_ID} ({current_timestamp}):")
+
+def _handle_device_status(device_id, is_online, raw_dp_list, current_timestamp):
+    """Turn one device's polled state into a snapshot and store it."""
+    if not is_online:
+        print(f"Tuya Client: Device {device_id} is OFFLINE. Using offline snapshot ({current_timestamp}).")
+        snapshot, individual_dp_records = data_processor.get_offline_snapshot(device_id, current_timestamp)
+    else:
+        snapshot, individual_dp_records = data_processor.process_device_data_snapshot(device_id, raw_dp_list,
+                                                                                      current_timestamp)
+        print(f"Tuya Client: Current polled status for {device_id} ({current_timestamp}):")
     data_processor.print_clean_snapshot(snapshot)
+    _store_snapshot(snapshot, individual_dp_records)
 
-    storage_manager.insert_data_into_google_sheet(snapshot)
-    for record in individual_dp_records:
-        storage_manager.insert_data_into_sqlite(record)
 
+# --- Fleet Polling: online flags and DP status for many devices in a few batched requests ---
+def _result_items(response, *list_keys):
+    result = response.get("result") if response else None
+    if isinstance(result, dict):
+        for key in list_keys:
+            if isinstance(result.get(key), list):
+                return result[key]
+        return []
+    return result or []
+
+
+def _poll_fleet(device_ids):
+    if _openapi is None:
+        print("Tuya Client: OpenAPI not initialized for polling.")
+        return False
+
+    print(f"\nTuya Client: --- Fleet poll for {len(device_ids)} device(s) ---")
+    params = {"device_ids": ",".join(device_ids)}
+    devices_response = _api_get(FLEET_DEVICES_API, "fleet device info", params)
+    if devices_response is None:
+        return False
+    current_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+
+    devices = {item.get("id"): item for item in _result_items(devices_response, "devices", "list")}
+    online_ids = [device_id for device_id in device_ids if devices.get(device_id, {}).get("online", False)]
+    checked_at = time.time()
+    for device_id in device_ids:
+        if device_id in devices:
+            device_state.record_online(device_id, device_id in online_ids, checked_at)
+
+    # The device list usually carries DP status already; devices with fresh MQTT data use their
+    # last known state, and only the rest are fetched in one more batch call.
+    status_by_id = {device_id: devices[device_id]["status"] for device_id in online_ids
+                    if isinstance(devices[device_id].get("status"), list)}
+    for device_id in online_ids:
+        if device_id not in status_by_id and device_state.has_fresh_mqtt_data(device_id,
+                                                                             _mqtt_fresh_seconds(device_id)):
+            status_by_id[device_id] = []
+    missing_status = [device_id for device_id in online_ids if device_id not in status_by_id]
+    if missing_status:
+        status_response = _api_get(FLEET_STATUS_API, "fleet device status",
+                                   {"device_ids": ",".join(missing_status)})
+        for item in _result_items(status_response, "list"):
+            status_by_id[item.get("id")] = item.get("status", [])
+
+    for device_id in device_ids:
+        if device_id not in devices:
+            print(f"Tuya Client: Device {device_id} missing from fleet response; skipping this cycle.")
+            continue
+        if device_id in online_ids and device_id not in status_by_id:
+            print(f"Tuya Client: No status returned for online device {device_id}; skipping this cycle.")
+            continue
+        try:
+            _handle_device_status(device_id, device_id in online_ids, status_by_id.get(device_id),
+                                  current_timestamp)
+        except Exception as e:
+            print(f"Tuya Client: Error handling fleet status for {device_id}: {e}")
     return True
 
 
-# --- Polling Thread Function (This is what main.py calls) ---
+def _fleet_batches(device_ids):
+    """[(interval, [device_id, ...]), ...]: devices grouped by poll interval, then chunked."""
+    batch_size = max(1, int(getattr(env, 'FLEET_POLL_BATCH_SIZE', 20)))
+    by_interval = {}
+    for device_id in device_ids:
+        by_interval.setdefault(_get_poll_interval(device_id), []).append(device_id)
+    return [(interval, ids[i:i + batch_size])
+            for interval, ids in by_interval.items()
+            for i in range(0, len(ids), batch_size)]
+
+
+def _store_snapshot(snapshot, individual_dp_records):
+    storage_manager.insert_data_into_google_sheet(snapshot)
+    storage_manager.insert_snapshot_into_sqlite(snapshot)
+    storage_manager.insert_records_into_sqlite(individual_dp_records)
+
+
+# --- Polling Scheduler (This is what main.py calls) ---
+# One scheduler thread and a bounded worker pool poll every device; each device has its
+# own interval and its first poll is spread across that interval. In fleet mode (default
+# with more than one device) each job polls a whole batch through the batch endpoints.
 def start_polling_loop():
-    global _polling_thread
+    global _poll_scheduler
     if _openapi is None:
         print("Tuya Client: OpenAPI not initialized for polling. Cannot start polling loop.")
         return
 
-    if _polling_thread and _polling_thread.is_alive():
-        print("Tuya Client: Polling thread already running")
+    if _poll_scheduler and _poll_scheduler.is_running():
+        print("Tuya Client: Polling scheduler already running")
         return
 
-    _polling_thread = threading.Thread(target=_polling_thread_runner, args=(env.POLLING_INTERVAL_SECONDS,), daemon=True)
-    _polling_thread.start()
-    print(f"Tuya Client: Starting polling thread for device status every {env.POLLING_INTERVAL_SECONDS} seconds.")
+    device_ids = get_device_ids()
+    _poll_scheduler = PollScheduler(
+        max_workers=int(getattr(env, 'POLL_WORKERS', min(8, len(device_ids)))),
+        jitter_fraction=float(getattr(env, 'POLL_JITTER_FRACTION', 0.1)),
+    )
+    if getattr(env, 'FLEET_POLLING', len(device_ids) > 1):
+        # One job per batch: O(N / batch) requests per cycle instead of 2 per device
+        _poll_scheduler.add_jobs_spread([
+            (f"fleet-{index}", functools.partial(_poll_fleet, batch), interval)
+            for index, (interval, batch) in enumerate(_fleet_batches(device_ids))
+        ])
+    else:
+        _poll_scheduler.add_jobs_spread([
+            (device_id, functools.partial(_get_device_status_poll, device_id), _get_poll_interval(device_id))
+            for device_id in device_ids
+        ])
+    _poll_scheduler.start()
+    print(f"Tuya Client: Polling {len(device_ids)} device(s) every {env.POLLING_INTERVAL_SECONDS} seconds (default).")
+
+
+def get_polling_stats():
+    """Per-device run/failure/deadline-miss counters from the polling scheduler."""
+    return _poll_scheduler.stats() if _poll_scheduler else {}
+
+
+def get_mqtt_listener_stats():
+    """Per-listener queue depth, drop counts and lag of the MQTT dispatch."""
+    return _openmq.listener_stats() if _openmq else {}
+
+
+def get_rate_limit_stats():
+    """Current adaptive scale and throttle/timeout counters of the API rate limiter."""
+    if _openapi is None or _openapi.rate_limiter is None:
+        return {}
+    return _openapi.rate_limiter.stats()
 
 
 def start_heartbeat_loop():
-    """Start a heartbeat thread that prints device online status frequently (no Sheets writes)."""
+    """Start the device-state probe thread; it caches online status for the pollers and the UI (no Sheets writes)."""
     global _heartbeat_thread
     interval = int(getattr(env, 'HEARTBEAT_INTERVAL_SECONDS', 30))
     if _heartbeat_thread and _heartbeat_thread.is_alive():
@@ -221,38 +383,44 @@ def start_heartbeat_loop():
     print(f"Tuya Client: Starting heartbeat thread every {interval} seconds.")
 
 
+def _stale_device_ids():
+    """Devices without an online flag fresher than _state_max_age(), e.g. not just refreshed by the fleet poll."""
+    max_age = _state_max_age()
+    return [device_id for device_id in get_device_ids() if device_state.get_online(device_id, max_age) is None]
+
+
 def _heartbeat_thread_runner(interval):
     while True:
         try:
-            if _openapi is None:
-                time.sleep(interval)
-                continue
-            device_info = _openapi.get(f"/v1.0/devices/{env.DEVICE_ID}")
-            is_online = False
-            if device_info and device_info.get('success'):
-                is_online = device_info.get('result', {}).get('online', False)
+            states = probe_device_states(_stale_device_ids())
             ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            status = 'ONLINE' if is_online else 'OFFLINE'
-            print(f"Tuya Heartbeat: {env.DEVICE_ID} is {status} at {ts}")
+            for device_id, is_online in states.items():
+                status = 'ONLINE' if is_online else 'OFFLINE'
+                print(f"Tuya Heartbeat: {device_id} is {status} at {ts}")
         except Exception as e:
             print(f"Tuya Heartbeat: error checking device status: {e}")
         time.sleep(interval)
 
 
-# Internal runner for the polling thread
-def _polling_thread_runner(interval):
-    while True:
-        _get_device_status_poll()
-        time.sleep(interval)
+def get_device_states():
+    """Cached online/offline state per device, as shared by the probe, the pollers and MQTT."""
+    return device_state.get_all_states()
 
 
 # --- Cleanup ---
 def stop_tuya_client():
+    global _ingest_pipeline
+    if _poll_scheduler:
+        _poll_scheduler.stop()
+        print("Tuya Client: Polling scheduler stopped.")
     if _openmq:
         print(f"Tuya Client: Stopping MQTT listener (alive={_openmq.is_alive()})")
         _openmq.stop()
         print("Tuya Client: MQTT listener stopped.")
     else:
         print("Tuya Client: No MQTT listener to stop.")
+    if _ingest_pipeline:
+        _ingest_pipeline.stop()
+        _ingest_pipeline = None
 
 # === END OF PUBLIC FUNCTION DEFINITIONS ===
@@ -0,0 +1,131 @@
+"""Per-message cost of turning a DP burst into a snapshot and DP records, before and after.
+
+Run from the repository root:
+
+    python benchmarks/bench_dp_decode.py
+
+"legacy" is a copy of the previous `process_device_data_snapshot` (DP_SPECS
+lookups and type string comparisons per DP, an 8-key dict with a formatted
+display string per record); "current" is `data_processor.process_device_data_snapshot`
+with the compiled decoder table and lazy `DpRecord` display values. Both
+produce the same snapshot values and display strings.
+"""
+import datetime
+import os
+import random
+import sys
+import time
+import timeit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+
+import data_processor  # noqa: E402
+from data_processor import DP_SPECS, interpret_fault_bitmap  # noqa: E402
+
+ROUNDS = 20000
+TIMESTAMP = "2025-01-01 12:00:00"
+
+# Typical MQTT report (electrical readings) and a full status poll (every DP).
+MQTT_BURST = [
+    {"code": "output_voltage", "value": 2301},
+    {"code": "output_current", "value": 6120},
+    {"code": "output_power", "value": 1350},
+    {"code": "power_factor", "value": 958},
+    {"code": "supply_frequency", "value": 500},
+    {"code": "total_forward_energy", "value": 123456},
+    {"code": "fault", "value": 0},
+]
+FULL_POLL = [
+    {"code": code, "value": {"Integer": random.randint(0, 10000), "Boolean": random.random() < 0.5,
+                             "Bitmap": 5, "Raw": "CPwAPQAHNA==", "String": "BRK-0001"}[spec["type"]]}
+    for code, spec in DP_SPECS.items()
+]
+
+_legacy_state = dict(data_processor._INITIAL_DEVICE_STATE)
+
+
+def legacy_process_device_data_snapshot(device_id, raw_dp_list, timestamp):
+    individual_dp_records = []
+    if raw_dp_list:
+        datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+    for dp_change in raw_dp_list:
+        dp_code = dp_change.get('code')
+        dp_value_raw = dp_change.get('value')
+        dp_info = DP_SPECS.get(dp_code)
+        if dp_info:
+            dp_name = dp_info["name"]
+            dp_type = dp_info["type"]
+            dp_scale = dp_info.get("scale", 1)
+            dp_unit = dp_info.get("unit", "")
+            if dp_type == "Integer":
+                value_for_state = round(dp_value_raw / dp_scale, 3)
+                display_value_individual = f"{value_for_state} {dp_unit}"
+            elif dp_type == "Boolean":
+                value_for_state = "ON" if dp_value_raw else "OFF"
+                display_value_individual = value_for_state
+            elif dp_type == "Bitmap":
+                value_for_state = interpret_fault_bitmap(dp_value_raw, dp_info.get("labels", []))
+                display_value_individual = value_for_state
+            elif dp_type == "Raw":
+                value_for_state = dp_value_raw
+                display_value_individual = f"{dp_value_raw} (Raw Data)"
+            else:
+                value_for_state = dp_value_raw
+                display_value_individual = str(dp_value_raw)
+            if dp_code in _legacy_state:
+                _legacy_state[dp_code] = value_for_state
+            individual_dp_records.append({
+                "timestamp": timestamp, "device_id": device_id, "dp_code": dp_code,
+                "dp_name": dp_name, "dp_value_display": display_value_individual,
+                "dp_value_save": value_for_state, "dp_unit": dp_unit, "dp_type": dp_type
+            })
+        else:
+            individual_dp_records.append({
+                "timestamp": timestamp, "device_id": device_id, "dp_code": dp_code,
+                "dp_name": "Unknown DP", "dp_value_display": dp_value_raw,
+                "dp_value_save": dp_value_raw, "dp_unit": "", "dp_type": "Unknown"
+            })
+    snapshot_data = {
+        "timestamp": timestamp,
+        "time_12hr": time.strftime('%I:%M:%S %p', time.localtime()),
+        "device_id": device_id,
+        "dp_code_raw": raw_dp_list,
+        "Breaker Switch": _legacy_state.get("switch", "N/A"),
+        "Voltage (V)": _legacy_state.get("output_voltage", "N/A"),
+        "Frequency (Hz)": _legacy_state.get("supply_frequency", "N/A"),
+        "Current (A)": _legacy_state.get("output_current", "N/A"),
+        "Active Power (kW)": _legacy_state.get("output_power", "N/A"),
+        "Power Factor": _legacy_state.get("power_factor", "N/A"),
+    }
+    if snapshot_data["Breaker Switch"] == "OFF":
+        for key in ("Voltage (V)", "Frequency (Hz)", "Current (A)", "Active Power (kW)", "Power Factor"):
+            if snapshot_data[key] != "N/A":
+                snapshot_data[key] = 0.0
+    return snapshot_data, individual_dp_records
+
+
+def main():
+    bursts = {"MQTT report (7 DPs)": MQTT_BURST, f"full poll ({len(FULL_POLL)} DPs)": FULL_POLL}
+
+    for burst in bursts.values():
+        legacy_snapshot, legacy_records = legacy_process_device_data_snapshot("dev", burst, TIMESTAMP)
+        snapshot, records = data_processor.process_device_data_snapshot("dev", burst, TIMESTAMP)
+        # Bitmap DPs now save the raw bitmap; their display string is unchanged.
+        assert [record.dp_value_display for record in records] == [r["dp_value_display"] for r in legacy_records]
+        assert [record.to_dict() for record in records if record.dp_type != "Bitmap"] == \
+            [r for r in legacy_records if r["dp_type"] != "Bitmap"]
+        assert {k: v for k, v in snapshot.items() if k not in ("time_12hr", "fault_events")} == \
+            {k: v for k, v in legacy_snapshot.items() if k != "time_12hr"}
+
+    print(f"{'burst':<22}{'legacy us/msg':>15}{'current us/msg':>16}{'speedup':>9}")
+    for name, burst in bursts.items():
+        legacy = min(timeit.repeat(lambda: legacy_process_device_data_snapshot("dev", burst, TIMESTAMP),
+                                   number=ROUNDS, repeat=3))
+        current = min(timeit.repeat(lambda: data_processor.process_device_data_snapshot("dev", burst, TIMESTAMP),
+                                    number=ROUNDS, repeat=3))
+        print(f"{name:<22}{legacy / ROUNDS * 1e6:>15.2f}{current / ROUNDS * 1e6:>16.2f}{legacy / current:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
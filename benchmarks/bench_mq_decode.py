@@ -0,0 +1,122 @@
+"""Messages per second one MQTT network thread can decode in TuyaOpenMQ, before and after.
+
+Run from the repository root:
+
+    python benchmarks/bench_mq_decode.py
+
+Payloads are encrypted here the way the broker does it (AES-ECB/PKCS7 for
+SMART_HOME, AES-GCM with the `t` field as AAD for CUSTOM) around a recorded
+device status report. "legacy" is a copy of the previous `_on_message` decode
+path (new cipher and key per message, utf-8 decode + json.loads, eager debug
+f-strings); "current" is `TuyaOpenMQ._on_message` with no listeners.
+"""
+import base64
+import json
+import logging
+import os
+import queue
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Crypto.Cipher import AES  # noqa: E402
+from Crypto.Util.Padding import pad  # noqa: E402
+
+from tuya_iot import AuthType, TuyaOpenAPI, TuyaOpenMQ  # noqa: E402
+from tuya_iot import openmq  # noqa: E402
+from tuya_iot.openlogging import logger  # noqa: E402
+
+ROUNDS = 20000
+
+PASSWORD = "0123456789abcdefghijklmnopqrstuv"
+STATUS_REPORT = {
+    "dataId": "5f6b1e0a-2c3d-4e5f-8a9b-0c1d2e3f4a5b",
+    "devId": "bf1234567890abcdefghij",
+    "productKey": "keyabcdefghijklm",
+    "status": [
+        {"code": "total_forward_energy", "t": 1700000000000, "value": 123456, "20": 123456},
+        {"code": "phase_a", "t": 1700000000000, "value": "CPwAPQAHNA==", "6": "CPwAPQAHNA=="},
+        {"code": "fault", "t": 1700000000000, "value": 0, "9": 0},
+        {"code": "switch", "t": 1700000000000, "value": True, "1": True},
+        {"code": "cur_voltage", "t": 1700000000000, "value": 2301, "22": 2301},
+        {"code": "cur_current", "t": 1700000000000, "value": 612, "18": 612},
+        {"code": "cur_power", "t": 1700000000000, "value": 1350, "19": 1350},
+    ],
+}
+
+
+class _Message:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def encrypt_message(auth_type, t, plaintext):
+    key = PASSWORD[8:24].encode("utf8")
+    if auth_type == AuthType.SMART_HOME:
+        data = AES.new(key, AES.MODE_ECB).encrypt(pad(plaintext, 16))
+    else:
+        iv = os.urandom(12)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+        cipher.update(str(t).encode("utf8"))
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        data = len(iv).to_bytes(4, "big") + iv + ciphertext + tag
+    envelope = {"protocol": 4, "pv": "2.0", "sign": "x" * 32, "t": t, "data": base64.b64encode(data).decode()}
+    return json.dumps(envelope).encode("utf8")
+
+
+def legacy_on_message(auth_type, mq_config, msg):
+    logger.debug(f"payload-> {msg.payload}")
+    msg_dict = json.loads(msg.payload.decode("utf8"))
+    t = msg_dict.get("t", "")
+    key = mq_config.password[8:24]
+    b64msg = msg_dict["data"]
+    if auth_type == AuthType.SMART_HOME:
+        cipher = AES.new(key.encode("utf8"), AES.MODE_ECB)
+        decoded = cipher.decrypt(base64.b64decode(b64msg))
+        decoded = json.loads(decoded[:-decoded[-1]])
+    else:
+        buffer = base64.b64decode(b64msg)
+        iv_length = int.from_bytes(buffer[0:4], byteorder="big")
+        iv_buffer = buffer[4: iv_length + 4]
+        data_buffer = buffer[iv_length + 4: len(buffer) - openmq.GCM_TAG_LENGTH]
+        tag_buffer = buffer[len(buffer) - openmq.GCM_TAG_LENGTH:]
+        cipher = AES.new(key.encode("utf8"), AES.MODE_GCM, nonce=iv_buffer)
+        cipher.update(str(t).encode("utf8"))
+        decoded = json.loads(cipher.decrypt_and_verify(data_buffer, tag_buffer).decode("utf8"))
+    msg_dict["data"] = decoded
+    logger.debug(f"on_message: {msg_dict}")
+    return msg_dict
+
+
+def main():
+    logger.setLevel(logging.INFO)
+    mq_config = openmq.TuyaMQConfig({"result": {"password": PASSWORD}})
+    plaintext = json.dumps(STATUS_REPORT).encode("utf8")
+    t = int(time.time())
+    json_backend = "orjson" if openmq.orjson is not None else "json"
+
+    print(f"JSON backend: {json_backend}")
+    print(f"{'auth type':<12}{'legacy msg/s':>14}{'current msg/s':>15}{'speedup':>9}")
+    for auth_type in (AuthType.SMART_HOME, AuthType.CUSTOM):
+        api = TuyaOpenAPI("https://openapi.tuyaeu.com", "id", "secret", auth_type=auth_type)
+        mq = TuyaOpenMQ(api)
+        received = queue.Queue()
+        mq.add_message_listener(received.put)
+        msg = _Message(encrypt_message(auth_type, t, plaintext))
+
+        # Both paths must decode to the same message.
+        mq._on_message(None, {"mqConfig": mq_config}, msg)
+        decoded = received.get(timeout=5)
+        assert decoded["data"] == legacy_on_message(auth_type, mq_config, msg)["data"] == STATUS_REPORT
+        mq.remove_message_listener(received.put)
+
+        user_data = {"mqConfig": mq_config}
+        legacy = min(timeit.repeat(lambda: legacy_on_message(auth_type, mq_config, msg), number=ROUNDS, repeat=3))
+        current = min(timeit.repeat(lambda: mq._on_message(None, user_data, msg), number=ROUNDS, repeat=3))
+        print(f"{auth_type.name:<12}{ROUNDS / legacy:>14.0f}{ROUNDS / current:>15.0f}{legacy / current:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Per-request CPU cost of TuyaOpenAPI signing and request logging, before and after.
+
+Run from the repository root:
+
+    python benchmarks/bench_openapi_sign.py
+
+"legacy" is a copy of the previous `_calculate_sign` plus the debug f-strings
+that `__request` used to build unconditionally (DEBUG logging off); "current"
+is `TuyaOpenAPI._calculate_sign` with a pre-serialised body and the lazy
+`isEnabledFor` check. Both produce the same signature.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuya_iot import TuyaOpenAPI  # noqa: E402
+from tuya_iot.openapi import serialize_body  # noqa: E402
+from tuya_iot.openlogging import filter_logger, logger  # noqa: E402
+
+ROUNDS = 20000
+
+PARAMS = {"device_ids": ",".join(f"bf{i:020d}" for i in range(20)), "page_size": 20}
+BODY = {"commands": [{"code": "switch", "value": True}, {"code": "countdown_1", "value": 0}]}
+RESPONSE = {
+    "success": True,
+    "t": 1700000000000,
+    "result": [{"code": f"dp_{i}", "value": i * 10} for i in range(12)],
+}
+
+
+def legacy_calculate_sign(api, method, path, params=None, body=None):
+    str_to_sign = method
+    str_to_sign += "\n"
+    content_to_sha256 = "" if body is None or len(body.keys()) == 0 else json.dumps(body)
+    str_to_sign += hashlib.sha256(content_to_sha256.encode("utf8")).hexdigest().lower()
+    str_to_sign += "\n"
+    str_to_sign += "\n"
+    str_to_sign += path
+    if params is not None and len(params.keys()) > 0:
+        str_to_sign += "?"
+        params_keys = sorted(params.keys())
+        query_builder = "".join(f"{key}={params[key]}&" for key in params_keys)
+        str_to_sign += query_builder[:-1]
+    t = int(time.time() * 1000)
+    message = api.access_id
+    if api.token_info is not None:
+        message += api.token_info.access_token
+    message += str(t) + str_to_sign
+    sign = (
+        hmac.new(api.access_secret.encode("utf8"), msg=message.encode("utf8"), digestmod=hashlib.sha256)
+        .hexdigest()
+        .upper()
+    )
+    return sign, t
+
+
+def legacy_request_path(api, method, path, params, body):
+    sign, t = legacy_calculate_sign(api, method, path, params, body)
+    logger.debug(
+        f"Request: method = {method}, url = {api.endpoint + path}, params = {params}, "
+        f"body = {filter_logger(body)}, t = {int(time.time()*1000)}"
+    )
+    logger.debug(f"Response: {json.dumps(filter_logger(RESPONSE), ensure_ascii=False, indent=2)}")
+    return sign
+
+
+def current_request_path(api, method, path, params, body):
+    body_json = serialize_body(body)
+    sign, t = api._calculate_sign(method, path, params, body, None, body_json)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Request: {method} {path}")
+    return sign
+
+
+def main():
+    logger.setLevel(logging.INFO)
+    api = TuyaOpenAPI("https://openapi.tuyaeu.com", "a" * 20, "s" * 32)
+
+    # Same inputs and same clock give the same signature.
+    real_time = time.time
+    time.time = lambda: 1700000000.0
+    try:
+        for method, path, params, body in (("GET", "/v1.0/devices", PARAMS, None),
+                                           ("POST", "/v1.0/devices/x/commands", None, BODY)):
+            assert legacy_calculate_sign(api, method, path, params, body) == api._calculate_sign(
+                method, path, params, body)
+    finally:
+        time.time = real_time
+
+    cases = {
+        "GET status poll": ("GET", "/v1.0/devices", PARAMS, None),
+        "POST command": ("POST", "/v1.0/devices/x/commands", None, BODY),
+    }
+    print(f"{'case':<18}{'legacy us/req':>15}{'current us/req':>16}{'speedup':>9}")
+    for name, args in cases.items():
+        legacy = min(timeit.repeat(lambda: legacy_request_path(api, *args), number=ROUNDS, repeat=3))
+        current = min(timeit.repeat(lambda: current_request_path(api, *args), number=ROUNDS, repeat=3))
+        print(f"{name:<18}{legacy / ROUNDS * 1e6:>15.2f}{current / ROUNDS * 1e6:>16.2f}{legacy / current:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
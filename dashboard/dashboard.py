@@ -5,13 +5,20 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
+BACKEND_DIR = ROOT_DIR / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.append(str(BACKEND_DIR))
 
 import streamlit as st
 import pandas as pd
 import datetime
 import storage
 from storage import authenticate_gsheets as auth_gsheets
+from storage import sheet_reader
 import app_config as env
+import storage_manager
+import device_state
+from dashboard.tariff import calculate_cost
 from gspread.exceptions import WorksheetNotFound
 
 import plotly.express as px
@@ -21,34 +28,22 @@ import plotly.express as px
 # Auto-refresh every 30 seconds
 
 
-def calculate_cost(units_kwh):
-    slabs = [
-        (50, 4.63),    # First 50 units
-        (25, 5.26),    # Next 25
-        (125, 7.20),   # Next 125
-        (100, 7.59),   # Next 100
-        (100, 8.02),   # Next 100
-        (200, 12.67),  # Next 200
-        (float('inf'), 14.61)  # Above 600
-    ]
-    remaining = units_kwh
-    total = 0
-    for limit, rate in slabs:
-        use = min(remaining, limit)
-        total += use * rate
-        remaining -= use
-        if remaining <= 0:
-            break
-    return total
-
-
-
-def get_latest_data(client, spreadsheet_name, sheet_name):
+def get_local_data(day):
+    """Today's rows from the backend's SQLite read model; the latest row comes from its in-memory cache."""
+    device_id = getattr(env, 'DEVICE_ID', None)
+    all_records = storage_manager.get_snapshot_records(day, device_id)
+    latest_data = storage_manager.get_latest_snapshot_record(device_id)
+    if latest_data is None:
+        return None, None
+    return latest_data, pd.DataFrame(all_records)
+
+
+def get_latest_data(spreadsheet_name, sheet_name):
+    """Latest row and all rows of today's tab; only rows appended since the last refresh are downloaded."""
     try:
-        sheet = client.open(spreadsheet_name).worksheet(sheet_name)
-        all_records = sheet.get_all_records()
-        if all_records:
-            return all_records[-1], all_records
+        today_df = sheet_reader.get_reader(sheet_name, spreadsheet_name).read()
+        if not today_df.empty:
+            return today_df.iloc[-1].to_dict(), today_df
         else:
             return None, None
     except WorksheetNotFound:
@@ -108,9 +103,13 @@ def plot_pretty_line_chart(df, y_column, title, color):
             )
 
 def dashboard_page():
-    client = auth_gsheets.get_gsheets_client()
-    today_tab = datetime.datetime.now().strftime("%d/%m/%Y")
-    latest_data, all_records = get_latest_data(client, env.GOOGLE_SHEETS_NAME, today_tab)
+    today = datetime.date.today()
+    today_tab = today.strftime("%d/%m/%Y")
+    if storage_manager.is_local_store_available():
+        latest_data, today_df = get_local_data(today)
+    else:
+        # Backend storage not running in this process: fall back to reading the sheet.
+        latest_data, today_df = get_latest_data(env.GOOGLE_SHEETS_NAME, today_tab)
 
     if latest_data:
         breaker_switch = (latest_data.get("Breaker Switch") or latest_data.get("breaker switch") or latest_data.get("BreakerSwitch") or "Unknown").lower()
@@ -121,6 +120,12 @@ def dashboard_page():
         else:
             st.warning("⚪ Device Status: Unknown")
 
+        # Connectivity as last seen by the backend's device-state probe (only when it runs in this process)
+        connectivity = device_state.get_state(getattr(env, 'DEVICE_ID', None))
+        if connectivity and connectivity["checked_at"]:
+            checked = datetime.datetime.fromtimestamp(connectivity["checked_at"]).strftime("%I:%M:%S %p")
+            st.caption(f"Cloud connectivity: {'Online' if connectivity['online'] else 'Offline'} (checked {checked})")
+
         col1, col2, col3, col4, col5 = st.columns(5)
         col1.metric("Voltage (V)", latest_data.get("Voltage (V)", "N/A"))
         col2.metric("Current (A)", latest_data.get("Current (A)", "N/A"))
@@ -128,8 +133,14 @@ def dashboard_page():
         col4.metric("Power Factor", latest_data.get("Power Factor", "N/A"))
 
 
-        df1 = pd.DataFrame(all_records)
-        if 'Time' in df1.columns and 'Active Power (kW)' in df1.columns:
+        # Today's kWh is kept running by the backend as samples arrive; only re-integrate the
+        # sheet rows when the backend isn't running in this process.
+        energy_today = storage_manager.get_today_energy(getattr(env, 'DEVICE_ID', None))
+        df1 = today_df.copy()
+        if energy_today is not None:
+            total_kwh = energy_today["kwh"]
+            cumulative_cost = calculate_cost(total_kwh, today)
+        elif 'Time' in df1.columns and 'Active Power (kW)' in df1.columns:
             df1['Time'] = pd.to_datetime(df1['Time'], format='%I:%M:%S %p', errors='coerce')
             df1 = df1.dropna(subset=['Time'])
             df1 = df1.sort_values('Time')
@@ -138,17 +149,18 @@ def dashboard_page():
             df1.loc[df1['delta_sec'] <= 0, 'delta_sec'] = 1  # minimal interval
 
             df1['Active Power (kW)'] = pd.to_numeric(df1['Active Power (kW)'], errors='coerce')
-            df1['energy_kwh'] = df1['Active Power (kW)'] * (df1['delta_sec'] / 3600)
+            # Rows are change-only (deadbanded), so each power value holds until the next row.
+            df1['energy_kwh'] = df1['Active Power (kW)'].shift().fillna(0) * (df1['delta_sec'] / 3600)
             df1.loc[df1['energy_kwh'] < 0, 'energy_kwh'] = 0
 
             total_kwh = df1['energy_kwh'].sum()
-            cumulative_cost = calculate_cost(total_kwh)
+            cumulative_cost = calculate_cost(total_kwh, today)
         else:
             total_kwh = 0
             cumulative_cost = 0
 
         col5.metric("Cumulative Cost (৳)", f"{cumulative_cost:.2f}")
-        df = pd.DataFrame(all_records)
+        df = today_df.copy()
 
         if "Breaker Switch" in df.columns:
             df = df.drop(columns=["Breaker Switch"])
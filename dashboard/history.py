@@ -4,40 +4,44 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
+BACKEND_DIR = ROOT_DIR / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.append(str(BACKEND_DIR))
 
+import time
 import streamlit as st
 import pandas as pd
-from storage.authenticate_gsheets import get_gsheets_client
+from storage.authenticate_gsheets import list_worksheets, get_worksheet
 import app_config as env
-from datetime import datetime
-
-def calculate_cost(units_kwh):
-    slabs = [
-        (50, 4.63),
-        (25, 5.26),
-        (125, 7.20),
-        (100, 7.59),
-        (100, 8.02),
-        (200, 12.67),
-        (float('inf'), 14.61)
-    ]
-    remaining = units_kwh
-    total = 0
-    for limit, rate in slabs:
-        use = min(remaining, limit)
-        total += use * rate
-        remaining -= use
-        if remaining <= 0:
-            break
-    return total
+import storage_manager
+from dashboard.tariff import calculate_cost
+from datetime import datetime, timedelta
+
+
+def get_local_energy(log_date):
+    """Day total from the backend's energy checkpoints and cumulative kWh per 15 minutes from its rollups.
+
+    Returns (total kWh, DataFrame with Time/cum_energy_kwh, seconds of the day without power data)
+    or (None, None, None) when the backend has no data.
+    """
+    device_id = getattr(env, 'DEVICE_ID', None)
+    totals = storage_manager.get_day_energy(log_date, device_id)
+    if totals is None or device_id is None:
+        return None, None, None
+    start_ts = int(time.mktime(log_date.timetuple()))
+    end_ts = int(time.mktime((log_date + timedelta(days=1)).timetuple()))
+    _, rows = storage_manager.query_rollups(device_id, "output_power", start_ts, end_ts, resolution="15m")
+    energy_df = pd.DataFrame({
+        "Time": [datetime.fromtimestamp(row["bucket_ts"]) for row in rows],
+        "cum_energy_kwh": pd.Series([row["energy_kwh"] for row in rows], dtype=float).cumsum(),
+    })
+    return totals["kwh"], energy_df, totals["gap_seconds"]
 
 def history_page():
     st.title("IoT Power History")
 
-    # Don't cache client or spreadsheet objects
-    client = get_gsheets_client()
-    spreadsheet = client.open(env.GOOGLE_SHEETS_NAME)
-    all_worksheets = spreadsheet.worksheets()
+    # Client, spreadsheet handle and worksheet list are cached process-wide (see authenticate_gsheets)
+    all_worksheets = list_worksheets(env.GOOGLE_SHEETS_NAME)
     date_sheets = [
         ws for ws in all_worksheets
         if ws.title.count("/") == 2 and len(ws.title) == 10
@@ -57,8 +61,8 @@ def history_page():
     selected_date = st.selectbox("Select a log date", date_names_sorted)
 
     try:
-        # Always freshly get the worksheet and rows
-        worksheet = spreadsheet.worksheet(selected_date)
+        # Rows are always fetched fresh; only the worksheet handle comes from the cache
+        worksheet = get_worksheet(selected_date, env.GOOGLE_SHEETS_NAME)
         data = worksheet.get_all_records()
     except Exception as e:
         st.error(f"Could not load worksheet '{selected_date}': {e}")
@@ -68,8 +72,23 @@ def history_page():
         st.warning(f"No data logged for the selected date: {selected_date}")
         return
 
+    log_date = datetime.strptime(selected_date, date_format).date()
+    local_kwh, energy_df, gap_seconds = get_local_energy(log_date)
+    # The backend's total only replaces the Sheets log when it saw (nearly) the whole day.
+    local_complete = local_kwh is not None and gap_seconds <= getattr(env, 'HISTORY_MAX_ENERGY_GAP_SECONDS', 900)
+    has_sheets_power = 'Time' in data[0] and 'Active Power (kW)' in data[0]
     df1 = pd.DataFrame(data)
-    if 'Time' in df1.columns and 'Active Power (kW)' in df1.columns:
+    total_kwh = None
+    if local_complete or (local_kwh is not None and not has_sheets_power):
+        if not local_complete:
+            st.warning(f"Local energy data is missing {gap_seconds / 3600:.1f} h of this day; "
+                       f"the totals below only cover the rest.")
+        # Integrated by the backend at ingest time; nothing to re-integrate here.
+        df1 = energy_df
+        df1['cumulative_cost_bdt'] = calculate_cost(df1['cum_energy_kwh'].to_numpy(), log_date)
+        total_kwh = local_kwh
+        total_cost = calculate_cost(total_kwh, log_date)
+    elif has_sheets_power:
         # Parse strict 12-hour time, drop bad rows, order
         df1['Time'] = pd.to_datetime(df1['Time'], format='%I:%M:%S %p', errors='coerce')
         df1 = df1.dropna(subset=['Time'])
@@ -77,13 +96,15 @@ def history_page():
         df1['delta_sec'] = df1['Time'].diff().dt.total_seconds().fillna(0)
         df1.loc[df1['delta_sec'] <= 0, 'delta_sec'] = 1
         df1['Active Power (kW)'] = pd.to_numeric(df1['Active Power (kW)'], errors='coerce')
-        df1['energy_kwh'] = df1['Active Power (kW)'] * (df1['delta_sec'] / 3600)
+        # Rows are change-only (deadbanded), so each power value holds until the next row.
+        df1['energy_kwh'] = df1['Active Power (kW)'].shift().fillna(0) * (df1['delta_sec'] / 3600)
         df1.loc[df1['energy_kwh'] < 0, 'energy_kwh'] = 0
         df1['cum_energy_kwh'] = df1['energy_kwh'].cumsum()
-        df1['cumulative_cost_bdt'] = df1['cum_energy_kwh'].apply(calculate_cost)
+        df1['cumulative_cost_bdt'] = calculate_cost(df1['cum_energy_kwh'].to_numpy(), log_date)
         total_kwh = df1['cum_energy_kwh'].iloc[-1] if len(df1) > 0 else 0
         total_cost = df1['cumulative_cost_bdt'].iloc[-1] if len(df1) > 0 else 0
 
+    if total_kwh is not None:
         st.metric("Total kWh Used", f"{total_kwh:.3f}")
         st.metric("Total Cost (৳)", f"{total_cost:.2f}")
 
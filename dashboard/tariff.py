@@ -0,0 +1,74 @@
+import datetime
+
+import numpy as np
+
+import app_config as env
+
+# Slab tables, each in effect from its `effective_from` date until the next one.
+# A slab is (size in kWh, rate in ৳/kWh); the last slab is open-ended.
+# Override with TARIFF_SCHEDULES in app_config using the same shape.
+DEFAULT_TARIFF_SCHEDULES = [
+    {
+        "effective_from": "2000-01-01",
+        "slabs": [
+            (50, 4.63),    # First 50 units
+            (25, 5.26),    # Next 25
+            (125, 7.20),   # Next 125
+            (100, 7.59),   # Next 100
+            (100, 8.02),   # Next 100
+            (200, 12.67),  # Next 200
+            (float('inf'), 14.61)  # Above 600
+        ],
+    },
+]
+
+
+class SlabTariff:
+    """Progressive slab tariff stored as cumulative breakpoints.
+
+    `breakpoints[i]` is the kWh at which slab i starts and `base_cost[i]` the
+    cost of everything below it, so the cost of any consumption is one
+    `searchsorted` plus a multiply-add, for a scalar or a whole array.
+    """
+
+    def __init__(self, effective_from, slabs):
+        self.effective_from = effective_from
+        sizes = np.array([size for size, _ in slabs], dtype=float)
+        self.rates = np.array([rate for _, rate in slabs], dtype=float)
+        self.breakpoints = np.concatenate(([0.0], np.cumsum(sizes[:-1])))
+        self.base_cost = np.concatenate(([0.0], np.cumsum(sizes[:-1] * self.rates[:-1])))
+
+    def cost(self, units_kwh):
+        units = np.maximum(np.asarray(units_kwh, dtype=float), 0.0)
+        slab = np.searchsorted(self.breakpoints, units, side="right") - 1
+        total = self.base_cost[slab] + (units - self.breakpoints[slab]) * self.rates[slab]
+        return float(total) if total.ndim == 0 else total
+
+
+def _load_tariffs():
+    schedules = getattr(env, 'TARIFF_SCHEDULES', None) or DEFAULT_TARIFF_SCHEDULES
+    tariffs = [
+        SlabTariff(datetime.date.fromisoformat(str(schedule["effective_from"])), schedule["slabs"])
+        for schedule in schedules
+    ]
+    return sorted(tariffs, key=lambda tariff: tariff.effective_from)
+
+
+_TARIFFS = _load_tariffs()
+
+
+def get_tariff(on_date=None):
+    """Tariff in effect on `on_date` (default today); the earliest one if the date predates them all."""
+    on_date = on_date or datetime.date.today()
+    current = _TARIFFS[0]
+    for tariff in _TARIFFS:
+        if tariff.effective_from <= on_date:
+            current = tariff
+        else:
+            break
+    return current
+
+
+def calculate_cost(units_kwh, on_date=None):
+    """Cost in ৳ of `units_kwh` (scalar or array-like) under the tariff in effect on `on_date`."""
+    return get_tariff(on_date).cost(units_kwh)
@@ -1,7 +1,11 @@
 # storage/authenticate_gsheets.py
-import json
+import datetime
+import threading
+import time
+
 import streamlit as st
 import gspread
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 import app_config as env
 
@@ -12,8 +16,74 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive"
 ]
 
+# Refresh the OAuth access token this long before it expires.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# How long a spreadsheet's worksheet list is reused before being fetched again.
+WORKSHEET_CACHE_TTL_SECONDS = 300
+
+# One client/spreadsheet per process, shared by every Streamlit session and rerun.
+_lock = threading.RLock()
+_credentials = None
+_client = None
+_spreadsheets = {}      # spreadsheet name -> gspread.Spreadsheet
+_worksheet_cache = {}   # spreadsheet name -> (fetched_at monotonic, [gspread.Worksheet, ...])
+
+
+def _refresh_credentials_if_needed():
+    expiry = _credentials.expiry  # naive UTC datetime, None before the first refresh
+    now_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if (not _credentials.valid or expiry is None
+            or (expiry - now_utc).total_seconds() < TOKEN_REFRESH_MARGIN_SECONDS):
+        _credentials.refresh(Request())
+
+
 def get_gsheets_client():
-    creds = Credentials.from_service_account_file(env.SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    client = gspread.authorize(creds)
-    return client
+    """Process-wide gspread client; the service-account token is refreshed before it expires."""
+    global _credentials, _client
+    with _lock:
+        if _client is None:
+            _credentials = Credentials.from_service_account_file(env.SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            _client = gspread.authorize(_credentials)
+        _refresh_credentials_if_needed()
+        return _client
+
+
+def get_spreadsheet(spreadsheet_name=None):
+    """Cached spreadsheet handle (opened once per process)."""
+    spreadsheet_name = spreadsheet_name or env.GOOGLE_SHEETS_NAME
+    client = get_gsheets_client()
+    with _lock:
+        spreadsheet = _spreadsheets.get(spreadsheet_name)
+        if spreadsheet is None:
+            spreadsheet = client.open(spreadsheet_name)
+            _spreadsheets[spreadsheet_name] = spreadsheet
+        return spreadsheet
+
+
+def list_worksheets(spreadsheet_name=None, force_refresh=False):
+    """Worksheets of the spreadsheet, cached for WORKSHEET_CACHE_TTL_SECONDS."""
+    spreadsheet_name = spreadsheet_name or env.GOOGLE_SHEETS_NAME
+    spreadsheet = get_spreadsheet(spreadsheet_name)
+    with _lock:
+        cached = _worksheet_cache.get(spreadsheet_name)
+        if cached and not force_refresh and time.monotonic() - cached[0] < WORKSHEET_CACHE_TTL_SECONDS:
+            return cached[1]
+        worksheets = spreadsheet.worksheets()
+        _worksheet_cache[spreadsheet_name] = (time.monotonic(), worksheets)
+        return worksheets
+
+
+def get_worksheet(title, spreadsheet_name=None):
+    """Worksheet by title from the cached list; refetches the list once if the title is new."""
+    for force_refresh in (False, True):
+        for worksheet in list_worksheets(spreadsheet_name, force_refresh=force_refresh):
+            if worksheet.title == title:
+                return worksheet
+    raise gspread.exceptions.WorksheetNotFound(title)
+
+
+def invalidate_cache():
+    """Drop cached spreadsheet handles and worksheet lists (the client itself is kept)."""
+    with _lock:
+        _spreadsheets.clear()
+        _worksheet_cache.clear()
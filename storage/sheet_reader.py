@@ -0,0 +1,66 @@
+# storage/sheet_reader.py
+import threading
+
+import pandas as pd
+from gspread.utils import numericise_all, rowcol_to_a1
+
+from storage import authenticate_gsheets as auth_gsheets
+
+
+class IncrementalSheetReader:
+    """Keeps a worksheet's rows in a DataFrame and only fetches rows appended since the last read.
+
+    The first read downloads the whole sheet; later reads request the open-ended
+    range below the last row already seen (e.g. "A812:G"), so a refresh costs
+    as much at the end of the day as in the morning. Values are numericised the
+    same way `get_all_records()` does.
+    """
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+        self._lock = threading.Lock()
+        self._header = None
+        self._rows_seen = 0  # data rows (below the header) already in self._df
+        self._df = pd.DataFrame()
+
+    def read(self):
+        """Return the cached DataFrame after appending any new rows. Treat the result as read-only."""
+        with self._lock:
+            if self._header is None:
+                values = self._worksheet.get_all_values()
+                if not values:
+                    return self._df
+                self._header = values[0]
+                new_rows = values[1:]
+            else:
+                first_row = self._rows_seen + 2  # 1-based sheet row after the header and seen rows
+                last_col_a1 = rowcol_to_a1(1, len(self._header)).rstrip("0123456789")
+                new_rows = self._worksheet.get_values(f"A{first_row}:{last_col_a1}")
+
+            self._rows_seen += len(new_rows)
+            new_rows = [row for row in new_rows if any(cell != "" for cell in row)]
+            if new_rows:
+                width = len(self._header)
+                padded = [numericise_all((row + [""] * width)[:width]) for row in new_rows]
+                new_df = pd.DataFrame(padded, columns=self._header)
+                self._df = new_df if self._df.empty else pd.concat([self._df, new_df], ignore_index=True)
+            return self._df
+
+
+# --- One reader per (spreadsheet, tab), shared by all sessions ---
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(sheet_name, spreadsheet_name=None):
+    """Reader for a tab; readers for other tabs of the same spreadsheet (previous days) are dropped."""
+    key = (spreadsheet_name, sheet_name)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is None:
+            worksheet = auth_gsheets.get_worksheet(sheet_name, spreadsheet_name)
+            for stale_key in [k for k in _readers if k[0] == spreadsheet_name]:
+                del _readers[stale_key]
+            reader = IncrementalSheetReader(worksheet)
+            _readers[key] = reader
+        return reader
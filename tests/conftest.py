@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Backend modules import each other by top-level name (backend/ is on sys.path in app.py and main.py).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
@@ -0,0 +1,66 @@
+from deadband import DeadbandFilter, DeadbandRules
+
+RULES = DeadbandRules({"output_voltage": (0.5, 300), "switch": (0, None)}, default_heartbeat=60)
+
+
+def test_first_sample_is_always_due():
+    assert RULES.is_due("output_voltage", None, None, 230.0, 0)
+
+
+def test_numeric_deadband():
+    assert not RULES.is_due("output_voltage", 230.0, 0, 230.4, 10)
+    assert RULES.is_due("output_voltage", 230.0, 0, 230.5, 10)
+    assert RULES.is_due("output_voltage", 230.0, 0, 229.5, 10)
+    assert not RULES.is_due("output_voltage", 230.0, 0, 230.0, 10)
+
+
+def test_heartbeat_forces_a_write():
+    assert not RULES.is_due("output_voltage", 230.0, 0, 230.0, 299)
+    assert RULES.is_due("output_voltage", 230.0, 0, 230.0, 300)
+
+
+def test_no_heartbeat_and_non_numeric_values():
+    assert not RULES.is_due("switch", True, 0, True, 10 ** 6)
+    assert RULES.is_due("switch", True, 0, False, 1)
+
+
+def test_dp_without_rule_stores_changes_with_default_heartbeat():
+    assert RULES.is_due("unknown", 1, 0, 2, 1)
+    assert not RULES.is_due("unknown", 1, 0, 1, 59)
+    assert RULES.is_due("unknown", 1, 0, 1, 60)
+
+
+def test_drift_is_compared_against_last_stored_value():
+    flt = DeadbandFilter(RULES)
+    stored = [flt.should_store("dev", "output_voltage", ts, v)
+              for ts, v in ((0, 230.0), (1, 230.3), (2, 230.6), (3, 230.7))]
+    assert stored == [True, False, True, False]
+    assert flt.stats() == {"stored": 2, "skipped": 2, "skipped_by_dp": {"output_voltage": 2}}
+
+
+def test_batch_sees_its_own_staged_values():
+    flt = DeadbandFilter(RULES)
+    batch = flt.begin()
+    assert batch.should_store("dev", "output_voltage", 0, 230.0)
+    assert not batch.should_store("dev", "output_voltage", 1, 230.0)
+    batch.commit()
+    assert not flt.should_store("dev", "output_voltage", 2, 230.0)
+
+
+def test_uncommitted_batch_leaves_filter_untouched():
+    flt = DeadbandFilter(RULES)
+    flt.should_store("dev", "output_voltage", 0, 230.0)
+    batch = flt.begin()
+    assert batch.should_store("dev", "output_voltage", 60, 240.0)
+    # The transaction rolled back; the retry must store the sample again.
+    retry = flt.begin()
+    assert retry.should_store("dev", "output_voltage", 60, 240.0)
+    retry.commit()
+    assert flt.stats()["stored"] == 2
+
+
+def test_out_of_order_sample_is_stored_but_keeps_newer_reference():
+    flt = DeadbandFilter(RULES)
+    flt.should_store("dev", "output_voltage", 100, 230.0)
+    assert flt.should_store("dev", "output_voltage", 50, 230.0)
+    assert not flt.should_store("dev", "output_voltage", 101, 230.0)
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+import energy
+from energy import DAY_SECONDS, METER_DP_CODE, EnergyIntegrator, day_start
+from rollups import ENERGY_DP_CODE
+
+DEVICE = "dev"
+DAY = day_start(1_760_000_000)
+MIDNIGHT = DAY + DAY_SECONDS
+
+
+def _feed(integrator, conn, samples):
+    """One writer batch: stage the samples, store the checkpoints, then commit."""
+    batch = integrator.begin()
+    for dp_code, epoch_ts, value in samples:
+        batch.add_sample(DEVICE, dp_code, epoch_ts, value)
+    energy.write_checkpoints(conn, batch)
+    batch.commit()
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    energy.ensure_checkpoint_table(conn)
+    yield conn
+    conn.close()
+
+
+def test_constant_power_integrates_to_kwh(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, DAY + 600, 2.0), (ENERGY_DP_CODE, DAY + 900, 2.0)])
+    today = integrator.get_today(DEVICE, now=DAY + 900)
+    assert today["kwh"] == pytest.approx(2.0 * 300 / 3600)
+    assert today["gap_seconds"] == 600  # before the first sample of the day
+
+
+def test_midnight_rollover_splits_energy_between_days(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, MIDNIGHT - 120, 1.0)])
+    _feed(integrator, conn, [(ENERGY_DP_CODE, MIDNIGHT + 60, 1.0)])
+    assert integrator.get_today(DEVICE, now=MIDNIGHT + 60)["kwh"] == pytest.approx(60 / 3600)
+    # Yesterday's row got its final total from the batch that crossed midnight.
+    yesterday = energy.query_day(conn, DAY, DEVICE, now=MIDNIGHT + 60)
+    assert yesterday["kwh"] == pytest.approx(120 / 3600)
+    assert energy.query_day(conn, MIDNIGHT, DEVICE, now=MIDNIGHT + 60)["gap_seconds"] == 0
+
+
+def test_gap_longer_than_max_gap_counts_no_energy(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, MIDNIGHT - 300, 1.0)])
+    _feed(integrator, conn, [(ENERGY_DP_CODE, MIDNIGHT + 900, 1.0), (ENERGY_DP_CODE, MIDNIGHT + 960, 1.0)])
+    today = integrator.get_today(DEVICE, now=MIDNIGHT + 960)
+    assert today["kwh"] == pytest.approx(60 / 3600)
+    assert today["gap_seconds"] == 900
+    yesterday = energy.query_day(conn, DAY, DEVICE, now=MIDNIGHT + 960)
+    assert yesterday["kwh"] == 0.0
+    assert yesterday["gap_seconds"] == DAY_SECONDS
+
+
+def test_untracked_tail_counts_as_gap(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, DAY, 1.0), (ENERGY_DP_CODE, DAY + 60, 1.0)])
+    assert energy.query_day(conn, DAY, DEVICE, now=DAY + 3660)["gap_seconds"] == 3600
+    assert energy.query_day(conn, DAY, DEVICE, now=MIDNIGHT + 10)["gap_seconds"] == DAY_SECONDS - 60
+
+
+def test_meter_register_clear_keeps_metered_consumption(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(METER_DP_CODE, DAY + 60, 100.0), (METER_DP_CODE, DAY + 120, 101.5)])
+    _feed(integrator, conn, [(METER_DP_CODE, DAY + 180, 0.0), (METER_DP_CODE, DAY + 240, 0.5)])
+    assert integrator.get_today(DEVICE, now=DAY + 240)["meter_kwh"] == pytest.approx(2.0)
+
+
+def test_uncommitted_batch_leaves_integrator_untouched(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, DAY + 60, 1.0)])
+    batch = integrator.begin()
+    assert batch.add_sample(DEVICE, ENERGY_DP_CODE, DAY + 120, 1.0) == [(DAY + 60, pytest.approx(60 / 3600))]
+    assert integrator.get_today(DEVICE, now=DAY + 120)["kwh"] == 0.0
+    # The transaction rolled back; the retried batch integrates the same interval again.
+    _feed(integrator, conn, [(ENERGY_DP_CODE, DAY + 120, 1.0)])
+    assert integrator.get_today(DEVICE, now=DAY + 120)["kwh"] == pytest.approx(60 / 3600)
+
+
+def test_restore_round_trip_continues_integration(conn):
+    integrator = EnergyIntegrator(max_gap_seconds=600)
+    _feed(integrator, conn, [(ENERGY_DP_CODE, DAY + 60, 1.0), (ENERGY_DP_CODE, DAY + 120, 1.0),
+                             (METER_DP_CODE, DAY + 120, 50.0)])
+    before = integrator.get_today(DEVICE, now=DAY + 120)
+
+    restored = EnergyIntegrator(max_gap_seconds=600)
+    restored.restore(energy.load_latest_checkpoints(conn))
+    assert restored.get_today(DEVICE, now=DAY + 120) == before
+
+    # The restored last power sample closes the next interval as if nothing had restarted.
+    _feed(restored, conn, [(ENERGY_DP_CODE, DAY + 180, 1.0)])
+    assert restored.get_today(DEVICE, now=DAY + 180)["kwh"] == pytest.approx(120 / 3600)
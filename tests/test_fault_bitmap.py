@@ -0,0 +1,50 @@
+import data_processor
+from data_processor import DP_SPECS, decode_fault_bitmap, interpret_fault_bitmap, _fault_transitions
+
+LABELS = DP_SPECS["fault"]["labels"]
+
+
+def _reference_decode(value, labels):
+    return tuple(label for bit, label in enumerate(labels) if (value >> bit) & 1)
+
+
+def test_decode_matches_bit_by_bit_reference():
+    for value in (0, 1, 5, 0xFF, 0x100, 0x1FFFF, 0x10001, 0xABCDE):
+        assert decode_fault_bitmap(value, LABELS) == _reference_decode(value, LABELS)
+
+
+def test_decode_order_and_bits_beyond_labels():
+    assert decode_fault_bitmap(0b101, LABELS) == ("short_circuit_alarm", "overload_alarm")
+    # Bit 16 is the last label; higher bits have no label and are ignored.
+    assert decode_fault_bitmap(1 << 16, LABELS) == ("no_balance_alarm",)
+    assert decode_fault_bitmap(1 << 20, LABELS) == ()
+
+
+def test_interpret_fault_bitmap_strings():
+    assert interpret_fault_bitmap(0, LABELS) == "No active faults"
+    assert interpret_fault_bitmap(4, LABELS) == "overload_alarm"
+    assert interpret_fault_bitmap("x", LABELS) == "Unknown fault value type: x"
+
+
+def test_fault_transitions_raised_and_cleared():
+    events = _fault_transitions("dev", "2025-01-01 12:00:00", "fault", 4,
+                                ("short_circuit_alarm",), ("overload_alarm",))
+    assert [(e["fault_code"], e["event"]) for e in events] == [
+        ("overload_alarm", "raised"), ("short_circuit_alarm", "cleared")]
+    assert all(e["bitmap"] == 4 and e["device_id"] == "dev" for e in events)
+    assert _fault_transitions("dev", "2025-01-01 12:00:00", "fault", 4, ("overload_alarm",),
+                              ("overload_alarm",)) == []
+
+
+def test_snapshot_carries_fault_events_per_device():
+    data_processor.initialize_dp_state()
+    ts = "2025-01-01 12:00:00"
+    snapshot, _ = data_processor.process_device_data_snapshot("dev", [{"code": "fault", "value": 5}], ts)
+    assert {(e["fault_code"], e["event"]) for e in snapshot["fault_events"]} == {
+        ("short_circuit_alarm", "raised"), ("overload_alarm", "raised")}
+    snapshot, _ = data_processor.process_device_data_snapshot("dev", [{"code": "fault", "value": 5}], ts)
+    assert snapshot["fault_events"] == []
+    snapshot, _ = data_processor.process_device_data_snapshot("dev", [{"code": "fault", "value": 0}], ts)
+    assert {(e["fault_code"], e["event"]) for e in snapshot["fault_events"]} == {
+        ("short_circuit_alarm", "cleared"), ("overload_alarm", "cleared")}
+    assert data_processor.get_active_faults("dev") == {"fault": ()}
@@ -0,0 +1,33 @@
+import sqlite3
+
+from sqlite_writer import SQLiteBatchWriter
+
+
+def _writer(tmp_path, after_commit):
+    def write_batch(conn, batch):
+        conn.execute("CREATE TABLE IF NOT EXISTS t (x)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(x,) for x in batch])
+        return after_commit
+    return SQLiteBatchWriter(str(tmp_path / "t.db"), write_batch, flush_interval=0.05)
+
+
+def test_after_commit_runs_once_per_committed_batch(tmp_path):
+    calls = []
+    writer = _writer(tmp_path, lambda: calls.append(1))
+    writer.start()
+    writer.submit([1, 2])
+    writer.stop()
+    assert calls == [1]
+    assert (writer.written_count, writer.failed_batches) == (2, 0)
+
+
+def test_failing_after_commit_does_not_fail_the_batch(tmp_path):
+    def after_commit():
+        raise RuntimeError("boom")
+    writer = _writer(tmp_path, after_commit)
+    writer.start()
+    writer.submit([1, 2])
+    writer.stop()
+    assert (writer.written_count, writer.failed_batches, writer.failed_after_commit) == (2, 0, 1)
+    with sqlite3.connect(str(tmp_path / "t.db")) as conn:
+        assert conn.execute("SELECT count(*) FROM t").fetchone() == (2,)
@@ -1,13 +1,17 @@
 from .openapi import TuyaOpenAPI, TuyaTokenInfo
+from .openapi_async import AsyncTuyaOpenAPI
 from .openlogging import TUYA_LOGGER
 from .openmq import TuyaOpenMQ
+from .ratelimit import RateLimiter
 from .tuya_enums import AuthType, TuyaCloudOpenAPIEndpoint
 from .version import VERSION
 
 __all__ = [
     "TuyaOpenAPI",
     "TuyaTokenInfo",
+    "AsyncTuyaOpenAPI",
     "TuyaOpenMQ",
+    "RateLimiter",
     "AuthType",
     "TuyaCloudOpenAPIEndpoint",
     "TUYA_LOGGER",
@@ -1,20 +1,29 @@
 """Tuya Open API."""
 from __future__ import annotations
 
+import functools
 import hashlib
 import hmac
 import json
+import logging
+import threading
 import time
 from typing import Any
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .openlogging import filter_logger, logger
+from .ratelimit import RateLimiter
 from .tuya_enums import AuthType
 from .version import VERSION
 
 TUYA_ERROR_CODE_TOKEN_INVALID = 1010
 
+# Methods the transport may retry on connection errors and 5xx; POST (login, commands) is never replayed.
+IDEMPOTENT_METHODS = frozenset({"GET", "PUT", "DELETE", "HEAD", "OPTIONS"})
+
 TO_C_CUSTOM_REFRESH_TOKEN_API = "/v1.0/iot-03/users/token/"
 TO_C_SMART_HOME_REFRESH_TOKEN_API = "/v1.0/token/"
 
@@ -22,6 +31,20 @@ TO_C_CUSTOM_TOKEN_API = "/v1.0/iot-03/users/login"
 TO_C_SMART_HOME_TOKEN_API = "/v1.0/iot-01/associated-users/actions/authorized-login"
 
 
+EMPTY_BODY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+@functools.lru_cache(maxsize=8)
+def _hmac_template(secret: str) -> hmac.HMAC:
+    """Keyed HMAC-SHA256 with no data yet; copy() it per message instead of re-deriving the key."""
+    return hmac.new(secret.encode("utf8"), digestmod=hashlib.sha256)
+
+
+def serialize_body(body: dict[str, Any] | None) -> str:
+    """Request body as sent and signed; "" for no body."""
+    return json.dumps(body) if body else ""
+
+
 class TuyaTokenInfo:
     """Tuya token info.
 
@@ -62,9 +85,41 @@ class TuyaOpenAPI:
         access_secret: str,
         auth_type: AuthType = AuthType.SMART_HOME,
         lang: str = "en",
+        token_refresh_margin: int = 60,
+        pool_maxsize: int = 10,
+        max_retries: int = 3,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+        rate_limiter: RateLimiter | None = None,
+        rate_limit_timeout: float | None = None,
     ) -> None:
-        """Init TuyaOpenAPI."""
+        """Init TuyaOpenAPI.
+
+        Args:
+            token_refresh_margin (int): refresh the access token this many seconds before it expires
+            pool_maxsize (int): keep-alive connections kept per host; size it to the number of concurrent callers
+            max_retries (int): transport retries for idempotent requests (connection errors, 5xx)
+            connect_timeout (float): seconds to establish a connection
+            read_timeout (float): seconds to wait for the server between bytes of the response
+            rate_limiter (RateLimiter): paces requests; non-GET and token calls use its priority lane
+            rate_limit_timeout (float): give up (return None) after waiting this long for budget; None waits
+        """
         self.session = requests.session()
+        retry = Retry(
+            total=max_retries,
+            # A read timeout already cost read_timeout seconds; retry it at most once to bound a stuck call.
+            read=min(1, max_retries),
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = rate_limiter
+        self.rate_limit_timeout = rate_limit_timeout
 
         self.endpoint = endpoint
         self.access_id = access_id
@@ -78,6 +133,9 @@ class TuyaOpenAPI:
             self.__login_path = TO_C_SMART_HOME_TOKEN_API
 
         self.token_info: TuyaTokenInfo = None
+        # Serialises refresh and re-login so only one is ever in flight; see __refresh_access_token_if_need.
+        self.__token_lock = threading.RLock()
+        self.token_refresh_margin = token_refresh_margin
 
         self.dev_channel: str = ""
 
@@ -93,79 +151,92 @@ class TuyaOpenAPI:
         path: str,
         params: dict[str, Any] | None = None,
         body: dict[str, Any] | None = None,
+        access_token: str | None = None,
+        body_json: str | None = None,
     ) -> tuple[str, int]:
+        """Sign a request.
 
-        # HTTPMethod
-        str_to_sign = method
-        str_to_sign += "\n"
-
+        `access_token` overrides the cached token ("" signs without one) and
+        `body_json` is the already serialised body (see serialize_body), which
+        saves dumping `body` a second time.
+        """
         # Content-SHA256
-        content_to_sha256 = (
-            "" if body is None or len(body.keys()) == 0 else json.dumps(body)
+        if body_json is None:
+            body_json = serialize_body(body)
+        content_sha256 = (
+            hashlib.sha256(body_json.encode("utf8")).hexdigest() if body_json else EMPTY_BODY_SHA256
         )
 
-        str_to_sign += (
-            hashlib.sha256(content_to_sha256.encode("utf8")).hexdigest().lower()
-        )
-        str_to_sign += "\n"
-
-        # Header
-        str_to_sign += "\n"
-
         # URL
-        str_to_sign += path
+        url = path
+        if params:
+            url += "?" + "&".join(f"{key}={params[key]}" for key in sorted(params))
 
-        if params is not None and len(params.keys()) > 0:
-            str_to_sign += "?"
-
-            params_keys = sorted(params.keys())
-            query_builder = "".join(f"{key}={params[key]}&" for key in params_keys)
-            str_to_sign += query_builder[:-1]
+        # HTTPMethod, Content-SHA256, Header (none signed), URL
+        str_to_sign = f"{method}\n{content_sha256}\n\n{url}"
 
         # Sign
         t = int(time.time() * 1000)
 
-        message = self.access_id
-        if self.token_info is not None:
-            message += self.token_info.access_token
-        message += str(t) + str_to_sign
-        sign = (
-            hmac.new(
-                self.access_secret.encode("utf8"),
-                msg=message.encode("utf8"),
-                digestmod=hashlib.sha256,
-            )
-            .hexdigest()
-            .upper()
+        if access_token is None and self.token_info is not None:
+            access_token = self.token_info.access_token
+        message = f"{self.access_id}{access_token or ''}{t}{str_to_sign}"
+        mac = _hmac_template(self.access_secret).copy()
+        mac.update(message.encode("utf8"))
+        return mac.hexdigest().upper(), t
+
+    def __token_expiring(self) -> bool:
+        now = int(time.time() * 1000)
+        return self.token_info.expire_time - self.token_refresh_margin * 1000 <= now
+
+    def __is_token_path(self, path: str) -> bool:
+        return (
+            path.startswith(self.__login_path)
+            or path.startswith(TO_C_CUSTOM_REFRESH_TOKEN_API)
+            or path.startswith(TO_C_SMART_HOME_REFRESH_TOKEN_API)
         )
-        return sign, t
 
     def __refresh_access_token_if_need(self, path: str):
         if self.is_connect() is False:
             return
 
-        if path.startswith(self.__login_path):
+        if self.__is_token_path(path):
             return
 
         # should use refresh token?
-        now = int(time.time() * 1000)
-        expired_time = self.token_info.expire_time
-
-        if expired_time - 60 * 1000 > now:  # 1min
+        if not self.__token_expiring():
             return
 
-        self.token_info.access_token = ""
-
-        if self.auth_type == AuthType.CUSTOM:
-            response = self.post(
-                TO_C_CUSTOM_REFRESH_TOKEN_API + self.token_info.refresh_token
-            )
-        else:
-            response = self.get(
-                TO_C_SMART_HOME_REFRESH_TOKEN_API + self.token_info.refresh_token
+        # Single flight: the first caller refreshes, the others wait here and then find a fresh
+        # token. The old token stays in place meanwhile, so requests already signed with it
+        # (still valid for token_refresh_margin) are not disturbed.
+        with self.__token_lock:
+            if self.is_connect() is False or not self.__token_expiring():
+                return
+
+            if self.auth_type == AuthType.CUSTOM:
+                response = self.post(
+                    TO_C_CUSTOM_REFRESH_TOKEN_API + self.token_info.refresh_token
+                )
+            else:
+                response = self.get(
+                    TO_C_SMART_HOME_REFRESH_TOKEN_API + self.token_info.refresh_token
+                )
+
+            if response and response.get("success"):
+                self.token_info = TuyaTokenInfo(response)
+            else:
+                logger.error(f"Token refresh failed: {filter_logger(response)}")
+
+    def __relogin(self, stale_access_token: str) -> bool:
+        """Log in again after a token-invalid response, unless another thread already did."""
+        with self.__token_lock:
+            if self.token_info is not None and self.token_info.access_token != stale_access_token:
+                return True
+            response = self.connect(
+                self.__username, self.__password, self.__country_code, self.__schema
             )
-
-        self.token_info = TuyaTokenInfo(response)
+            return bool(response and response.get("success"))
 
     def set_dev_channel(self, dev_channel: str):
         """Set dev channel."""
@@ -215,7 +286,7 @@ class TuyaOpenAPI:
                 },
             )
 
-        if not response["success"]:
+        if not response or not response["success"]:
             return response
 
         # Cache token info.
@@ -233,12 +304,20 @@ class TuyaOpenAPI:
         path: str,
         params: dict[str, Any] | None = None,
         body: dict[str, Any] | None = None,
+        retry_on_token_invalid: bool = True,
     ) -> dict[str, Any]:
 
         self.__refresh_access_token_if_need(path)
 
-        access_token = self.token_info.access_token if self.token_info else ""
-        sign, t = self._calculate_sign(method, path, params, body)
+        is_token_path = self.__is_token_path(path)
+        # Token management calls are signed without the access token. Read the token once so
+        # the signature and the header always agree, even if another thread swaps it.
+        if is_token_path or self.token_info is None:
+            access_token = ""
+        else:
+            access_token = self.token_info.access_token
+        body_json = serialize_body(body)
+        sign, t = self._calculate_sign(method, path, params, body, access_token, body_json)
         headers = {
             "client_id": self.access_id,
             "sign": sign,
@@ -248,43 +327,67 @@ class TuyaOpenAPI:
             "lang": self.lang,
         }
 
-        if path == self.__login_path or \
-            path.startswith(TO_C_CUSTOM_REFRESH_TOKEN_API) or\
-            path.startswith(TO_C_SMART_HOME_REFRESH_TOKEN_API):
+        if is_token_path:
             headers["dev_lang"] = "python"
             headers["dev_version"] = VERSION
             headers["dev_channel"] = self.dev_channel
 
-        logger.debug(
-            f"Request: method = {method}, \
-                url = {self.endpoint + path},\
-                params = {params},\
-                body = {filter_logger(body)},\
-                t = {int(time.time()*1000)}"
-        )
+        if body_json:
+            # Send exactly the string that was hashed into the signature.
+            headers["Content-Type"] = "application/json"
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                f"Request: method = {method}, \
+                    url = {self.endpoint + path},\
+                    params = {params},\
+                    body = {filter_logger(body)},\
+                    t = {int(time.time()*1000)}"
+            )
 
-        response = self.session.request(
-            method, self.endpoint + path, params=params, json=body, headers=headers
-        )
+        if self.rate_limiter is not None:
+            # Commands and token calls go ahead of bulk status polls.
+            priority = method != "GET" or is_token_path
+            if not self.rate_limiter.acquire(path, priority, self.rate_limit_timeout):
+                logger.warning(f"Rate limit budget exhausted, dropping request: method={method}, path={path}")
+                return None
+
+        try:
+            response = self.session.request(
+                method,
+                self.endpoint + path,
+                params=params,
+                data=body_json.encode("utf8") if body_json else None,
+                headers=headers,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            logger.error(f"Request error: method={method}, path={path}, error={e}")
+            return None
 
         if response.ok is False:
+            if self.rate_limiter is not None:
+                self.rate_limiter.record_response(response.status_code)
             logger.error(
-                f"Response error: code={response.status_code}, body={response.body}"
+                f"Response error: code={response.status_code}, body={response.text}"
             )
             return None
 
         result = response.json()
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_response(response.status_code, result.get("code"))
 
-        logger.debug(
-            f"Response: {json.dumps(filter_logger(result), ensure_ascii=False, indent=2)}"
-        )
-
-        if result.get("code", -1) == TUYA_ERROR_CODE_TOKEN_INVALID:
-            self.token_info = None
-            self.connect(
-                self.__username, self.__password, self.__country_code, self.__schema
+        if debug:
+            logger.debug(
+                f"Response: {json.dumps(filter_logger(result), ensure_ascii=False, indent=2)}"
             )
 
+        if result.get("code", -1) == TUYA_ERROR_CODE_TOKEN_INVALID and not is_token_path:
+            # Retry once with the new token; a second 1010 is returned to the caller.
+            if retry_on_token_invalid and self.__relogin(access_token):
+                return self.__request(method, path, params, body, retry_on_token_invalid=False)
+
         return result
 
     def get(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
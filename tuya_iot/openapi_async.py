@@ -0,0 +1,362 @@
+"""Tuya Open API, asyncio variant."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for AsyncTuyaOpenAPI
+    aiohttp = None
+
+from .openapi import (
+    TO_C_CUSTOM_REFRESH_TOKEN_API,
+    TO_C_CUSTOM_TOKEN_API,
+    TO_C_SMART_HOME_REFRESH_TOKEN_API,
+    TO_C_SMART_HOME_TOKEN_API,
+    TUYA_ERROR_CODE_TOKEN_INVALID,
+    TuyaOpenAPI,
+    TuyaTokenInfo,
+    serialize_body,
+)
+from .openlogging import filter_logger, logger
+from .tuya_enums import AuthType
+from .version import VERSION
+
+
+class AsyncTuyaOpenAPI:
+    """Open Api on asyncio/aiohttp.
+
+    Same signing, token refresh and re-login-and-retry-on-1010 behaviour as TuyaOpenAPI,
+    but requests are coroutines sharing one pooled aiohttp session, so a single
+    event loop can keep many calls in flight. A token refresh is single-flight:
+    concurrent requests that find the token expiring wait for the one refresh.
+    Connection errors and timeouts propagate as aiohttp.ClientError /
+    asyncio.TimeoutError.
+
+    Typical usage example:
+
+    async with AsyncTuyaOpenAPI(ENDPOINT, ACCESS_ID, ACCESS_KEY) as openapi:
+        await openapi.connect(USERNAME, PASSWORD, COUNTRY_CODE, SCHEMA)
+        responses = await asyncio.gather(*(openapi.get(path) for path in paths))
+    """
+
+    _calculate_sign = TuyaOpenAPI._calculate_sign
+
+    def __init__(
+        self,
+        endpoint: str,
+        access_id: str,
+        access_secret: str,
+        auth_type: AuthType = AuthType.SMART_HOME,
+        lang: str = "en",
+        token_refresh_margin: int = 60,
+        connection_limit: int = 100,
+        connection_limit_per_host: int = 0,
+        request_timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+    ) -> None:
+        """Init AsyncTuyaOpenAPI.
+
+        Args:
+            token_refresh_margin (int): refresh the access token this many seconds before it expires
+            connection_limit (int): max open connections in the pool (0 = unlimited)
+            connection_limit_per_host (int): max open connections per host (0 = unlimited)
+            request_timeout (float): total seconds allowed per request
+            connect_timeout (float): seconds allowed to acquire and open a connection
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncTuyaOpenAPI requires the aiohttp package")
+
+        self.endpoint = endpoint
+        self.access_id = access_id
+        self.access_secret = access_secret
+        self.lang = lang
+
+        self.auth_type = auth_type
+        if self.auth_type == AuthType.CUSTOM:
+            self.__login_path = TO_C_CUSTOM_TOKEN_API
+        else:
+            self.__login_path = TO_C_SMART_HOME_TOKEN_API
+
+        self.token_info: TuyaTokenInfo = None
+        self.token_refresh_margin = token_refresh_margin
+
+        self.dev_channel: str = ""
+
+        self.__username = ""
+        self.__password = ""
+        self.__country_code = ""
+        self.__schema = ""
+
+        self._connection_limit = connection_limit
+        self._connection_limit_per_host = connection_limit_per_host
+        self._timeout = aiohttp.ClientTimeout(total=request_timeout, connect=connect_timeout)
+        # Created on first use so they bind to the running event loop.
+        self._session: aiohttp.ClientSession | None = None
+        self._token_lock: asyncio.Lock | None = None
+
+    async def __aenter__(self) -> AsyncTuyaOpenAPI:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connection_limit,
+                limit_per_host=self._connection_limit_per_host,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+        return self._session
+
+    def _get_token_lock(self) -> asyncio.Lock:
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        return self._token_lock
+
+    async def close(self) -> None:
+        """Close the underlying HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def __is_token_path(self, path: str) -> bool:
+        return (
+            path == self.__login_path
+            or path.startswith(TO_C_CUSTOM_REFRESH_TOKEN_API)
+            or path.startswith(TO_C_SMART_HOME_REFRESH_TOKEN_API)
+        )
+
+    def __token_expiring(self) -> bool:
+        now = int(time.time() * 1000)
+        return self.token_info.expire_time - self.token_refresh_margin * 1000 <= now
+
+    async def __refresh_access_token_if_need(self, path: str):
+        if self.is_connect() is False:
+            return
+
+        if self.__is_token_path(path) or path.startswith(self.__login_path):
+            return
+
+        if not self.__token_expiring():
+            return
+
+        async with self._get_token_lock():
+            # Another request may have refreshed the token while this one waited.
+            if self.is_connect() is False or not self.__token_expiring():
+                return
+
+            if self.auth_type == AuthType.CUSTOM:
+                response = await self.post(
+                    TO_C_CUSTOM_REFRESH_TOKEN_API + self.token_info.refresh_token
+                )
+            else:
+                response = await self.get(
+                    TO_C_SMART_HOME_REFRESH_TOKEN_API + self.token_info.refresh_token
+                )
+
+            if response and response.get("success"):
+                self.token_info = TuyaTokenInfo(response)
+
+    async def __reconnect(self, stale_token_info: TuyaTokenInfo) -> bool:
+        async with self._get_token_lock():
+            # Only the first request to see the invalid token logs in again.
+            if self.token_info is not None and self.token_info is not stale_token_info:
+                return True
+            response = await self.connect(
+                self.__username, self.__password, self.__country_code, self.__schema
+            )
+            return bool(response and response.get("success"))
+
+    def set_dev_channel(self, dev_channel: str):
+        """Set dev channel."""
+        self.dev_channel = dev_channel
+
+    async def connect(
+        self,
+        username: str = "",
+        password: str = "",
+        country_code: str = "",
+        schema: str = "",
+    ) -> dict[str, Any]:
+        """Connect to Tuya Cloud.
+
+        Args:
+            username (str): user name in to C
+            password (str): user password in to C
+            country_code (str): country code in SMART_HOME
+            schema (str): app schema in SMART_HOME
+
+        Returns:
+            response: connect response
+        """
+        self.__username = username
+        self.__password = password
+        self.__country_code = country_code
+        self.__schema = schema
+
+        if self.auth_type == AuthType.CUSTOM:
+            response = await self.post(
+                TO_C_CUSTOM_TOKEN_API,
+                {
+                    "username": username,
+                    "password": hashlib.sha256(password.encode("utf8"))
+                    .hexdigest()
+                    .lower(),
+                },
+            )
+        else:
+            response = await self.post(
+                TO_C_SMART_HOME_TOKEN_API,
+                {
+                    "username": username,
+                    "password": hashlib.md5(password.encode("utf8")).hexdigest(),
+                    "country_code": country_code,
+                    "schema": schema,
+                },
+            )
+
+        if not response or not response["success"]:
+            return response
+
+        # Cache token info.
+        self.token_info = TuyaTokenInfo(response)
+
+        return response
+
+    def is_connect(self) -> bool:
+        """Is connect to tuya cloud."""
+        return self.token_info is not None and len(self.token_info.access_token) > 0
+
+    async def __request(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+        retry_on_token_invalid: bool = True,
+    ) -> dict[str, Any]:
+
+        await self.__refresh_access_token_if_need(path)
+
+        # Token management calls are signed without the access token.
+        token_info = self.token_info
+        if self.__is_token_path(path) or token_info is None:
+            access_token = ""
+        else:
+            access_token = token_info.access_token
+        body_json = serialize_body(body)
+        sign, t = self._calculate_sign(method, path, params, body, access_token, body_json)
+
+        headers = {
+            "client_id": self.access_id,
+            "sign": sign,
+            "sign_method": "HMAC-SHA256",
+            "access_token": access_token,
+            "t": str(t),
+            "lang": self.lang,
+        }
+
+        if self.__is_token_path(path):
+            headers["dev_lang"] = "python"
+            headers["dev_version"] = VERSION
+            headers["dev_channel"] = self.dev_channel
+
+        if body_json:
+            # Send exactly the string that was hashed into the signature.
+            headers["Content-Type"] = "application/json"
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                f"Request: method = {method}, \
+                    url = {self.endpoint + path},\
+                    params = {params},\
+                    body = {filter_logger(body)},\
+                    t = {int(time.time()*1000)}"
+            )
+
+        async with self._get_session().request(
+            method, self.endpoint + path, params=params, data=body_json or None, headers=headers
+        ) as response:
+            if response.ok is False:
+                logger.error(
+                    f"Response error: code={response.status}, body={await response.text()}"
+                )
+                return None
+
+            result = await response.json(content_type=None)
+
+        if debug:
+            logger.debug(
+                f"Response: {json.dumps(filter_logger(result), ensure_ascii=False, indent=2)}"
+            )
+
+        if result.get("code", -1) == TUYA_ERROR_CODE_TOKEN_INVALID and not self.__is_token_path(path):
+            # Retry once with the new token; a second 1010 is returned to the caller.
+            if retry_on_token_invalid and await self.__reconnect(token_info):
+                return await self.__request(method, path, params, body, retry_on_token_invalid=False)
+
+        return result
+
+    async def get(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Http Get.
+
+        Requests the server to return specified resources.
+
+        Args:
+            path (str): api path
+            params (map): request parameter
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("GET", path, params, None)
+
+    async def post(self, path: str, body: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Http Post.
+
+        Requests the server to update specified resources.
+
+        Args:
+            path (str): api path
+            body (map): request body
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("POST", path, None, body)
+
+    async def put(self, path: str, body: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Http Put.
+
+        Requires the server to perform specified operations.
+
+        Args:
+            path (str): api path
+            body (map): request body
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("PUT", path, None, body)
+
+    async def delete(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Http Delete.
+
+        Requires the server to delete specified resources.
+
+        Args:
+            path (str): api path
+            params (map): request param
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("DELETE", path, params, None)
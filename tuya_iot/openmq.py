@@ -1,8 +1,10 @@
 """Tuya Open IOT HUB which base on MQTT."""
 from __future__ import annotations
 
-import base64
+import binascii
 import json
+import logging
+import queue
 import threading
 import time
 import uuid
@@ -11,6 +13,11 @@ from urllib.parse import urlsplit
 from typing import Optional
 
 from Crypto.Cipher import AES
+
+try:
+    import orjson
+except ImportError:  # optional, faster JSON parsing of broker messages
+    orjson = None
 from paho.mqtt import client as mqtt
 from requests.exceptions import RequestException
 
@@ -25,6 +32,21 @@ CONNECT_FAILED_NOT_AUTHORISED = 5
 TO_C_CUSTOM_MQTT_CONFIG_API = "/v1.0/iot-03/open-hub/access-config"
 TO_C_SMART_HOME_MQTT_CONFIG_API = "/v1.0/open-hub/access/config"
 
+# Overflow policies for a listener's full queue.
+OVERFLOW_DROP_NEWEST = "drop_newest"  # discard the incoming message
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # evict the oldest queued message to make room
+OVERFLOW_BLOCK = "block"              # wait up to block_timeout on the network thread, then discard
+OVERFLOW_POLICIES = (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK)
+
+_STOP = object()
+
+
+def _json_loads(data: bytes | memoryview) -> Any:
+    """Parse UTF-8 JSON from a bytes-like object, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
 
 class TuyaMQConfig:
     """Tuya mqtt config."""
@@ -39,26 +61,184 @@ class TuyaMQConfig:
         self.source_topic = result.get("source_topic", {})
         self.sink_topic = result.get("sink_topic", {})
         self.expire_time = result.get("expire_time", 0)
+        # Message key material, derived once per config instead of once per message.
+        self.aes_key = self.password[8:24].encode("utf8")
+        self._ecb_cipher = None
+
+    def ecb_cipher(self):
+        """AES-ECB cipher for this config's key. ECB keeps no state between calls, so one object serves every message."""
+        if self._ecb_cipher is None:
+            self._ecb_cipher = AES.new(self.aes_key, AES.MODE_ECB)
+        return self._ecb_cipher
+
+
+class _ListenerWorker:
+    """Delivers messages to one listener from its own bounded queue and thread.
+
+    Lag is the time a message waited in the queue before the listener got it.
+    """
+
+    def __init__(
+        self,
+        listener: Callable[[dict[str, Any]], None],
+        maxsize: int,
+        overflow: str,
+        block_timeout: float,
+    ) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.listener = listener
+        self.name = getattr(listener, "__qualname__", repr(listener))
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, int(maxsize)))
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+        self._thread = threading.Thread(target=self._run, name=f"mq-listener-{self.name}", daemon=True)
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, msg: dict[str, Any]) -> bool:
+        """Enqueue without blocking the caller (unless the policy is "block"). False if a message was dropped."""
+        item = (time.monotonic(), msg)
+        if self._overflow == OVERFLOW_BLOCK:
+            try:
+                self._queue.put(item, timeout=self._block_timeout)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        self.dropped += 1
+        if self._overflow == OVERFLOW_DROP_NEWEST:
+            return False
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            pass
+        return False
+
+    def stop(self, timeout: float = 5):
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return  # daemon thread; it ends with the process
+        self._thread.join(timeout=timeout)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "depth": self._queue.qsize(),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            enqueued_at, msg = item
+            self.last_lag = time.monotonic() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                self.listener(msg)
+            except Exception:
+                self.errors += 1
+                logger.exception(f"mqtt message listener {self.name} failed")
+            self.delivered += 1
+
+
+class _InlineListener:
+    """Calls a listener directly on the MQTT network thread, for listeners that only hand the message off.
+
+    Used when the listener already has its own queue (e.g. an ingest pipeline's
+    `submit`), so messages pass through a single bounded queue and overflow policy.
+    """
+
+    def __init__(self, listener: Callable[[dict[str, Any]], None]) -> None:
+        self.listener = listener
+        self.name = getattr(listener, "__qualname__", repr(listener))
+        self.delivered = 0
+        self.errors = 0
+
+    def start(self):
+        pass
+
+    def put(self, msg: dict[str, Any]) -> bool:
+        try:
+            self.listener(msg)
+        except Exception:
+            self.errors += 1
+            logger.exception(f"mqtt message listener {self.name} failed")
+        self.delivered += 1
+        return True
+
+    def stop(self, timeout: float = 5):
+        pass
+
+    def stats(self) -> dict[str, Any]:
+        return {"depth": 0, "delivered": self.delivered, "dropped": 0, "errors": self.errors,
+                "last_lag": 0.0, "max_lag": 0.0}
 
 
 class TuyaOpenMQ(threading.Thread):
     """Tuya open iot hub.
 
-    Tuya open iot hub base on mqtt.
+    Tuya open iot hub base on mqtt. Decoded messages are handed to each
+    listener through its own bounded queue and worker thread, so a slow
+    listener never blocks the MQTT network thread (keep-alives) or the other
+    listeners. Listeners added with `inline=True` are called directly on the
+    network thread instead and must return quickly.
 
     Attributes:
       openapi: tuya openapi
     """
 
-    def __init__(self, api: TuyaOpenAPI) -> None:
-        """Init TuyaOpenMQ."""
+    def __init__(
+        self,
+        api: TuyaOpenAPI,
+        listener_queue_size: int = 1000,
+        listener_overflow: str = OVERFLOW_DROP_OLDEST,
+        listener_block_timeout: float = 0.5,
+    ) -> None:
+        """Init TuyaOpenMQ.
+
+        Args:
+            listener_queue_size (int): default queue size per listener
+            listener_overflow (str): default policy when a listener's queue is full, one of OVERFLOW_POLICIES
+            listener_block_timeout (float): seconds the "block" policy waits before discarding
+        """
         threading.Thread.__init__(self)
         self.api: TuyaOpenAPI = api
         self._stop_event = threading.Event()
         self._reconnect_event = threading.Event()
         self.client = None
         self.mq_config = None
-        self.message_listeners = set()
+        self.message_listeners: dict[Callable, _ListenerWorker | _InlineListener] = {}
+        self._listeners_lock = threading.Lock()
+        self.listener_queue_size = listener_queue_size
+        self.listener_overflow = listener_overflow
+        self.listener_block_timeout = listener_block_timeout
         self._last_disconnect_log_time = 0.0
 
     def _get_mqtt_config(self) -> Optional[TuyaMQConfig]:
@@ -82,19 +262,15 @@ class TuyaOpenMQ(threading.Thread):
 
         return TuyaMQConfig(response)
 
-    def _decode_mq_message(self, b64msg: str, password: str, t: str) -> dict[str, Any]:
-        key = password[8:24]
+    def _decode_mq_message(self, b64msg: str, mq_config: TuyaMQConfig, t: str) -> dict[str, Any]:
+        # base64 decode; slices below are memoryviews into this one buffer
+        buffer = memoryview(binascii.a2b_base64(b64msg))
 
         if self.api.auth_type == AuthType.SMART_HOME:
-            cipher = AES.new(key.encode("utf8"), AES.MODE_ECB)
-            msg = cipher.decrypt(base64.b64decode(b64msg))
+            msg = memoryview(mq_config.ecb_cipher().decrypt(buffer))
             padding_bytes = msg[-1]
-            msg = msg[:-padding_bytes]
-            return json.loads(msg)
+            return _json_loads(msg[:-padding_bytes])
         else:
-            # base64 decode
-            buffer = base64.b64decode(b64msg)
-
             # get iv buffer
             iv_length = int.from_bytes(buffer[0:4], byteorder="big")
             iv_buffer = buffer[4: iv_length + 4]
@@ -108,12 +284,11 @@ class TuyaOpenMQ(threading.Thread):
             # tag
             tag_buffer = buffer[len(buffer) - GCM_TAG_LENGTH:]
 
-            cipher = AES.new(key.encode("utf8"), AES.MODE_GCM, nonce=iv_buffer)
+            # GCM needs a fresh cipher per nonce; only the key is reused.
+            cipher = AES.new(mq_config.aes_key, AES.MODE_GCM, nonce=iv_buffer)
             cipher.update(aad_buffer)
-            plaintext = cipher.decrypt_and_verify(data_buffer, tag_buffer).decode(
-                "utf8"
-            )
-            return json.loads(plaintext)
+            plaintext = cipher.decrypt_and_verify(data_buffer, tag_buffer)
+            return _json_loads(plaintext)
 
     def _on_disconnect(self, client, userdata, rc):
         # If we are shutting down, do not trigger a reconnect.
@@ -143,24 +318,25 @@ class TuyaOpenMQ(threading.Thread):
             self._reconnect_event.set()
 
     def _on_message(self, mqttc: mqtt.Client, user_data: Any, msg: mqtt.MQTTMessage):
-        logger.debug(f"payload-> {msg.payload}")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"payload-> {msg.payload}")
 
-        msg_dict = json.loads(msg.payload.decode("utf8"))
+        msg_dict = _json_loads(msg.payload)
 
         t = msg_dict.get("t", "")
 
         mq_config = user_data["mqConfig"]
-        decrypted_data = self._decode_mq_message(
-            msg_dict["data"], mq_config.password, t
-        )
+        decrypted_data = self._decode_mq_message(msg_dict["data"], mq_config, t)
         if decrypted_data is None:
             return
 
         msg_dict["data"] = decrypted_data
-        logger.debug(f"on_message: {msg_dict}")
+        if debug:
+            logger.debug(f"on_message: {msg_dict}")
 
-        for listener in self.message_listeners:
-            listener(msg_dict)
+        for worker in list(self.message_listeners.values()):
+            worker.put(msg_dict)
 
     def _on_subscribe(self, mqttc: mqtt.Client, user_data: Any, mid, granted_qos):
         logger.debug(f"_on_subscribe: {mid}")
@@ -248,7 +424,11 @@ class TuyaOpenMQ(threading.Thread):
         logger.debug("stop")
         self._stop_event.set()
         self._reconnect_event.clear()
-        self.message_listeners = set()
+        with self._listeners_lock:
+            workers = list(self.message_listeners.values())
+            self.message_listeners = {}
+        for worker in workers:
+            worker.stop()
         if self.client is not None:
             try:
                 self.client.loop_stop(force=True)
@@ -258,10 +438,44 @@ class TuyaOpenMQ(threading.Thread):
             finally:
                 self.client = None
 
-    def add_message_listener(self, listener: Callable[[str], None]):
-        """Add mqtt message listener."""
-        self.message_listeners.add(listener)
-
-    def remove_message_listener(self, listener: Callable[[str], None]):
+    def add_message_listener(
+        self,
+        listener: Callable[[dict[str, Any]], None],
+        maxsize: int | None = None,
+        overflow: str | None = None,
+        inline: bool = False,
+    ):
+        """Add mqtt message listener.
+
+        Args:
+            listener (callable): called with each decoded message on the listener's own thread
+            maxsize (int): queue size for this listener (default listener_queue_size)
+            overflow (str): overflow policy for this listener (default listener_overflow)
+            inline (bool): call the listener on the MQTT network thread, without a queue
+                (for listeners that only enqueue into their own bounded queue)
+        """
+        with self._listeners_lock:
+            if listener in self.message_listeners:
+                return
+            if inline:
+                worker = _InlineListener(listener)
+            else:
+                worker = _ListenerWorker(
+                    listener,
+                    maxsize or self.listener_queue_size,
+                    overflow or self.listener_overflow,
+                    self.listener_block_timeout,
+                )
+            worker.start()
+            self.message_listeners[listener] = worker
+
+    def remove_message_listener(self, listener: Callable[[dict[str, Any]], None]):
         """Remvoe mqtt message listener."""
-        self.message_listeners.discard(listener)
+        with self._listeners_lock:
+            worker = self.message_listeners.pop(listener, None)
+        if worker is not None:
+            worker.stop()
+
+    def listener_stats(self) -> dict[str, dict[str, Any]]:
+        """Queue depth, delivered/dropped/error counts and lag (seconds) per listener."""
+        return {worker.name: worker.stats() for worker in list(self.message_listeners.values())}
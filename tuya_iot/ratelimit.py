@@ -0,0 +1,156 @@
+"""Client-side rate limiting for Tuya Open API calls."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Iterable
+
+from .openlogging import logger
+
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Tuya answers rate-limited calls with HTTP 200 and one of these codes in the body:
+# 1110 "concurrent request over limit", 40000309 "request frequency exceeds the limit".
+DEFAULT_RATE_LIMIT_CODES = (1110, 40000309)
+
+
+class TokenBucket:
+    """Token bucket with a priority lane.
+
+    Tokens refill at `rate * scale` per second up to `capacity`. While any
+    priority caller is waiting, normal callers do not take tokens, so priority
+    requests go first once the bucket refills.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """Init TokenBucket."""
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.scale = 1.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._priority_waiting = 0
+        self._cond = threading.Condition()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate * self.scale)
+        self._updated = now
+
+    def acquire(self, priority: bool = False, timeout: float | None = None) -> bool:
+        """Take one token, waiting up to `timeout` seconds (None waits forever). Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if priority:
+                self._priority_waiting += 1
+            try:
+                while True:
+                    self._refill_locked()
+                    if self._tokens >= 1 and (priority or self._priority_waiting == 0):
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / (self.rate * self.scale) if self._tokens < 1 else 0.05
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait = min(wait, remaining)
+                    self._cond.wait(max(wait, 0.001))
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+                    self._cond.notify_all()
+
+    def set_scale(self, scale: float) -> None:
+        with self._cond:
+            self._refill_locked()
+            self.scale = scale
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """Paces API calls with a global token bucket plus optional per-endpoint buckets.
+
+    Endpoint budgets are keyed by path prefix; the longest matching prefix
+    applies on top of the global budget. Throttling is adaptive (AIMD): every
+    rate-limit response (HTTP 429 or one of `rate_limit_codes`) halves the
+    allowed rate of all buckets, down to `min_scale`, and every successful
+    response adds `recovery_step` back, up to the configured rate.
+
+    Typical usage example:
+
+    limiter = RateLimiter(rate=10, burst=20, endpoint_budgets={"/v1.0/devices": (5, 10)})
+    openapi = TuyaOpenAPI(ENDPOINT, ACCESS_ID, ACCESS_KEY, rate_limiter=limiter)
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 20.0,
+        endpoint_budgets: dict[str, tuple[float, float]] | None = None,
+        rate_limit_codes: Iterable[int] = DEFAULT_RATE_LIMIT_CODES,
+        min_scale: float = 0.1,
+        recovery_step: float = 0.02,
+    ) -> None:
+        """Init RateLimiter.
+
+        Args:
+            rate (float): requests per second allowed overall
+            burst (float): requests allowed back to back after an idle period
+            endpoint_budgets (dict): {path prefix: (rate, burst)} for individual endpoints
+            rate_limit_codes (iterable): Tuya response codes that mean "too many requests"
+            min_scale (float): lowest fraction of the configured rates that backoff goes down to
+            recovery_step (float): fraction of the configured rates restored per successful response
+        """
+        self._global = TokenBucket(rate, burst)
+        self._endpoints = sorted(
+            ((prefix, TokenBucket(r, b)) for prefix, (r, b) in (endpoint_budgets or {}).items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self.rate_limit_codes = frozenset(int(code) for code in rate_limit_codes)
+        self._min_scale = min_scale
+        self._recovery_step = recovery_step
+        self._lock = threading.Lock()
+        self.scale = 1.0
+
+        self.throttled = 0
+        self.timeouts = 0
+
+    def _buckets(self, path: str) -> list[TokenBucket]:
+        for prefix, bucket in self._endpoints:
+            if path.startswith(prefix):
+                return [bucket, self._global]
+        return [self._global]
+
+    def acquire(self, path: str, priority: bool = False, timeout: float | None = None) -> bool:
+        """Wait for budget to call `path`. Returns False if `timeout` ran out first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for bucket in self._buckets(path):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not bucket.acquire(priority, remaining):
+                self.timeouts += 1
+                return False
+        return True
+
+    def is_rate_limited(self, status_code: int, code: int | None) -> bool:
+        return status_code == HTTP_TOO_MANY_REQUESTS or (code is not None and code in self.rate_limit_codes)
+
+    def record_response(self, status_code: int, code: int | None = None) -> None:
+        """Feed a response back into the adaptive throttle."""
+        with self._lock:
+            if self.is_rate_limited(status_code, code):
+                self.throttled += 1
+                scale = max(self._min_scale, self.scale / 2)
+                if scale != self.scale:
+                    logger.warning(f"Rate limited by Tuya Cloud, slowing to {scale:.0%} of the configured rate")
+            elif self.scale < 1.0:
+                scale = min(1.0, self.scale + self._recovery_step)
+            else:
+                return
+            self.scale = scale
+        for bucket in [self._global] + [bucket for _, bucket in self._endpoints]:
+            bucket.set_scale(scale)
+
+    def stats(self) -> dict[str, float]:
+        return {"scale": self.scale, "throttled": self.throttled, "timeouts": self.timeouts}